@@ -0,0 +1,473 @@
+"""Offline benchmark for ExploreChain, SQLDatabaseSequentialChain and
+ExperienceExtractorChain.
+
+Runs every chain against deterministic fake LLMs and a SQLite copy of a
+synthetic experience_raw, so performance changes can be measured without
+OpenAI or Snowflake. Reports p50/p95 latency, throughput under concurrent
+sessions, cache hit rates and where time went per stage.
+
+Usage:
+    python -m bench.Benchmark --rows 10000 --sessions 8 --requests 200 --latency 0.2
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import tempfile
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from langchain.utilities.sql_database import SQLDatabase
+from sqlalchemy import text
+
+from bench.Corpus import (
+    EVENT_DESCRIPTIONS,
+    QUESTIONS,
+    TABLE_QUESTIONS,
+    explore_responder,
+    fields_for,
+    typed_fields_for,
+)
+from bench.FakeLLM import FakeExtractionChatModel, FakeLLM
+from bench.SyntheticData import seed_database, seed_related_tables
+from chain.Instrumentation import MetricsRecorder, StageRecord, maybe_stage
+
+SCENARIOS = [
+    "explore", "explore_cached", "explore_compact", "explore_routed",
+    "sequential", "sequential_indexed", "extractor",
+    "explore_async", "extractor_async", "extractor_structured",
+    "explore_burst", "explore_coalesced",
+    # These change experience_raw, so they run last
+    "explore_upcoming", "portal_append", "portal_queued",
+]
+
+# Consecutive requests in the burst scenarios ask the same question, like a trending one
+BURST_SIZE = 8
+
+# Distinct listings the portal scenarios submit, so most requests are resubmits
+PORTAL_LISTINGS = 20
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def run_load(
+    request: Callable[[int], Any], requests: int, sessions: int
+) -> Dict[str, Any]:
+    """Call ``request(i)`` ``requests`` times from ``sessions`` threads."""
+    latencies: List[float] = []
+    errors: List[str] = []
+
+    def timed(i: int) -> None:
+        start = time.perf_counter()
+        try:
+            request(i)
+        except Exception as exc:
+            errors.append("".join(traceback.format_exception_only(type(exc), exc)).strip())
+            return
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=sessions) as executor:
+        list(executor.map(timed, range(requests)))
+    elapsed = time.perf_counter() - start
+    return {
+        "requests": requests,
+        "sessions": sessions,
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "mean_ms": statistics.fmean(latencies) * 1000 if latencies else 0.0,
+        "throughput_rps": len(latencies) / elapsed if elapsed else 0.0,
+    }
+
+
+def run_async_load(
+    request: Callable[[int], Awaitable[Any]], requests: int, sessions: int
+) -> Dict[str, Any]:
+    """Await ``request(i)`` ``requests`` times, ``sessions`` at a time, on one event loop."""
+    latencies: List[float] = []
+    errors: List[str] = []
+
+    async def timed(i: int, semaphore: asyncio.Semaphore) -> None:
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await request(i)
+            except Exception as exc:
+                errors.append("".join(traceback.format_exception_only(type(exc), exc)).strip())
+                return
+            latencies.append(time.perf_counter() - start)
+
+    async def run() -> None:
+        semaphore = asyncio.Semaphore(sessions)
+        await asyncio.gather(*(timed(i, semaphore) for i in range(requests)))
+
+    start = time.perf_counter()
+    asyncio.run(run())
+    elapsed = time.perf_counter() - start
+    return {
+        "requests": requests,
+        "sessions": sessions,
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "mean_ms": statistics.fmean(latencies) * 1000 if latencies else 0.0,
+        "throughput_rps": len(latencies) / elapsed if elapsed else 0.0,
+    }
+
+
+def hit_rate(hits: int, misses: int) -> Optional[float]:
+    return hits / (hits + misses) if hits + misses else None
+
+
+def build_scenario(
+    name: str, database: SQLDatabase, latency: float, metrics: MetricsRecorder
+) -> Tuple[Callable[[int], Any], Callable[[], Dict[str, Any]]]:
+    """Return ``(request, stats)`` callables for one scenario."""
+    from chain.ExploreChain import ExploreChain, SQLDatabaseSequentialChain
+
+    llm = FakeLLM(responder=explore_responder, latency=latency)
+
+    if name == "explore":
+        chain = ExploreChain.from_llm(llm, database, metrics=metrics)
+        return (lambda i: chain(QUESTIONS[i % len(QUESTIONS)][0])), dict
+
+    if name == "explore_cached":
+        from chain.QueryCache import QueryCache
+        from chain.SchemaCache import SchemaCache
+
+        schema_cache = SchemaCache(database)
+        query_cache = QueryCache()
+        chain = ExploreChain.from_llm(
+            llm,
+            database,
+            schema_cache=schema_cache,
+            query_cache=query_cache,
+            use_sql_validator=True,
+            max_result_rows=25,
+            max_result_tokens=1000,
+            metrics=metrics,
+        )
+
+        def stats() -> Dict[str, Any]:
+            schema, query = schema_cache.stats(), query_cache.stats()
+            return {
+                "schema_cache_hit_rate": hit_rate(schema["hits"], schema["misses"]),
+                "sql_cache_hit_rate": hit_rate(query["sql_hits"], query["sql_misses"]),
+                "answer_cache_hit_rate": hit_rate(
+                    query["answer_hits"], query["answer_misses"]
+                ),
+            }
+
+        return (lambda i: chain(QUESTIONS[i % len(QUESTIONS)][0])), stats
+
+    if name == "explore_compact":
+        from chain.SchemaDescriptor import SchemaDescriptor
+
+        chain = ExploreChain.from_llm(
+            llm,
+            database,
+            schema_descriptor=SchemaDescriptor(database._engine, table_info=database),
+            metrics=metrics,
+        )
+        return (lambda i: chain(QUESTIONS[i % len(QUESTIONS)][0])), dict
+
+    if name == "explore_routed":
+        from chain.IntentRouter import IntentRouter
+
+        router = IntentRouter(database._engine)
+        chain = ExploreChain.from_llm(llm, database, metrics=metrics)
+
+        def request(i: int) -> Any:
+            question = QUESTIONS[i % len(QUESTIONS)][0]
+            if router.route(question) is None:
+                return chain(question)
+
+        def stats() -> Dict[str, Any]:
+            return {"router_hit_rate": router.stats()["hit_rate"]}
+
+        return request, stats
+
+    if name == "sequential":
+        chain = SQLDatabaseSequentialChain.from_llm(llm, database)
+        return (lambda i: chain(QUESTIONS[i % len(QUESTIONS)][0])), dict
+
+    if name == "sequential_indexed":
+        from chain.TableIndex import TableIndex
+
+        # With experience_raw alone the index has nothing to choose between, so
+        # add its neighbours; the shared database was reflected without them
+        seed_related_tables(database._engine)
+        indexed_database = SQLDatabase(database._engine)
+        index = TableIndex(
+            indexed_database,
+            descriptions={"experience_raw": "events live music happy hours shows"},
+        )
+        chain = SQLDatabaseSequentialChain.from_llm(llm, indexed_database, table_index=index)
+
+        def stats() -> Dict[str, Any]:
+            index_stats = index.stats()
+            # Request i asked question i % len(TABLE_QUESTIONS); selection is deterministic
+            asked = [0] * len(TABLE_QUESTIONS)
+            for i in range(index_stats["selections"]):
+                asked[i % len(TABLE_QUESTIONS)] += 1
+            correct = confident = 0
+            for (question, tables), count in zip(TABLE_QUESTIONS, asked):
+                selected = index.select(question)
+                if selected is not None:
+                    confident += count
+                    correct += count * (sorted(selected) == sorted(tables))
+            return {
+                "tables": index_stats["tables"],
+                "table_index_hit_rate": hit_rate(
+                    index_stats["selections"] - index_stats["low_confidence"],
+                    index_stats["low_confidence"],
+                ),
+                "table_index_accuracy": correct / confident if confident else None,
+                "decider_fallbacks": index_stats["low_confidence"],
+            }
+
+        return (lambda i: chain(TABLE_QUESTIONS[i % len(TABLE_QUESTIONS)][0])), stats
+
+    if name in ("explore_burst", "explore_coalesced"):
+        from chain.SingleFlight import SingleFlight
+
+        chain = ExploreChain.from_llm(llm, database, metrics=metrics)
+        flight = SingleFlight()
+
+        def request(i: int) -> Any:
+            question = QUESTIONS[(i // BURST_SIZE) % len(QUESTIONS)][0]
+            if name == "explore_burst":
+                return chain(question)
+            return flight.do(question, lambda: chain(question))
+
+        def stats() -> Dict[str, Any]:
+            if name == "explore_burst":
+                return {}
+            return {"coalesce_rate": flight.stats()["coalesce_rate"]}
+
+        return request, stats
+
+    if name == "explore_upcoming":
+        from chain.UpcomingExperiences import UpcomingExperiences
+
+        upcoming = UpcomingExperiences(database._engine)
+        upcoming.refresh()
+        upcoming_llm = FakeLLM(
+            responder=lambda prompt: explore_responder(prompt).replace(
+                "experience_raw", upcoming.table_name
+            ),
+            latency=latency,
+        )
+        chain = ExploreChain.from_llm(
+            upcoming_llm,
+            SQLDatabase(database._engine, include_tables=[upcoming.table_name]),
+            metrics=metrics,
+        )
+
+        def stats() -> Dict[str, Any]:
+            # Share of experience_raw the generated SQL has to scan
+            with database._engine.connect() as conn:
+                total = conn.execute(text(f"SELECT COUNT(*) FROM {upcoming.source_table}")).scalar()
+            return {"upcoming_row_rate": hit_rate(upcoming.stats()["rows"], total - upcoming.stats()["rows"])}
+
+        return (lambda i: chain(QUESTIONS[i % len(QUESTIONS)][0])), stats
+
+    if name in ("portal_append", "portal_queued"):
+        from bench.SyntheticData import synthetic_experiences
+        from chain.LocalReplica import ensure_watermark_column, stamp_ingested_at
+        from chain.SubmissionQueue import SubmissionQueue
+        from chain.UpcomingExperiences import ensure_timestamp_columns, stamp_event_timestamps
+
+        engine = database._engine
+        ensure_watermark_column(engine)
+        ensure_timestamp_columns(engine)
+        # Different listings per scenario, so neither sees the other's rows as resubmits
+        listings = synthetic_experiences(PORTAL_LISTINGS, seed=SCENARIOS.index(name))
+        count = text("SELECT COUNT(*) FROM experience_raw")
+        with engine.connect() as conn:
+            before = conn.execute(count).scalar()
+        queue = SubmissionQueue(
+            engine,
+            on_flush=lambda df, summary: metrics.add(
+                StageRecord("flush", "portal", "flush", seconds=summary["seconds"])
+            ),
+        )
+        if name == "portal_queued":
+            queue.start(max_delay=0.2)
+
+        def request(i: int) -> Any:
+            listing = listings.iloc[[i % len(listings)]]
+            with maybe_stage(metrics, str(i), "portal", "submit"):
+                if name == "portal_queued":
+                    return queue.submit(listing)
+                stamp_event_timestamps(stamp_ingested_at(listing)).to_sql(
+                    "experience_raw", engine, if_exists="append", index=False
+                )
+
+        def stats() -> Dict[str, Any]:
+            queue.stop()
+            with engine.connect() as conn:
+                written = conn.execute(count).scalar() - before
+            unique = min(written, len(listings))
+            return {"duplicate_row_rate": hit_rate(written - unique, unique)}
+
+        return request, stats
+
+    if name == "explore_async":
+        chain = ExploreChain.from_llm(llm, database, metrics=metrics)
+        return (lambda i: chain.acall(QUESTIONS[i % len(QUESTIONS)][0])), dict
+
+    if name in ("extractor", "extractor_async", "extractor_structured"):
+        from chain.DateTimeParser import conversion_stats
+        from chain.ExperienceExtractorChain import ExperienceExtractorChain
+
+        extraction_llm = FakeExtractionChatModel(
+            extractor=fields_for, typed_extractor=typed_fields_for, latency=latency
+        )
+        before = conversion_stats.as_dict()
+
+        def extractor(i: int) -> ExperienceExtractorChain:
+            return ExperienceExtractorChain(
+                EVENT_DESCRIPTIONS[i % len(EVENT_DESCRIPTIONS)][0],
+                metrics=metrics,
+                extraction_llm=extraction_llm,
+                convert_llm=llm,
+                structured=name == "extractor_structured",
+            )
+
+        if name == "extractor_async":
+            request: Callable[[int], Any] = lambda i: extractor(i).arun()
+        else:
+            request = lambda i: extractor(i).run()
+
+        def stats() -> Dict[str, Any]:
+            local = llm_calls = 0
+            for field, counts in conversion_stats.as_dict().items():
+                # Structured output needs no conversion call, so it counts as local
+                for path, count in counts.items():
+                    calls = count - before.get(field, {}).get(path, 0)
+                    if path == "llm":
+                        llm_calls += calls
+                    else:
+                        local += calls
+            return {"conversion_local_rate": hit_rate(local, llm_calls)}
+
+        return request, stats
+
+    raise ValueError(f"Unknown scenario {name}")
+
+
+def per_request(metrics: MetricsRecorder, attribute: str, requests: int) -> Optional[float]:
+    """Mean of ``attribute`` over every request made, so requests answered
+    without running a chain (routed, coalesced) count as spending nothing."""
+    records = metrics.records()
+    if not records or not requests:
+        return None
+    return sum(getattr(record, attribute) for record in records) / requests
+
+
+def stage_means(metrics: MetricsRecorder) -> Dict[str, float]:
+    """Mean milliseconds per ``chain.stage`` across every recorded request."""
+    seconds: Dict[str, List[float]] = {}
+    for record in metrics.records():
+        seconds.setdefault(f"{record.chain}.{record.stage}", []).append(record.seconds)
+    return {stage: statistics.fmean(values) * 1000 for stage, values in seconds.items()}
+
+
+def run_benchmark(
+    scenarios: List[str],
+    rows: int = 1000,
+    sessions: int = 4,
+    requests: int = 100,
+    latency: float = 0.05,
+    seed: int = 0,
+) -> List[Dict[str, Any]]:
+    with tempfile.TemporaryDirectory() as directory:
+        engine = seed_database(os.path.join(directory, "bench.sqlite"), rows, seed)
+        database = SQLDatabase(engine)
+        results = []
+        for name in scenarios:
+            metrics = MetricsRecorder()
+            request, stats = build_scenario(name, database, latency, metrics)
+            result = {"scenario": name, "rows": rows, "llm_latency_s": latency}
+            load = run_async_load if name.endswith("_async") else run_load
+            result.update(load(request, requests, sessions))
+            result.update(stats())
+            result["prompt_tokens_per_request"] = per_request(metrics, "prompt_tokens", requests)
+            result["llm_calls_per_request"] = per_request(metrics, "llm_calls", requests)
+            result["stage_ms"] = stage_means(metrics)
+            results.append(result)
+        engine.dispose()
+    return results
+
+
+def format_results(results: List[Dict[str, Any]]) -> str:
+    lines = []
+    for result in results:
+        lines.append(
+            f"{result['scenario']:<20} p50 {result['p50_ms']:8.1f} ms  "
+            f"p95 {result['p95_ms']:8.1f} ms  "
+            f"{result['throughput_rps']:7.1f} req/s  errors {result['errors']}"
+        )
+        if result["prompt_tokens_per_request"] is not None:
+            lines.append(
+                f"    {'prompt tokens per request':<32} {result['prompt_tokens_per_request']:8.0f}"
+            )
+            lines.append(
+                f"    {'LLM calls per request':<32} {result['llm_calls_per_request']:8.2f}"
+            )
+        for key, value in result.items():
+            if key.endswith(("_rate", "_accuracy")) and value is not None:
+                lines.append(f"    {key:<32} {value:6.1%}")
+            elif key in ("tables", "decider_fallbacks"):
+                lines.append(f"    {key:<32} {value:8d}")
+        for stage, ms in result["stage_ms"].items():
+            lines.append(f"    {stage:<32} {ms:8.1f} ms")
+        if result["first_error"]:
+            lines.append(f"    first error: {result['first_error']}")
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS, help="defaults to all")
+    parser.add_argument("--rows", type=int, default=1000, help="synthetic experience_raw rows")
+    parser.add_argument("--sessions", type=int, default=4, help="concurrent sessions")
+    parser.add_argument("--requests", type=int, default=100, help="requests per scenario")
+    parser.add_argument("--latency", type=float, default=0.05, help="fake LLM latency in seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print JSON lines")
+    args = parser.parse_args(argv)
+
+    results = run_benchmark(
+        args.scenario or SCENARIOS,
+        rows=args.rows,
+        sessions=args.sessions,
+        requests=args.requests,
+        latency=args.latency,
+        seed=args.seed,
+    )
+    if args.json:
+        for result in results:
+            print(json.dumps(result))
+    else:
+        print(format_results(results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+"""Representative explorer questions and portal event descriptions.
+
+Each question carries the SQL a model would generate for it against the
+SQLite stand-in, and each description the fields the extractor would return,
+so the fake LLMs can answer deterministically. ``RELATED_QUESTIONS`` are about
+the tables next to experience_raw and also name the tables they need.
+"""
+import datetime
+import json
+import re
+from typing import Any, Dict, List, Tuple
+
+from chain.DateTimeParser import local_today, parse_date, parse_time
+
+QUESTIONS = [
+    (
+        "Where can I listen to live music tonight?",
+        "SELECT business_name, band_name, event_start_time FROM experience_raw "
+        "WHERE event_type LIKE '%music%' AND event_date = date('now')",
+    ),
+    (
+        "Are there any good happy hours this weekend?",
+        "SELECT business_name, happy_hour_deal, event_date FROM experience_raw "
+        "WHERE happy_hour_deal IS NOT NULL "
+        "AND event_date BETWEEN date('now') AND date('now', '+7 day')",
+    ),
+    (
+        "What's happening tomorrow?",
+        "SELECT business_name, event_type, event_start_time FROM experience_raw "
+        "WHERE event_date = date('now', '+1 day')",
+    ),
+    (
+        "Any free events this week?",
+        "SELECT business_name, event_type, event_date FROM experience_raw "
+        "WHERE event_price = 0 AND event_date BETWEEN date('now') AND date('now', '+7 day')",
+    ),
+    (
+        "Where is trivia tonight?",
+        "SELECT business_name, event_start_time FROM experience_raw "
+        "WHERE event_type LIKE '%trivia%' AND event_date = date('now')",
+    ),
+    (
+        "Which places have shows under $10?",
+        "SELECT business_name, event_type, event_price FROM experience_raw "
+        "WHERE event_price < 10 AND event_date >= date('now')",
+    ),
+    (
+        "Is Post Malone playing anywhere?",
+        "SELECT business_name, event_date, event_start_time FROM experience_raw "
+        "WHERE band_name LIKE '%Post Malone%' AND event_date >= date('now')",
+    ),
+    (
+        "What comedy shows are coming up?",
+        "SELECT business_name, event_date, event_price FROM experience_raw "
+        "WHERE event_type LIKE '%comedy%' AND event_date >= date('now')",
+    ),
+    (
+        "Anything going on this weekend?",
+        "SELECT business_name, event_type, event_date FROM experience_raw "
+        "WHERE event_date BETWEEN date('now') AND date('now', '+7 day')",
+    ),
+]
+
+RELATED_QUESTIONS = [
+    (
+        "Which neighborhood is Blueberry Hill in?",
+        "SELECT neighborhood FROM venues WHERE business_name = 'Blueberry Hill'",
+        ["venues"],
+    ),
+    (
+        "What's the phone number for The Pageant?",
+        "SELECT phone_number FROM venues WHERE business_name = 'The Pageant'",
+        ["venues"],
+    ),
+    (
+        "What genre does Kingdom Brass play?",
+        "SELECT genre FROM bands WHERE band_name = 'Kingdom Brass'",
+        ["bands"],
+    ),
+    (
+        "How many tickets were sold last month?",
+        "SELECT SUM(quantity) FROM ticket_sales "
+        "WHERE purchased_at >= date('now', 'start of month', '-1 month') "
+        "AND purchased_at < date('now', 'start of month')",
+        ["ticket_sales"],
+    ),
+    (
+        "How many portal users signed up this year?",
+        "SELECT COUNT(*) FROM portal_users WHERE signup_date >= date('now', 'start of year')",
+        ["portal_users"],
+    ),
+    (
+        "Which venues in Soulard sold the most tickets?",
+        "SELECT v.business_name, SUM(t.quantity) AS tickets FROM venues v "
+        "JOIN ticket_sales t ON t.business_name = v.business_name "
+        "WHERE v.neighborhood = 'Soulard' GROUP BY v.business_name ORDER BY tickets DESC",
+        ["venues", "ticket_sales"],
+    ),
+]
+
+# The tables each question needs, for scoring table selection
+TABLE_QUESTIONS: List[Tuple[str, List[str]]] = [
+    (question, ["experience_raw"]) for question, _ in QUESTIONS
+] + [(question, tables) for question, _, tables in RELATED_QUESTIONS]
+
+FALLBACK_SQL = (
+    "SELECT business_name, event_type, event_date FROM experience_raw "
+    "WHERE event_date >= date('now')"
+)
+
+EVENT_DESCRIPTIONS = [
+    (
+        "Post Malone is playing tonight at The Broadway Oyster Bar. Show is from 7PM to 10PM. "
+        "There is a $10 cover. Deals are 1/2 Well Drinks and apps",
+        {
+            "business_name": "The Broadway Oyster Bar",
+            "event_type": "live music",
+            "event_price": 10,
+            "event_date": "tonight",
+            "event_start_time": "7PM",
+            "event_end_time": "10PM",
+            "band_name": "Post Malone",
+            "happy_hour_deal": "1/2 Well Drinks and apps",
+        },
+    ),
+    (
+        "Trivia night at Molly's in Soulard this Thursday, 8pm to 10:30pm. Free to play.",
+        {
+            "business_name": "Molly's in Soulard",
+            "event_type": "trivia",
+            "event_price": 0,
+            "event_date": "this Thursday",
+            "event_start_time": "8pm",
+            "event_end_time": "10:30pm",
+        },
+    ),
+    (
+        "Happy hour at Sauce on the Side tomorrow from 3 to 6, $2 off all drafts",
+        {
+            "business_name": "Sauce on the Side",
+            "event_type": "happy hour",
+            "event_date": "tomorrow",
+            "event_start_time": "3 in the afternoon",
+            "event_end_time": "6 in the evening",
+            "happy_hour_deal": "$2 off all drafts",
+        },
+    ),
+    (
+        "Comedy showcase at The Improv Shop on 9/14 at 7:30 PM, tickets $15",
+        {
+            "business_name": "The Improv Shop",
+            "event_type": "comedy",
+            "event_price": 15,
+            "event_date": "9/14",
+            "event_start_time": "7:30 PM",
+        },
+    ),
+    (
+        "The Funky Butt Brass Band plays Off Broadway Saturday night starting at 9pm, $20 at the door",
+        {
+            "business_name": "Off Broadway",
+            "event_type": "live music",
+            "event_price": 20,
+            "event_date": "Saturday",
+            "event_start_time": "9pm",
+            "band_name": "The Funky Butt Brass Band",
+        },
+    ),
+    (
+        "Jazz brunch at Evangeline's sometime next weekend around noon",
+        {
+            "business_name": "Evangeline's",
+            "event_type": "live music",
+            "event_date": "sometime next weekend",
+            "event_start_time": "noon",
+        },
+    ),
+]
+
+
+def _normalize(text: str) -> str:
+    return " ".join(re.sub(r"[^\w\s$]", " ", text.lower()).split())
+
+
+def sql_for(prompt: str) -> str:
+    """The canned SQL for the corpus question in ``prompt``."""
+    prompt = _normalize(prompt)
+    questions = QUESTIONS + [(question, sql) for question, sql, _ in RELATED_QUESTIONS]
+    for question, sql in sorted(questions, key=lambda q: -len(q[0])):
+        if _normalize(question) in prompt:
+            return sql
+    return FALLBACK_SQL
+
+
+def tables_for(prompt: str) -> List[str]:
+    """The tables the corpus question in ``prompt`` needs."""
+    prompt = _normalize(prompt)
+    for question, tables in sorted(TABLE_QUESTIONS, key=lambda q: -len(q[0])):
+        if _normalize(question) in prompt:
+            return tables
+    return ["experience_raw"]
+
+
+def fields_for(passage: str) -> Dict[str, Any]:
+    """The canned extraction for the corpus description ``passage``."""
+    passage = _normalize(passage)
+    for description, fields in EVENT_DESCRIPTIONS:
+        if _normalize(description) == passage:
+            return dict(fields)
+    return {"business_name": "Unknown", "event_type": "event", "event_date": "today"}
+
+
+def typed_fields_for(passage: str) -> Dict[str, Any]:
+    """``fields_for`` with dates and times resolved, as structured output returns them."""
+    fields = fields_for(passage)
+    today = local_today()
+    date = parse_date(fields["event_date"], today=today) or {"year": 2023, "month": 8, "day": 4}
+    fields["event_date"] = datetime.date(**date).isoformat()
+    for field in ("event_start_time", "event_end_time"):
+        if field in fields:
+            fields[field] = parse_time(fields[field]) or {"hour": 20, "minute": 0}
+    return fields
+
+
+def explore_responder(prompt: str) -> str:
+    """Answer SQL generation, decider, answer and date/time conversion prompts."""
+    stripped = prompt.rstrip()
+    if stripped.endswith("SQLQuery:"):
+        return " " + sql_for(prompt)
+    if stripped.endswith("Relevant Table Names:"):
+        return " " + ", ".join(tables_for(prompt))
+    if stripped.endswith("Answer:"):
+        result = stripped.rsplit("SQLResult:", 1)[-1].rsplit("Answer:", 1)[0]
+        rows = max(0, result.strip().count("\n"))
+        return f" We found {rows or 'a few'} options that look like a great fit!"
+    if '"year"' in prompt:
+        return json.dumps({"year": 2023, "month": 8, "day": 4})
+    if '"hour"' in prompt:
+        return json.dumps({"hour": 20, "minute": 0})
+    return " I'm not sure."
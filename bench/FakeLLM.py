@@ -0,0 +1,105 @@
+"""Deterministic stand-ins for the OpenAI models, with configurable latency."""
+from __future__ import annotations
+
+import asyncio
+import json
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from langchain.callbacks.manager import (
+    AsyncCallbackManagerForLLMRun,
+    CallbackManagerForLLMRun,
+)
+from langchain.chat_models.base import BaseChatModel
+from langchain.llms.base import LLM
+from langchain.schema import AIMessage, BaseMessage, ChatGeneration, ChatResult
+
+
+class FakeLLM(LLM):
+    """Completion model that answers with ``responder(prompt)`` after ``latency`` seconds."""
+
+    responder: Callable[[str], str]
+    latency: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake"
+
+    def _call(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> str:
+        if self.latency:
+            time.sleep(self.latency)
+        return self.responder(prompt)
+
+    async def _acall(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> str:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self.responder(prompt)
+
+
+class FakeExtractionChatModel(BaseChatModel):
+    """Chat model that answers ``create_extraction_chain``'s function call.
+
+    ``extractor(text)`` returns the dict of fields for the passage. When
+    ``typed_extractor`` is set, ``create_structured_output_chain``'s call is
+    answered with ``typed_extractor(text)`` as well.
+    """
+
+    extractor: Callable[[str], Dict[str, Any]]
+    typed_extractor: Optional[Callable[[str], Dict[str, Any]]] = None
+    latency: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        if self.latency:
+            time.sleep(self.latency)
+        return self._respond(messages, kwargs.get("functions") or [])
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._respond(messages, kwargs.get("functions") or [])
+
+    def _respond(
+        self, messages: List[BaseMessage], functions: List[Dict[str, Any]]
+    ) -> ChatResult:
+        passage = messages[-1].content.rsplit("Passage:", 1)[-1].strip()
+        names = [function["name"] for function in functions]
+        if self.typed_extractor is not None and "_OutputFormatter" in names:
+            function_call = {
+                "name": "_OutputFormatter",
+                "arguments": json.dumps({"output": self.typed_extractor(passage)}),
+            }
+        else:
+            function_call = {
+                "name": "information_extraction",
+                "arguments": json.dumps({"info": [self.extractor(passage)]}),
+            }
+        message = AIMessage(content="", additional_kwargs={"function_call": function_call})
+        return ChatResult(generations=[ChatGeneration(message=message)])
@@ -0,0 +1,158 @@
+"""Cold-start import time of the app and the chain modules.
+
+Imports each target in a fresh interpreter with ``python -X importtime`` and
+reports the best of ``--repeat`` runs, the heaviest packages it pulled in and
+whether langchain was among them. The ``main`` target runs just the
+module-level imports of main.py, which is what the first page render pays
+before any question is asked. ``--max-seconds`` makes the run fail when a
+target gets slower than that, so it can gate CI.
+
+Usage:
+    python -m bench.ImportProfile --repeat 3
+    python -m bench.ImportProfile --target main --max-seconds 1.5
+"""
+from __future__ import annotations
+
+import argparse
+import ast
+import json
+import os
+import subprocess
+import sys
+from typing import Any, Dict, List, Optional, Set
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TARGETS = [
+    "main",
+    "chain.Instrumentation",
+    "chain.QueryCache",
+    "chain.SchemaCache",
+    "chain.SchemaDescriptor",
+    "chain.LocalReplica",
+    "chain.UpcomingExperiences",
+    "chain.SubmissionQueue",
+    "chain.IntentRouter",
+    "chain.SingleFlight",
+    "chain.SnowflakeEngine",
+    "chain.ExploreChain",
+    "chain.ExperienceExtractorChain",
+]
+
+
+def main_imports(path: str = os.path.join(ROOT, "main.py")) -> str:
+    """The module-level import statements of main.py, as code."""
+    with open(path) as f:
+        tree = ast.parse(f.read())
+    return "\n".join(
+        ast.unparse(node)
+        for node in tree.body
+        if isinstance(node, (ast.Import, ast.ImportFrom))
+    )
+
+
+def parse_importtime(stderr: str) -> List[Dict[str, Any]]:
+    """``-X importtime`` lines as dicts of microseconds and nesting depth."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line.split(":", 1)[1].split("|")
+        rows.append(
+            {
+                "module": name.strip(),
+                "depth": (len(name) - len(name.lstrip())) // 2,
+                "self_us": int(self_us),
+                "cumulative_us": int(cumulative_us),
+            }
+        )
+    return rows
+
+
+def _importtime(code: str) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+    )
+
+
+def startup_modules() -> Set[str]:
+    """Modules every interpreter imports before running any code."""
+    return {row["module"] for row in parse_importtime(_importtime("pass").stderr)}
+
+
+def profile(target: str, startup: Set[str]) -> Dict[str, Any]:
+    """Import ``target`` once in a fresh interpreter."""
+    code = main_imports() if target == "main" else f"import {target}"
+    completed = _importtime(code)
+    rows = [row for row in parse_importtime(completed.stderr) if row["module"] not in startup]
+    # Direct imports of the target, or of main.py, are the ones worth chasing
+    depth = 0 if target == "main" else 1
+    children = [
+        row for row in rows if row["depth"] == depth and row["module"] != target
+    ]
+    return {
+        "target": target,
+        "seconds": sum(row["cumulative_us"] for row in rows if row["depth"] == 0) / 1e6,
+        "modules": len(rows),
+        "langchain": any(row["module"] == "langchain" for row in rows),
+        "heaviest": [
+            (row["module"], row["cumulative_us"] / 1e6)
+            for row in sorted(children, key=lambda row: -row["cumulative_us"])[:5]
+        ],
+        "error": completed.stderr.strip().splitlines()[-1] if completed.returncode else None,
+    }
+
+
+def run_profile(targets: List[str], repeat: int = 3) -> List[Dict[str, Any]]:
+    startup = startup_modules()
+    results = []
+    for target in targets:
+        runs = [profile(target, startup) for _ in range(repeat)]
+        results.append(min(runs, key=lambda run: run["seconds"]))
+    return results
+
+
+def format_results(results: List[Dict[str, Any]]) -> str:
+    lines = []
+    for result in results:
+        lines.append(
+            f"{result['target']:<32} {result['seconds']:6.2f} s  "
+            f"{result['modules']:5d} modules  langchain {'yes' if result['langchain'] else 'no'}"
+        )
+        for module, seconds in result["heaviest"]:
+            lines.append(f"    {module:<28} {seconds:6.2f} s")
+        if result["error"]:
+            lines.append(f"    error: {result['error']}")
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--target", action="append", choices=TARGETS, help="defaults to all"
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="runs per target, best is kept")
+    parser.add_argument("--max-seconds", type=float, help="fail if any target is slower")
+    parser.add_argument("--json", action="store_true", help="print JSON lines")
+    args = parser.parse_args(argv)
+
+    results = run_profile(args.target or TARGETS, args.repeat)
+    if args.json:
+        for result in results:
+            print(json.dumps(result))
+    else:
+        print(format_results(results))
+    slow = [
+        result["target"]
+        for result in results
+        if args.max_seconds is not None and result["seconds"] > args.max_seconds
+    ]
+    if slow or any(result["error"] for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Synthetic experience_raw and related tables in SQLite, standing in for Snowflake."""
+from __future__ import annotations
+
+import datetime
+import random
+from typing import Dict, List, Optional
+
+import pandas as pd
+from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import StaticPool
+
+BUSINESSES = [
+    "The Broadway Oyster Bar", "Molly's in Soulard", "Sauce on the Side",
+    "The Improv Shop", "Off Broadway", "Evangeline's", "Blueberry Hill",
+    "The Pageant", "Venice Cafe", "Hammerstone's", "Llywelyn's Pub",
+    "The Dubliner", "Cafe Natasha", "Yaquis on Cherokee", "The Royale",
+]
+EVENT_TYPES = ["live music", "happy hour", "trivia", "comedy", "karaoke", "open mic", "dj night"]
+BANDS = [
+    "Post Malone", "The Funky Butt Brass Band", "Kingdom Brass", "Aaron Kamm",
+    "Miss Jubilee", "The Mighty Pines", "Jake's Leg", "Dogtown Allstars",
+]
+DEALS = ["$2 off drafts", "1/2 Well Drinks and apps", "$5 margaritas", "BOGO wings", None]
+
+
+def synthetic_experiences(
+    rows: int, seed: int = 0, today: Optional[datetime.date] = None
+) -> pd.DataFrame:
+    """``rows`` experiences spread over the 60 days before and 30 days after today."""
+    rng = random.Random(seed)
+    today = today or datetime.date.today()
+    records = []
+    for _ in range(rows):
+        event_type = rng.choice(EVENT_TYPES)
+        start_hour = rng.randint(11, 22)
+        records.append(
+            {
+                "business_name": rng.choice(BUSINESSES),
+                "event_type": event_type,
+                "event_price": rng.choice([0, 0, 5, 10, 15, 20, 25]),
+                "event_date": today + datetime.timedelta(days=rng.randint(-60, 30)),
+                "event_start_time": datetime.time(start_hour, rng.choice([0, 30])),
+                "event_end_time": datetime.time(min(start_hour + rng.randint(1, 3), 23), 0),
+                "band_name": rng.choice(BANDS) if event_type == "live music" else None,
+                "happy_hour_deal": rng.choice(DEALS) if event_type == "happy hour" else None,
+            }
+        )
+    return pd.DataFrame(records)
+
+
+def seed_database(path: str = ":memory:", rows: int = 1000, seed: int = 0) -> Engine:
+    """Create a SQLite database at ``path`` holding a synthetic experience_raw."""
+    # An in-memory database only exists on its one connection, so share it
+    engine = create_engine(
+        f"sqlite:///{path}",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool if path == ":memory:" else None,
+    )
+    synthetic_experiences(rows, seed).to_sql(
+        "experience_raw", engine, if_exists="replace", index=False, chunksize=1000
+    )
+    return engine
+
+
+def related_tables(seed: int = 0) -> Dict[str, pd.DataFrame]:
+    """Small tables that sit next to experience_raw in the warehouse."""
+    rng = random.Random(seed)
+    neighborhoods = ["Soulard", "The Grove", "Central West End", "Downtown", "The Loop"]
+    genres = ["jazz", "blues", "brass", "rock", "bluegrass"]
+    return {
+        "venues": pd.DataFrame(
+            {
+                "business_name": BUSINESSES,
+                "neighborhood": [rng.choice(neighborhoods) for _ in BUSINESSES],
+                "street_address": [f"{rng.randint(100, 9999)} Main St" for _ in BUSINESSES],
+                "phone_number": [f"314-555-{rng.randint(1000, 9999)}" for _ in BUSINESSES],
+                "capacity": [rng.choice([50, 100, 250, 800]) for _ in BUSINESSES],
+            }
+        ),
+        "bands": pd.DataFrame(
+            {
+                "band_name": BANDS,
+                "genre": [rng.choice(genres) for _ in BANDS],
+                "hometown": [rng.choice(["St. Louis", "Chicago", "Memphis"]) for _ in BANDS],
+            }
+        ),
+        "ticket_sales": pd.DataFrame(
+            {
+                "order_id": range(200),
+                "business_name": [rng.choice(BUSINESSES) for _ in range(200)],
+                "quantity": [rng.randint(1, 6) for _ in range(200)],
+                "amount_paid": [rng.choice([10, 15, 20, 25]) for _ in range(200)],
+                "purchased_at": [
+                    datetime.datetime(2026, 1, 1) + datetime.timedelta(hours=rng.randint(0, 6000))
+                    for _ in range(200)
+                ],
+            }
+        ),
+        "portal_users": pd.DataFrame(
+            {
+                "user_id": range(50),
+                "email": [f"owner{i}@example.com" for i in range(50)],
+                "business_name": [rng.choice(BUSINESSES) for _ in range(50)],
+                "signup_date": [
+                    datetime.date(2025, 1, 1) + datetime.timedelta(days=rng.randint(0, 600))
+                    for _ in range(50)
+                ],
+            }
+        ),
+    }
+
+
+def seed_related_tables(engine: Engine, seed: int = 0) -> List[str]:
+    """Add ``related_tables`` to the database behind ``engine``. Returns their names."""
+    tables = related_tables(seed)
+    for name, df in tables.items():
+        df.to_sql(name, engine, if_exists="replace", index=False)
+    return list(tables)
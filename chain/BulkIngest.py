@@ -0,0 +1,305 @@
+"""Bulk ingestion of event descriptions into experience_raw.
+
+Reads a CSV or JSONL file of free-text event descriptions, runs
+ExperienceExtractorChain on them concurrently under a rate limit, and loads
+the extracted rows into Snowflake in large staged batches. Progress is
+checkpointed per record so an interrupted run can be resumed, and records that
+fail extraction are written to an errors file instead of stopping the run.
+
+Usage:
+    python -m chain.BulkIngest listings.csv --workers 8 --rate-limit 120
+"""
+from __future__ import annotations
+
+import argparse
+import csv
+import hashlib
+import json
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set
+
+import pandas as pd
+from sqlalchemy.engine import Engine
+
+from chain.LocalReplica import ensure_watermark_column, stamp_ingested_at
+from chain.UpcomingExperiences import ensure_timestamp_columns, stamp_event_timestamps
+
+DESCRIPTION_FIELDS = ("description", "text", "input")
+
+
+def record_id(description: str) -> str:
+    """Stable id for records that don't carry one, so resumes skip the same rows."""
+    return hashlib.sha1(description.strip().encode("utf-8")).hexdigest()[:16]
+
+
+def read_records(path: str) -> Iterator[Dict[str, str]]:
+    """Yield ``{"id", "description"}`` records from a CSV or JSONL file.
+
+    The description is taken from the first of ``description``, ``text`` or
+    ``input`` that is present. An ``id`` column is used if there is one.
+    """
+    def to_record(raw: Dict[str, Any]) -> Optional[Dict[str, str]]:
+        description = next(
+            (raw[field] for field in DESCRIPTION_FIELDS if raw.get(field)), None
+        )
+        if not description:
+            return None
+        return {
+            "id": str(raw.get("id") or record_id(description)),
+            "description": str(description),
+        }
+
+    with open(path, newline="") as f:
+        if path.endswith((".jsonl", ".ndjson")):
+            rows: Iterator[Dict[str, Any]] = (json.loads(line) for line in f if line.strip())
+        else:
+            rows = csv.DictReader(f)
+        for raw in rows:
+            record = to_record(raw)
+            if record is not None:
+                yield record
+
+
+class RateLimiter:
+    """Thread-safe limiter that spaces calls evenly at ``per_minute`` per minute."""
+
+    def __init__(self, per_minute: Optional[float]):
+        self.interval = 60.0 / per_minute if per_minute else 0.0
+        self._next_slot = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class Checkpoint:
+    """Append-only JSONL log of finished record ids."""
+
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def load(self, include_errors: bool = False) -> Set[str]:
+        """Ids that don't need to be processed again."""
+        done: Set[str] = set()
+        if not self.path or not os.path.exists(self.path):
+            return done
+        with open(self.path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                if entry["status"] == "loaded" or include_errors:
+                    done.add(entry["id"])
+        return done
+
+    def mark(self, ids: List[str], status: str) -> None:
+        if not self.path or not ids:
+            return
+        with self._lock, open(self.path, "a") as f:
+            for id_ in ids:
+                f.write(json.dumps({"id": id_, "status": status}) + "\n")
+
+
+def extract_row(description: str) -> Dict[str, Any]:
+    """Run the extractor on one description and return an experience_raw row."""
+    from chain.ExperienceExtractorChain import ExperienceExtractorChain, to_experience_row
+
+    return to_experience_row(*ExperienceExtractorChain(user_input=description).run())
+
+
+def bulk_load(df: pd.DataFrame, engine: Engine, table_name: str = "experience_raw") -> int:
+    """Load a batch of rows, staged with COPY INTO on Snowflake.
+
+    ``write_pandas`` writes the frame to parquet, PUTs it to the table stage and
+    runs a single COPY INTO, which is far cheaper than row INSERTs. Other
+    databases fall back to a multi-row ``to_sql``.
+    """
+    if engine.dialect.name == "snowflake":
+        from snowflake.connector.pandas_tools import write_pandas
+
+        raw_connection = engine.raw_connection()
+        try:
+            connection = (
+                getattr(raw_connection, "dbapi_connection", None)
+                or raw_connection.connection
+            )
+            # use_logical_type keeps naive timestamps like ingested_at intact
+            success, _, nrows, _ = write_pandas(
+                connection,
+                df,
+                table_name=table_name,
+                quote_identifiers=False,
+                use_logical_type=True,
+            )
+        finally:
+            raw_connection.close()
+        if not success:
+            raise RuntimeError(f"COPY INTO {table_name} failed")
+        return nrows
+    df.to_sql(table_name, con=engine, if_exists="append", index=False, method="multi")
+    return len(df)
+
+
+class BulkIngestPipeline:
+    """Concurrent extraction with batched loads, checkpoints and error capture.
+
+    Example:
+        .. code-block:: python
+
+            pipeline = BulkIngestPipeline(engine, workers=8, rate_limit=120)
+            summary = pipeline.run(read_records("listings.jsonl"))
+    """
+
+    def __init__(
+        self,
+        engine: Engine,
+        table_name: str = "experience_raw",
+        workers: int = 4,
+        rate_limit: Optional[float] = 60,
+        batch_size: int = 500,
+        checkpoint_path: Optional[str] = None,
+        errors_path: Optional[str] = None,
+        retry_errors: bool = False,
+        extract: Callable[[str], Dict[str, Any]] = extract_row,
+        on_load: Optional[Callable[[pd.DataFrame], None]] = None,
+    ):
+        self.engine = engine
+        self.table_name = table_name
+        self.workers = workers
+        self.rate_limiter = RateLimiter(rate_limit)
+        self.batch_size = batch_size
+        self.checkpoint = Checkpoint(checkpoint_path)
+        self.errors_path = errors_path
+        self.retry_errors = retry_errors
+        self.extract = extract
+        self.on_load = on_load
+        self._errors_lock = threading.Lock()
+
+    def _extract(self, record: Dict[str, str]) -> Dict[str, Any]:
+        self.rate_limiter.acquire()
+        return self.extract(record["description"])
+
+    def _record_error(self, record: Dict[str, str], exc: BaseException) -> None:
+        if self.errors_path:
+            entry = {
+                "id": record["id"],
+                "description": record["description"],
+                "error": f"{type(exc).__name__}: {exc}",
+                "traceback": "".join(
+                    traceback.format_exception(type(exc), exc, exc.__traceback__)
+                ),
+            }
+            with self._errors_lock, open(self.errors_path, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+        self.checkpoint.mark([record["id"]], "error")
+
+    def _flush(self, rows: List[Dict[str, Any]], ids: List[str]) -> int:
+        if not rows:
+            return 0
+        df = stamp_event_timestamps(stamp_ingested_at(pd.DataFrame(rows)))
+        loaded = bulk_load(df, self.engine, self.table_name)
+        self.checkpoint.mark(ids, "loaded")
+        if self.on_load is not None:
+            self.on_load(df)
+        return loaded
+
+    def run(self, records: Iterator[Dict[str, str]]) -> Dict[str, Any]:
+        """Process every record not already in the checkpoint. Returns a summary."""
+        done = self.checkpoint.load(include_errors=not self.retry_errors)
+        ensure_watermark_column(self.engine, self.table_name)
+        ensure_timestamp_columns(self.engine, self.table_name)
+        summary = {"skipped": 0, "extracted": 0, "errors": 0, "loaded": 0, "batches": 0}
+        start = time.perf_counter()
+        rows: List[Dict[str, Any]] = []
+        ids: List[str] = []
+        pending: Dict[Future, Dict[str, str]] = {}
+
+        def collect(finished: Set[Future]) -> None:
+            for future in finished:
+                record = pending.pop(future)
+                exc = future.exception()
+                if exc is not None:
+                    summary["errors"] += 1
+                    self._record_error(record, exc)
+                else:
+                    summary["extracted"] += 1
+                    rows.append(future.result())
+                    ids.append(record["id"])
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for record in records:
+                if record["id"] in done:
+                    summary["skipped"] += 1
+                    continue
+                done.add(record["id"])
+                pending[executor.submit(self._extract, record)] = record
+                # Keep a bounded number of records in flight
+                if len(pending) >= self.workers * 2:
+                    finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(finished)
+                if len(rows) >= self.batch_size:
+                    summary["loaded"] += self._flush(rows, ids)
+                    summary["batches"] += 1
+                    rows, ids = [], []
+            finished, _ = wait(pending)
+            collect(finished)
+
+        if rows:
+            summary["loaded"] += self._flush(rows, ids)
+            summary["batches"] += 1
+        summary["seconds"] = time.perf_counter() - start
+        return summary
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    import streamlit as st
+
+    from chain.SnowflakeEngine import connection_string_from_secrets, get_engine
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path", help="CSV or JSONL file of event descriptions")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--rate-limit", type=float, default=60, help="records per minute, 0 for none")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--table", default="experience_raw")
+    parser.add_argument("--checkpoint", help="defaults to <path>.checkpoint.jsonl")
+    parser.add_argument("--errors", help="defaults to <path>.errors.jsonl")
+    parser.add_argument("--retry-errors", action="store_true", help="retry records that failed on a previous run")
+    parser.add_argument("--query-cache-path", help="SQLite query cache to invalidate after loading")
+    args = parser.parse_args(argv)
+
+    on_load = None
+    if args.query_cache_path:
+        from chain.QueryCache import QueryCache, SQLiteCacheBackend
+
+        query_cache = QueryCache(SQLiteCacheBackend(args.query_cache_path))
+        on_load = lambda df: query_cache.invalidate()  # noqa: E731
+
+    pipeline = BulkIngestPipeline(
+        get_engine(connection_string_from_secrets(st.secrets)),
+        table_name=args.table,
+        workers=args.workers,
+        rate_limit=args.rate_limit or None,
+        batch_size=args.batch_size,
+        checkpoint_path=args.checkpoint or f"{args.path}.checkpoint.jsonl",
+        errors_path=args.errors or f"{args.path}.errors.jsonl",
+        retry_errors=args.retry_errors,
+        on_load=on_load,
+    )
+    print(json.dumps(pipeline.run(read_records(args.path))))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+"""Rule-based parsing of the event dates and times people type into the portal.
+
+Handles the common cases ("tonight", "this friday", "8/12", "Aug 12th",
+"7PM", "10:30 pm", "noon") locally so ExperienceExtractorChain only needs an
+LLM completion for the odd ones. Anything ambiguous returns None.
+"""
+from __future__ import annotations
+
+import datetime
+import re
+import threading
+from typing import Dict, Optional
+from zoneinfo import ZoneInfo
+
+DEFAULT_TIMEZONE = "America/Chicago"
+
+WEEKDAYS = {
+    "monday": 0, "mon": 0,
+    "tuesday": 1, "tue": 1, "tues": 1,
+    "wednesday": 2, "wed": 2,
+    "thursday": 3, "thu": 3, "thur": 3, "thurs": 3,
+    "friday": 4, "fri": 4,
+    "saturday": 5, "sat": 5,
+    "sunday": 6, "sun": 6,
+}
+
+MONTHS = {
+    "january": 1, "jan": 1,
+    "february": 2, "feb": 2,
+    "march": 3, "mar": 3,
+    "april": 4, "apr": 4,
+    "may": 5,
+    "june": 6, "jun": 6,
+    "july": 7, "jul": 7,
+    "august": 8, "aug": 8,
+    "september": 9, "sep": 9, "sept": 9,
+    "october": 10, "oct": 10,
+    "november": 11, "nov": 11,
+    "december": 12, "dec": 12,
+}
+
+SAME_DAY_WORDS = ("today", "tonight", "this evening", "this afternoon", "this morning", "tonite")
+
+# A date without a year that is further in the past than this is taken to mean next year
+YEAR_ROLLOVER_DAYS = 60
+
+_MONTH_RE = "|".join(sorted(MONTHS, key=len, reverse=True))
+_WEEKDAY_RE = "|".join(sorted(WEEKDAYS, key=len, reverse=True))
+
+_ISO_DATE = re.compile(r"\b(\d{4})-(\d{1,2})-(\d{1,2})\b")
+_NUMERIC_DATE = re.compile(r"\b(\d{1,2})[/-](\d{1,2})(?:[/-](\d{2}|\d{4}))?\b")
+_MONTH_DAY = re.compile(
+    rf"\b({_MONTH_RE})\.?\s+(\d{{1,2}})(?:st|nd|rd|th)?(?:,?\s+(\d{{4}}))?\b"
+)
+_DAY_MONTH = re.compile(
+    rf"\b(\d{{1,2}})(?:st|nd|rd|th)?\s+(?:of\s+)?({_MONTH_RE})\.?(?:,?\s+(\d{{4}}))?\b"
+)
+_WEEKDAY = re.compile(rf"\b(next\s+|this\s+|coming\s+)?({_WEEKDAY_RE})\.?\b")
+_IN_DAYS = re.compile(r"\bin\s+(\d{1,2})\s+days?\b|\b(\d{1,2})\s+days?\s+from\s+(?:now|today)\b")
+
+_TIME_MERIDIEM = re.compile(
+    r"\b(\d{1,2})(?::(\d{2}))?\s*([ap])\.?\s*m?\.?(?![a-z])"
+)
+_TIME_24H = re.compile(r"\b(\d{1,2}):(\d{2})\b")
+
+
+def local_today(timezone: str = DEFAULT_TIMEZONE) -> datetime.date:
+    """Today's date in ``timezone``, which is what "tonight" means to the venue."""
+    return datetime.datetime.now(ZoneInfo(timezone)).date()
+
+
+def local_now(timezone: str = DEFAULT_TIMEZONE) -> datetime.datetime:
+    """The wall-clock time in ``timezone``, naive like the event timestamps."""
+    return datetime.datetime.now(ZoneInfo(timezone)).replace(tzinfo=None, microsecond=0)
+
+
+def _as_dict(date: datetime.date) -> Dict[str, int]:
+    return {"year": date.year, "month": date.month, "day": date.day}
+
+
+def _build_date(
+    year: Optional[int], month: int, day: int, today: datetime.date
+) -> Optional[datetime.date]:
+    if year is not None and year < 100:
+        year += 2000
+    try:
+        date = datetime.date(year or today.year, month, day)
+    except ValueError:
+        return None
+    if year is None and (today - date).days > YEAR_ROLLOVER_DAYS:
+        try:
+            date = date.replace(year=date.year + 1)
+        except ValueError:
+            return None
+    return date
+
+
+def parse_date(
+    text: str, today: Optional[datetime.date] = None
+) -> Optional[Dict[str, int]]:
+    """Parse a date into ``{"year", "month", "day"}`` relative to ``today``.
+
+    Returns None when the text doesn't match any known pattern.
+    """
+    if not text:
+        return None
+    today = today or local_today()
+    text = text.strip().lower()
+
+    match = _ISO_DATE.search(text)
+    if match:
+        date = _build_date(int(match[1]), int(match[2]), int(match[3]), today)
+        return _as_dict(date) if date else None
+
+    match = _MONTH_DAY.search(text)
+    if match:
+        year = int(match[3]) if match[3] else None
+        date = _build_date(year, MONTHS[match[1]], int(match[2]), today)
+        return _as_dict(date) if date else None
+
+    match = _DAY_MONTH.search(text)
+    if match:
+        year = int(match[3]) if match[3] else None
+        date = _build_date(year, MONTHS[match[2]], int(match[1]), today)
+        return _as_dict(date) if date else None
+
+    match = _NUMERIC_DATE.search(text)
+    if match:
+        year = int(match[3]) if match[3] else None
+        date = _build_date(year, int(match[1]), int(match[2]), today)
+        return _as_dict(date) if date else None
+
+    if any(word in text for word in SAME_DAY_WORDS):
+        return _as_dict(today)
+
+    if re.search(r"\b(tomorrow|tmrw|tmr)\b", text):
+        return _as_dict(today + datetime.timedelta(days=1))
+
+    match = _IN_DAYS.search(text)
+    if match:
+        days = int(match[1] or match[2])
+        return _as_dict(today + datetime.timedelta(days=days))
+
+    if re.search(r"\b(this\s+)?weekend\b", text):
+        days_ahead = max(0, 5 - today.weekday())
+        return _as_dict(today + datetime.timedelta(days=days_ahead))
+
+    match = _WEEKDAY.search(text)
+    if match:
+        days_ahead = (WEEKDAYS[match[2]] - today.weekday()) % 7
+        if match[1] and match[1].strip() == "next" and days_ahead == 0:
+            days_ahead = 7
+        return _as_dict(today + datetime.timedelta(days=days_ahead))
+
+    return None
+
+
+def parse_time(text: str) -> Optional[Dict[str, int]]:
+    """Parse a time into ``{"hour", "minute"}`` on a 24 hour clock.
+
+    Returns None for unknown formats, bare hours without am/pm, and ranges
+    such as "7-10pm" where it isn't clear which end was meant.
+    """
+    if not text:
+        return None
+    text = text.strip().lower()
+
+    if re.fullmatch(r"(12\s*)?noon|midday", text):
+        return {"hour": 12, "minute": 0}
+    if re.fullmatch(r"(12\s*)?midnight", text):
+        return {"hour": 0, "minute": 0}
+
+    matches = _TIME_MERIDIEM.findall(text)
+    if len(matches) == 1 and not re.search(r"\d\s*(-|to|until|till)\s*\d", text):
+        hour, minute, meridiem = int(matches[0][0]), int(matches[0][1] or 0), matches[0][2]
+        if not 1 <= hour <= 12 or minute > 59:
+            return None
+        hour %= 12
+        if meridiem == "p":
+            hour += 12
+        return {"hour": hour, "minute": minute}
+    if matches:
+        return None
+
+    matches = _TIME_24H.findall(text)
+    if len(matches) == 1:
+        hour, minute = int(matches[0][0]), int(matches[0][1])
+        # "7:30" with no am/pm could be either; only trust unambiguous 24 hour times
+        if (hour == 0 or 13 <= hour <= 23) and minute <= 59:
+            return {"hour": hour, "minute": minute}
+    return None
+
+
+class ConversionStats:
+    """Counts how often each date/time field was parsed locally vs by the LLM."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.counts: Dict[str, Dict[str, int]] = {}
+
+    def record(self, field: str, path: str) -> None:
+        with self._lock:
+            field_counts = self.counts.setdefault(field, {"local": 0, "llm": 0})
+            field_counts[path] = field_counts.get(path, 0) + 1
+
+    def as_dict(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {field: dict(counts) for field, counts in self.counts.items()}
+
+
+conversion_stats = ConversionStats()
@@ -1,14 +1,50 @@
 import streamlit as st
 import pandas as pd
+import asyncio
 import json
+import datetime
+from typing import Optional
 
 from langchain.llms import OpenAI
 from langchain.chat_models import ChatOpenAI
 from langchain.chains import create_extraction_chain
+from langchain.chains.openai_functions import create_structured_output_chain
+from langchain.prompts import ChatPromptTemplate
+from pydantic import BaseModel, Field, validator
 
-OPEN_AI_API_KEY = st.secrets["open_api_key"]
+from chain.DateTimeParser import (
+    DEFAULT_TIMEZONE,
+    conversion_stats,
+    local_today,
+    parse_date,
+    parse_time,
+)
+from chain.Instrumentation import maybe_stage, new_request_id
+from chain.TokenUsageHandler import TokenUsageHandler
 
-def load_experience_extraction_chain():
+def openai_api_key():
+    # Read lazily so the module imports without a secrets file, e.g. in benchmarks
+    return st.secrets["open_api_key"]
+
+def local_timezone():
+    try:
+        return st.secrets.get("timezone", DEFAULT_TIMEZONE)
+    except FileNotFoundError:
+        return DEFAULT_TIMEZONE
+
+# Columns of experience_raw, in the order the portal form writes them
+EXPERIENCE_COLUMNS = [
+    'business_name',
+    'event_type',
+    'event_price',
+    'event_date',
+    'event_start_time',
+    'event_end_time',
+    'band_name',
+    'happy_hour_deal',
+]
+
+def load_experience_extraction_chain(llm=None):
     # Defines what model should be attempting to extract from user prompt
     schema = {
         "properties": {
@@ -24,27 +60,74 @@ def load_experience_extraction_chain():
         "required": ["business_name", "event_type", "event_date"],
     }
 
-    llm = ChatOpenAI(openai_api_key=OPEN_AI_API_KEY, temperature=0, model="gpt-3.5-turbo-0613")
+    llm = llm or ChatOpenAI(openai_api_key=openai_api_key(), temperature=0, model="gpt-3.5-turbo-0613")
     chain = create_extraction_chain(schema, llm)
     return chain
 
-def date_convert_llm(event_date):
-    # Convert dates and times from user input into correct syntax
-    datetime_convert_llm = OpenAI(openai_api_key=OPEN_AI_API_KEY, temperature=0)
+class EventTime(BaseModel):
+    """A time of day on a 24-hour clock."""
+
+    hour: int = Field(..., ge=0, le=23)
+    minute: int = Field(0, ge=0, le=59)
+
+class ExperienceFields(BaseModel):
+    """An experience a business is hosting, with dates and times already resolved."""
+
+    business_name: str
+    event_type: str = Field(..., description="e.g. live music, happy hour, trivia")
+    event_price: Optional[int] = Field(None, ge=0, description="Cover or ticket price in whole dollars")
+    event_date: datetime.date = Field(..., description="ISO 8601 date, with relative dates like 'tonight' resolved against today's date")
+    event_start_time: Optional[EventTime] = None
+    event_end_time: Optional[EventTime] = None
+    band_name: Optional[str] = None
+    happy_hour_deal: Optional[str] = None
+
+    @validator('event_price', pre=True)
+    def strip_currency(cls, value):
+        if isinstance(value, str):
+            value = value.strip().lstrip('$').replace(',', '') or None
+        return value
+
+STRUCTURED_EXTRACTION_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", "Extract the experience described in the passage. Today is {today}. Resolve relative dates against today and give times on a 24-hour clock. Leave out anything the passage doesn't say."),
+    ("human", "Passage:\n{input}"),
+])
+
+def load_structured_extraction_chain(llm=None):
+    # One function call that returns every field typed, instead of extraction plus conversion calls
+    llm = llm or ChatOpenAI(openai_api_key=openai_api_key(), temperature=0, model="gpt-3.5-turbo-0613")
+    return create_structured_output_chain(ExperienceFields, llm, STRUCTURED_EXTRACTION_PROMPT)
+
+def structured_today():
+    today = local_today(local_timezone())
+    return f"{today.strftime('%A')} {today.isoformat()}"
+
+def from_experience_fields(fields):
+    # Same (df, date_df, start_time_df, end_time_df) shape that run() builds from the conversions
+    row = fields.dict(exclude_none=True)
+    date_df = pd.Series({'year': fields.event_date.year, 'month': fields.event_date.month, 'day': fields.event_date.day})
+    row['event_date'] = fields.event_date.isoformat()
+    times = {}
+    for field in ['event_start_time', 'event_end_time']:
+        value = getattr(fields, field)
+        if value is not None:
+            times[field] = pd.Series({'hour': value.hour, 'minute': value.minute})
+            row[field] = f"{value.hour:02d}:{value.minute:02d}"
+    return pd.Series(row), date_df, times.get('event_start_time'), times.get('event_end_time')
+
+def date_convert_prompt(event_date):
     date_prompt= """
         Convert the below date into the format of the below json object schema. Only respond with the output. 
-        Today's date is 8/4/2023
+        Today's date is <today>
 
         schema: {"year": {"type": "integer"}, "month": {"type": "integer"}, "day": {"type": "integer"}}
         Date: <date>
     """
-    date_prompt = date_prompt.replace('<date>', event_date)
-    date_response = json.loads(datetime_convert_llm(date_prompt))
-    return pd.DataFrame(date_response, index=[0]).iloc[0]
+    today = local_today(local_timezone())
+    date_prompt = date_prompt.replace('<today>', f'{today.month}/{today.day}/{today.year}')
+    return date_prompt.replace('<date>', event_date)
 
-def time_convert_llm(event_time):
-    # Convert times from user input into correct syntax
-    datetime_convert_llm = OpenAI(openai_api_key=OPEN_AI_API_KEY, temperature=0)
+def time_convert_prompt(event_time):
     time_prompt= """
         Convert the below times into the format of the below schema defining a json object. 
         Only respond with the output. 
@@ -52,31 +135,185 @@ def time_convert_llm(event_time):
         schema: {"hour": {"type": "integer"}, "minute": {"type": "integer"}}
         Time: <time>
     """
-    time_prompt = time_prompt.replace('<time>', event_time)
-    time_response = json.loads(datetime_convert_llm(time_prompt))
+    return time_prompt.replace('<time>', event_time)
+
+def date_convert_llm(event_date, callbacks=None, llm=None):
+    # Convert dates and times from user input into correct syntax
+    datetime_convert_llm = llm or OpenAI(openai_api_key=openai_api_key(), temperature=0)
+    date_response = json.loads(datetime_convert_llm(date_convert_prompt(event_date), callbacks=callbacks))
+    return pd.DataFrame(date_response, index=[0]).iloc[0]
+
+def time_convert_llm(event_time, callbacks=None, llm=None):
+    # Convert times from user input into correct syntax
+    datetime_convert_llm = llm or OpenAI(openai_api_key=openai_api_key(), temperature=0)
+    time_response = json.loads(datetime_convert_llm(time_convert_prompt(event_time), callbacks=callbacks))
+    return pd.DataFrame(time_response, index=[0]).iloc[0]
+
+async def adate_convert_llm(event_date, callbacks=None, llm=None):
+    datetime_convert_llm = llm or OpenAI(openai_api_key=openai_api_key(), temperature=0)
+    date_response = json.loads(await datetime_convert_llm.apredict(date_convert_prompt(event_date), callbacks=callbacks))
+    return pd.DataFrame(date_response, index=[0]).iloc[0]
+
+async def atime_convert_llm(event_time, callbacks=None, llm=None):
+    datetime_convert_llm = llm or OpenAI(openai_api_key=openai_api_key(), temperature=0)
+    time_response = json.loads(await datetime_convert_llm.apredict(time_convert_prompt(event_time), callbacks=callbacks))
     return pd.DataFrame(time_response, index=[0]).iloc[0]
 
+def date_convert(event_date, callbacks=None, llm=None):
+    # Try the local parser first and only spend an LLM call when it can't tell
+    date_response = parse_date(event_date, today=local_today(local_timezone()))
+    if date_response is None:
+        conversion_stats.record('event_date', 'llm')
+        return date_convert_llm(event_date, callbacks=callbacks, llm=llm), 'llm'
+    conversion_stats.record('event_date', 'local')
+    return pd.DataFrame(date_response, index=[0]).iloc[0], 'local'
+
+def time_convert(event_time, field='event_time', callbacks=None, llm=None):
+    time_response = parse_time(event_time)
+    if time_response is None:
+        conversion_stats.record(field, 'llm')
+        return time_convert_llm(event_time, callbacks=callbacks, llm=llm), 'llm'
+    conversion_stats.record(field, 'local')
+    return pd.DataFrame(time_response, index=[0]).iloc[0], 'local'
+
+async def adate_convert(event_date, callbacks=None, llm=None):
+    date_response = parse_date(event_date, today=local_today(local_timezone()))
+    if date_response is None:
+        conversion_stats.record('event_date', 'llm')
+        return await adate_convert_llm(event_date, callbacks=callbacks, llm=llm), 'llm'
+    conversion_stats.record('event_date', 'local')
+    return pd.DataFrame(date_response, index=[0]).iloc[0], 'local'
+
+async def atime_convert(event_time, field='event_time', callbacks=None, llm=None):
+    time_response = parse_time(event_time)
+    if time_response is None:
+        conversion_stats.record(field, 'llm')
+        return await atime_convert_llm(event_time, callbacks=callbacks, llm=llm), 'llm'
+    conversion_stats.record(field, 'local')
+    return pd.DataFrame(time_response, index=[0]).iloc[0], 'local'
+
+def to_experience_row(df, date_df, start_time_df, end_time_df):
+    # Turn ExperienceExtractorChain.run() output into an experience_raw row, like the portal form does
+    row = dict.fromkeys(EXPERIENCE_COLUMNS)
+    for column in ['business_name', 'event_type', 'band_name', 'happy_hour_deal']:
+        if column in df and pd.notna(df[column]):
+            row[column] = str(df[column])
+
+    if 'event_price' in df and pd.notna(df['event_price']):
+        row['event_price'] = int(df['event_price'])
+
+    if date_df is not None:
+        row['event_date'] = datetime.date(int(date_df['year']), int(date_df['month']), int(date_df['day']))
+
+    if start_time_df is not None:
+        row['event_start_time'] = datetime.time(int(start_time_df['hour']), int(start_time_df['minute']))
+
+    if end_time_df is not None:
+        row['event_end_time'] = datetime.time(int(end_time_df['hour']), int(end_time_df['minute']))
+
+    return row
+
 class ExperienceExtractorChain():
 
-    def __init__(self, user_input=''):
+    def __init__(self, user_input='', metrics=None, request_id=None, extraction_llm=None, convert_llm=None, structured=False):
         self.user_input = user_input
+        # Extract typed dates and times in one function call, falling back to
+        # extraction plus conversions when the output doesn't validate
+        self.structured = structured
+        # LLMs default to OpenAI; pass others in to swap them, e.g. fakes in benchmarks
+        self.extraction_llm = extraction_llm
+        self.convert_llm = convert_llm
+        # Which path ('local' or 'llm') converted each date/time field on the last run
+        self.conversion_paths = {}
+        # Optional MetricsRecorder; stages are recorded under request_id
+        self.metrics = metrics
+        self.request_id = request_id or new_request_id()
+
+    def _stage(self, stage):
+        return maybe_stage(self.metrics, self.request_id, 'extractor', stage)
+
+    def _callbacks(self, record):
+        return [TokenUsageHandler(record)] if self.metrics is not None else None
+
+    def _record_structured(self, fields):
+        for field in ['event_date', 'event_start_time', 'event_end_time']:
+            if getattr(fields, field) is not None:
+                conversion_stats.record(field, 'structured')
+                self.conversion_paths[field] = 'structured'
 
     def run(self):
-        chain = load_experience_extraction_chain()
-        output = chain.run(input=self.user_input)
+        if self.structured:
+            try:
+                with self._stage('structured_extraction') as record:
+                    chain = load_structured_extraction_chain(self.extraction_llm)
+                    fields = chain.run(input=self.user_input, today=structured_today(), callbacks=self._callbacks(record))
+            except ValueError:
+                # Recorded on the stage; the original path still gets the submission through
+                pass
+            else:
+                self._record_structured(fields)
+                return from_experience_fields(fields)
+
+        with self._stage('extraction') as record:
+            chain = load_experience_extraction_chain(self.extraction_llm)
+            output = chain.run(input=self.user_input, callbacks=self._callbacks(record))
 
         df = pd.DataFrame(output).iloc[0]
 
         #TODO: what if field not populated?
+        date_df, start_time_df, end_time_df = None, None, None
+
         if 'event_date' in df:
-            date_df = date_convert_llm(df['event_date'])
+            with self._stage('date_conversion') as record:
+                date_df, path = date_convert(df['event_date'], callbacks=self._callbacks(record), llm=self.convert_llm)
+                self.conversion_paths['event_date'] = record.extra['path'] = path
 
         if 'event_start_time' in df:
-            start_time_df = time_convert_llm(df['event_start_time'])
+            with self._stage('start_time_conversion') as record:
+                start_time_df, path = time_convert(df['event_start_time'], 'event_start_time', callbacks=self._callbacks(record), llm=self.convert_llm)
+                self.conversion_paths['event_start_time'] = record.extra['path'] = path
 
         if 'event_end_time' in df:
-            end_time_df = time_convert_llm(df['event_end_time'])
+            with self._stage('end_time_conversion') as record:
+                end_time_df, path = time_convert(df['event_end_time'], 'event_end_time', callbacks=self._callbacks(record), llm=self.convert_llm)
+                self.conversion_paths['event_end_time'] = record.extra['path'] = path
 
         return df, date_df, start_time_df, end_time_df
 
+    async def arun(self):
+        # Same as run(), but the date and time conversions are independent so they run concurrently
+        if self.structured:
+            try:
+                with self._stage('structured_extraction') as record:
+                    chain = load_structured_extraction_chain(self.extraction_llm)
+                    fields = await chain.arun(input=self.user_input, today=structured_today(), callbacks=self._callbacks(record))
+            except ValueError:
+                pass
+            else:
+                self._record_structured(fields)
+                return from_experience_fields(fields)
+
+        with self._stage('extraction') as record:
+            chain = load_experience_extraction_chain(self.extraction_llm)
+            output = await chain.arun(input=self.user_input, callbacks=self._callbacks(record))
+
+        df = pd.DataFrame(output).iloc[0]
+
+        async def convert(field, stage, converter):
+            with self._stage(stage) as record:
+                response, path = await converter(df[field], callbacks=self._callbacks(record))
+                self.conversion_paths[field] = record.extra['path'] = path
+            return response
+
+        conversions = {}
+        if 'event_date' in df:
+            conversions['event_date'] = convert('event_date', 'date_conversion', lambda value, callbacks: adate_convert(value, callbacks=callbacks, llm=self.convert_llm))
+        if 'event_start_time' in df:
+            conversions['event_start_time'] = convert('event_start_time', 'start_time_conversion', lambda value, callbacks: atime_convert(value, 'event_start_time', callbacks=callbacks, llm=self.convert_llm))
+        if 'event_end_time' in df:
+            conversions['event_end_time'] = convert('event_end_time', 'end_time_conversion', lambda value, callbacks: atime_convert(value, 'event_end_time', callbacks=callbacks, llm=self.convert_llm))
+
+        results = dict(zip(conversions, await asyncio.gather(*conversions.values())))
+        return df, results.get('event_date'), results.get('event_start_time'), results.get('event_end_time')
+
     
\ No newline at end of file
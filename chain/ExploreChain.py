@@ -1,10 +1,31 @@
 """Chain for interacting with SQL Database."""
 from __future__ import annotations
 
+import asyncio
+import threading
+import time
 import warnings
-from typing import Any, Dict, List, Optional
-
-from langchain.callbacks.manager import CallbackManagerForChainRun
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import (
+    Any,
+    Callable,
+    ContextManager,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+    Union,
+)
+
+from langchain.callbacks.manager import (
+    AsyncCallbackManager,
+    AsyncCallbackManagerForChainRun,
+    CallbackManager,
+    CallbackManagerForChainRun,
+    Callbacks,
+)
 from langchain.chains.base import Chain
 from langchain.chains.llm import LLMChain
 from langchain.chains.sql_database.prompt import DECIDER_PROMPT, PROMPT, SQL_PROMPTS
@@ -15,8 +36,50 @@ from langchain.tools.sql_database.prompt import QUERY_CHECKER
 from langchain.utilities.sql_database import SQLDatabase
 from pydantic import Extra, Field, root_validator
 
+from chain.Instrumentation import (
+    MetricsRecorder,
+    StageRecord,
+    maybe_stage,
+    new_request_id,
+)
+from chain.LocalReplica import LocalReplica
+from chain.QueryCache import QueryCache
+from chain.ResultBudget import estimate_tokens, fetch_bounded
+from chain.SchemaCache import SchemaCache
+from chain.SchemaDescriptor import SchemaDescriptor
+from chain.SQLValidator import SQLParseError, validate_sql
+from chain.TableIndex import TableIndex
+from chain.TokenUsageHandler import TokenUsageHandler
+
 INTERMEDIATE_STEPS_KEY = "intermediate_steps"
 
+# Events yielded by ExploreChain.stream_answer
+SQL_EVENT = "sql"
+RESULT_EVENT = "result"
+TOKEN_EVENT = "token"
+ANSWER_EVENT = "answer"
+
+NO_RESULTS_ANSWER = "We're not finding anything like that right now.. Try something else!"
+
+# Threads shared by every chain without its own db_executor. Bounded so a burst
+# of async requests can't open more warehouse connections than the pool holds.
+DB_EXECUTOR_WORKERS = 8
+_db_executor: Optional[Executor] = None
+_db_executor_lock = threading.Lock()
+
+T = TypeVar("T")
+
+
+def default_db_executor() -> Executor:
+    global _db_executor
+    if _db_executor is None:
+        with _db_executor_lock:
+            if _db_executor is None:
+                _db_executor = ThreadPoolExecutor(
+                    max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix="explore-db"
+                )
+    return _db_executor
+
 
 class ExploreChain(Chain):
     """Chain for interacting with SQL Database.
@@ -51,6 +114,37 @@ class ExploreChain(Chain):
     to fix the initial SQL from the LLM."""
     query_checker_prompt: Optional[BasePromptTemplate] = None
     """The prompt template that should be used by the query checker"""
+    use_sql_validator: bool = False
+    """Whether or not to validate the SQL locally before running it. Only
+    SELECTs over the allowed tables pass, and LIMIT is clamped to top_k, or to
+    one row past ``max_result_rows`` when set so the result budget can tell the
+    answer prompt that rows were left out. The query checker is then only used
+    when the SQL can't be parsed."""
+    allowed_tables: Optional[List[str]] = None
+    """Tables the validator lets queries read. Defaults to the tables in use."""
+    max_result_rows: Optional[int] = None
+    """Most rows of the query result to pass to the answer prompt."""
+    max_result_tokens: Optional[int] = None
+    """Approximate token budget for the query result in the answer prompt."""
+    result_columns: Optional[List[str]] = None
+    """Columns of the query result to pass to the answer prompt. Defaults to
+    every column that has a value. Only used with a row or token budget."""
+    metrics: Optional[MetricsRecorder] = Field(default=None, exclude=True)
+    """Recorder for per-stage latency and token counts, keyed by the
+    ``request_id`` input. If not set, nothing is recorded."""
+    schema_cache: Optional[SchemaCache] = Field(default=None, exclude=True)
+    """Cache for table info. If not set, the schema is reflected on every call."""
+    schema_descriptor: Optional[SchemaDescriptor] = Field(default=None, exclude=True)
+    """Compact description used in place of table info for the tables it
+    covers. Takes precedence over ``schema_cache``."""
+    query_cache: Optional[QueryCache] = Field(default=None, exclude=True)
+    """Cache for generated SQL and final answers. If not set, nothing is cached."""
+    replica: Optional[LocalReplica] = Field(default=None, exclude=True)
+    """Local copy of the database to run queries against instead. Queries fall
+    back to the database when the replica isn't synced yet or can't run them."""
+    db_executor: Optional[Executor] = Field(default=None, exclude=True)
+    """Executor the async path runs database calls in. Defaults to a shared
+    pool of ``DB_EXECUTOR_WORKERS`` threads."""
 
     class Config:
         """Configuration for this pydantic object."""
@@ -93,103 +187,510 @@ class ExploreChain(Chain):
         else:
             return [self.output_key, INTERMEDIATE_STEPS_KEY]
 
-    def _call(
+    def _stage(self, request_id: str, stage: str) -> ContextManager[StageRecord]:
+        return maybe_stage(self.metrics, request_id, "explore", stage)
+
+    def _allowed_qualifiers(self) -> List[str]:
+        # Generated SQL may name the configured database and schema, and nothing else.
+        # Snowflake URLs hold both as "database/schema"
+        url_parts = []
+        if self.database.dialect == "snowflake":
+            url_parts = (self.database._engine.url.database or "").split("/")
+        return [part for part in [*url_parts, self.database._schema] if part]
+
+    def _child_callbacks(
         self,
-        inputs: Dict[str, Any],
-        run_manager: Optional[CallbackManagerForChainRun] = None,
-    ) -> Dict[str, Any]:
-        _run_manager = run_manager or CallbackManagerForChainRun.get_noop_manager()
-        input_text = f"{inputs[self.input_key]}\nSQLQuery:"
-        _run_manager.on_text(input_text, verbose=self.verbose)
-        # If not present, then defaults to None which is all tables.
-        table_names_to_use = inputs.get("table_names_to_use")
-        table_info = self.database.get_table_info(table_names=table_names_to_use)
-        llm_inputs = {
+        run_manager: Union[CallbackManagerForChainRun, AsyncCallbackManagerForChainRun],
+        record: StageRecord,
+    ) -> Union[CallbackManager, AsyncCallbackManager]:
+        callbacks = run_manager.get_child()
+        if self.metrics is not None:
+            callbacks.add_handler(TokenUsageHandler(record))
+        return callbacks
+
+    async def _in_executor(self, func: Callable[..., T], *args: Any) -> T:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.db_executor or default_db_executor(), func, *args
+        )
+
+    def _get_table_info(self, table_names_to_use: Optional[List[str]]) -> str:
+        if self.schema_descriptor is not None and self.schema_descriptor.covers(
+            table_names_to_use
+        ):
+            return self.schema_descriptor.get_table_info(table_names_to_use)
+        if self.schema_cache is not None:
+            return self.schema_cache.get_table_info(table_names_to_use)
+        return self.database.get_table_info(table_names=table_names_to_use)
+
+    def _table_info(
+        self, table_names_to_use: Optional[List[str]], request_id: str
+    ) -> str:
+        with self._stage(request_id, "schema") as record:
+            table_info = self._get_table_info(table_names_to_use)
+            record.extra["table_info_tokens"] = estimate_tokens(table_info)
+        return table_info
+
+    def _llm_inputs(self, input_text: str, table_info: str) -> Dict[str, Any]:
+        return {
             "input": input_text,
             "top_k": str(self.top_k),
             "dialect": self.database.dialect,
             "table_info": table_info,
             "stop": ["\nSQLResult:"],
         }
-        intermediate_steps: List = []
+
+    def _cached_sql(
+        self, question: str, table_names_to_use: Optional[List[str]], request_id: str
+    ) -> Optional[str]:
+        if self.query_cache is None:
+            return None
+        with self._stage(request_id, "sql_cache") as record:
+            sql_cmd = self.query_cache.get_sql(question, table_names_to_use)
+            record.extra["hit"] = sql_cmd is not None
+        return sql_cmd
+
+    def _cache_sql(
+        self, question: str, sql_cmd: str, table_names_to_use: Optional[List[str]]
+    ) -> None:
+        if self.query_cache is not None:
+            self.query_cache.set_sql(question, sql_cmd, table_names_to_use)
+
+    def _cached_answer(self, sql_cmd: str, request_id: str) -> Optional[Tuple[str, str]]:
+        if self.query_cache is None:
+            return None
+        with self._stage(request_id, "answer_cache") as record:
+            cached_answer = self.query_cache.get_answer(sql_cmd)
+            record.extra["hit"] = cached_answer is not None
+        return cached_answer
+
+    def _cache_answer(self, sql_cmd: str, result: str, final_result: str) -> None:
+        if self.query_cache is not None:
+            self.query_cache.set_answer(sql_cmd, result, final_result)
+
+    def _query_checker(self, sql_cmd: str) -> Tuple[LLMChain, Dict[str, Any]]:
+        query_checker_prompt = self.query_checker_prompt or PromptTemplate(
+            template=QUERY_CHECKER, input_variables=["query", "dialect"]
+        )
+        query_checker_chain = LLMChain(
+            llm=self.llm_chain.llm, prompt=query_checker_prompt
+        )
+        query_checker_inputs = {
+            "query": sql_cmd,
+            "dialect": self.database.dialect,
+        }
+        return query_checker_chain, query_checker_inputs
+
+    def _check_sql(self, sql_cmd: str, callbacks: Callbacks) -> str:
+        query_checker_chain, query_checker_inputs = self._query_checker(sql_cmd)
+        return query_checker_chain.predict(
+            callbacks=callbacks, **query_checker_inputs
+        ).strip()
+
+    async def _acheck_sql(self, sql_cmd: str, callbacks: Callbacks) -> str:
+        query_checker_chain, query_checker_inputs = self._query_checker(sql_cmd)
+        return (
+            await query_checker_chain.apredict(
+                callbacks=callbacks, **query_checker_inputs
+            )
+        ).strip()
+
+    def _predict_answer(
+        self,
+        answer_inputs: Dict[str, Any],
+        callbacks: Callbacks,
+        stream: bool,
+    ) -> Iterator[str]:
+        """Yield the final answer, token by token when streaming."""
+        llm = self.llm_chain.llm
+        if not stream or not hasattr(llm, "stream"):
+            yield self.llm_chain.predict(callbacks=callbacks, **answer_inputs)
+            return
+        prompt_inputs = {
+            k: answer_inputs[k] for k in self.llm_chain.prompt.input_variables
+        }
+        prompt = self.llm_chain.prompt.format(**prompt_inputs)
+        for chunk in llm.stream(
+            prompt,
+            config={"callbacks": callbacks},
+            stop=answer_inputs["stop"],
+        ):
+            # Chat models stream message chunks, completion models stream text
+            yield getattr(chunk, "content", chunk)
+
+    def _validate(self, sql_cmd: str, table_names_to_use: Optional[List[str]]) -> str:
+        allowed_tables = (
+            self.allowed_tables
+            or table_names_to_use
+            or self.database.get_usable_table_names()
+        )
+        # One row past the budget is enough for fetch_bounded to notice truncation
+        max_rows = (
+            self.top_k if self.max_result_rows is None else self.max_result_rows + 1
+        )
+        return validate_sql(
+            sql_cmd,
+            allowed_tables,
+            max_rows,
+            self.database.dialect,
+            self._allowed_qualifiers(),
+        )
+
+    def _validate_sql(
+        self,
+        sql_cmd: str,
+        table_names_to_use: Optional[List[str]],
+        run_manager: CallbackManagerForChainRun,
+        request_id: str,
+    ) -> str:
         try:
-            intermediate_steps.append(llm_inputs)  # input: sql generation
-            sql_cmd = self.llm_chain.predict(
-                callbacks=_run_manager.get_child(),
-                **llm_inputs,
-            ).strip()
-            if self.return_sql:
-                return {self.output_key: sql_cmd}
-            if not self.use_query_checker:
-                _run_manager.on_text(sql_cmd, color="green", verbose=self.verbose)
-                intermediate_steps.append(
-                    sql_cmd
-                )  # output: sql generation (no checker)
-                intermediate_steps.append({"sql_cmd": sql_cmd})  # input: sql exec
-                result = self.database.run(sql_cmd)
-                intermediate_steps.append(str(result))  # output: sql exec
-            else:
-                query_checker_prompt = self.query_checker_prompt or PromptTemplate(
-                    template=QUERY_CHECKER, input_variables=["query", "dialect"]
+            return self._validate(sql_cmd, table_names_to_use)
+        except SQLParseError:
+            # Only pay for the LLM checker when the SQL doesn't even parse
+            run_manager.on_text(
+                "\nSQL did not parse, using query checker", verbose=self.verbose
+            )
+            with self._stage(request_id, "query_checker") as record:
+                checked_sql_cmd = self._check_sql(
+                    sql_cmd, self._child_callbacks(run_manager, record)
                 )
-                query_checker_chain = LLMChain(
-                    llm=self.llm_chain.llm, prompt=query_checker_prompt
+            return self._validate(checked_sql_cmd, table_names_to_use)
+
+    async def _avalidate_sql(
+        self,
+        sql_cmd: str,
+        table_names_to_use: Optional[List[str]],
+        run_manager: AsyncCallbackManagerForChainRun,
+        request_id: str,
+    ) -> str:
+        try:
+            return self._validate(sql_cmd, table_names_to_use)
+        except SQLParseError:
+            await run_manager.on_text(
+                "\nSQL did not parse, using query checker", verbose=self.verbose
+            )
+            with self._stage(request_id, "query_checker") as record:
+                checked_sql_cmd = await self._acheck_sql(
+                    sql_cmd, self._child_callbacks(run_manager, record)
                 )
-                query_checker_inputs = {
-                    "query": sql_cmd,
-                    "dialect": self.database.dialect,
-                }
-                checked_sql_command: str = query_checker_chain.predict(
-                    callbacks=_run_manager.get_child(), **query_checker_inputs
-                ).strip()
-                intermediate_steps.append(
-                    checked_sql_command
-                )  # output: sql generation (checker)
-                _run_manager.on_text(
-                    checked_sql_command, color="green", verbose=self.verbose
+            return self._validate(checked_sql_cmd, table_names_to_use)
+
+    def _run_sql_on(self, database: SQLDatabase, sql_cmd: str) -> str:
+        if self.max_result_rows is None and self.max_result_tokens is None:
+            return database.run(sql_cmd)
+        # Fetch only what fits the budget and hand the LLM a compact table
+        # with a note on how many rows were left out
+        return fetch_bounded(
+            database._engine,
+            sql_cmd,
+            max_rows=self.max_result_rows,
+            max_tokens=self.max_result_tokens,
+            columns=self.result_columns,
+            schema=database._schema,
+        ).text
+
+    def _run_sql(self, sql_cmd: str, record: StageRecord) -> str:
+        if self.replica is not None and self.replica.ready:
+            try:
+                result = self._run_sql_on(
+                    self.replica.database,
+                    self.replica.translate(sql_cmd, self.database.dialect),
                 )
-                intermediate_steps.append(
-                    {"sql_cmd": checked_sql_command}
-                )  # input: sql exec
-                result = self.database.run(checked_sql_command)
-                intermediate_steps.append(str(result))  # output: sql exec
-                sql_cmd = checked_sql_command
-
-            _run_manager.on_text("\nSQLResult: ", verbose=self.verbose)
-            _run_manager.on_text(result, color="yellow", verbose=self.verbose)
-            # If return direct, we just set the final result equal to
-            # the result of the sql query result, otherwise try to get a human readable
-            # final answer
-            if self.return_direct:
-                final_result = result
-
-            # TODO: Added condition to return static text if no results in query. can make it better
-            elif result == '':
-                final_result = "We're not finding anything like that right now.. Try something else!"
-
+            except Exception as exc:
+                # Anything the translation can't express still runs on the source
+                self.replica.record_query(fallback=True)
+                record.extra["replica_error"] = f"{type(exc).__name__}: {exc}"
             else:
-                _run_manager.on_text("\nAnswer:", verbose=self.verbose)
-                input_text += f"{sql_cmd}\nSQLResult: {result}\nAnswer:"
-                llm_inputs["input"] = input_text
-                intermediate_steps.append(llm_inputs)  # input: final answer
-
-                final_result = self.llm_chain.predict(
-                    callbacks=_run_manager.get_child(),
-                    **llm_inputs,
+                self.replica.record_query()
+                record.extra["source"] = "replica"
+                return result
+        record.extra["source"] = "database"
+        return self._run_sql_on(self.database, sql_cmd)
+
+    def _iter_call(
+        self,
+        inputs: Dict[str, Any],
+        run_manager: CallbackManagerForChainRun,
+        intermediate_steps: List,
+        stream: bool = False,
+    ) -> Iterator[Tuple[str, Any]]:
+        """Run the chain step by step, yielding ``(event, payload)`` as each
+        stage finishes. ``_call`` and ``stream_answer`` both drive this."""
+        question = inputs[self.input_key]
+        request_id = inputs.get("request_id") or new_request_id()
+        input_text = f"{question}\nSQLQuery:"
+        run_manager.on_text(input_text, verbose=self.verbose)
+        # If not present, then defaults to None which is all tables.
+        table_names_to_use = inputs.get("table_names_to_use")
+        llm_inputs: Optional[Dict[str, Any]] = None
+
+        def get_llm_inputs() -> Dict[str, Any]:
+            # Table info is only needed once an LLM call is actually made
+            nonlocal llm_inputs
+            if llm_inputs is None:
+                llm_inputs = self._llm_inputs(
+                    input_text, self._table_info(table_names_to_use, request_id)
+                )
+            return llm_inputs
+
+        sql_cmd = self._cached_sql(question, table_names_to_use, request_id)
+        if sql_cmd is None:
+            intermediate_steps.append(get_llm_inputs())  # input: sql generation
+            with self._stage(request_id, "sql_generation") as record:
+                sql_cmd = self.llm_chain.predict(
+                    callbacks=self._child_callbacks(run_manager, record),
+                    **get_llm_inputs(),
                 ).strip()
+            if self.return_sql:
+                yield SQL_EVENT, sql_cmd
+                yield ANSWER_EVENT, sql_cmd
+                return
+            if self.use_sql_validator:
+                with self._stage(request_id, "sql_validation"):
+                    sql_cmd = self._validate_sql(
+                        sql_cmd, table_names_to_use, run_manager, request_id
+                    )
+            elif self.use_query_checker:
+                with self._stage(request_id, "query_checker") as record:
+                    sql_cmd = self._check_sql(
+                        sql_cmd, self._child_callbacks(run_manager, record)
+                    )
+            self._cache_sql(question, sql_cmd, table_names_to_use)
+        elif self.return_sql:
+            yield SQL_EVENT, sql_cmd
+            yield ANSWER_EVENT, sql_cmd
+            return
+        run_manager.on_text(sql_cmd, color="green", verbose=self.verbose)
+        intermediate_steps.append(sql_cmd)  # output: sql generation
+        yield SQL_EVENT, sql_cmd
+        intermediate_steps.append({"sql_cmd": sql_cmd})  # input: sql exec
+
+        cached_answer = self._cached_answer(sql_cmd, request_id)
+        if cached_answer is not None:
+            result, final_result = cached_answer
+        else:
+            with self._stage(request_id, "sql_execution") as record:
+                result = self._run_sql(sql_cmd, record)
+        intermediate_steps.append(str(result))  # output: sql exec
+        yield RESULT_EVENT, result
+
+        run_manager.on_text("\nSQLResult: ", verbose=self.verbose)
+        run_manager.on_text(result, color="yellow", verbose=self.verbose)
+        # If return direct, we just set the final result equal to
+        # the result of the sql query result, otherwise try to get a human readable
+        # final answer
+        if cached_answer is not None:
+            yield TOKEN_EVENT, final_result
+            run_manager.on_text(final_result, color="green", verbose=self.verbose)
+
+        elif self.return_direct:
+            final_result = result
+
+        # TODO: Added condition to return static text if no results in query. can make it better
+        elif result == '':
+            final_result = NO_RESULTS_ANSWER
+            yield TOKEN_EVENT, final_result
 
-                intermediate_steps.append(final_result)  # output: final answer
-                _run_manager.on_text(final_result, color="green", verbose=self.verbose)
-            chain_result: Dict[str, Any] = {self.output_key: final_result}
-            if self.return_intermediate_steps:
-                chain_result[INTERMEDIATE_STEPS_KEY] = intermediate_steps
-            return chain_result
+        else:
+            run_manager.on_text("\nAnswer:", verbose=self.verbose)
+            answer_inputs = self._answer_inputs(get_llm_inputs(), sql_cmd, result)
+            intermediate_steps.append(answer_inputs)  # input: final answer
+
+            tokens: List[str] = []
+            with self._stage(request_id, "answer_generation") as record:
+                start = time.perf_counter()
+                for token in self._predict_answer(
+                    answer_inputs, self._child_callbacks(run_manager, record), stream
+                ):
+                    if not tokens:
+                        token = token.lstrip()
+                        if not token:
+                            continue
+                        record.extra["first_token_seconds"] = time.perf_counter() - start
+                    tokens.append(token)
+                    yield TOKEN_EVENT, token
+            final_result = "".join(tokens).strip()
+
+            intermediate_steps.append(final_result)  # output: final answer
+            run_manager.on_text(final_result, color="green", verbose=self.verbose)
+        if cached_answer is None:
+            self._cache_answer(sql_cmd, str(result), final_result)
+        yield ANSWER_EVENT, final_result
+
+    def _answer_inputs(
+        self, llm_inputs: Dict[str, Any], sql_cmd: str, result: str
+    ) -> Dict[str, Any]:
+        answer_inputs = dict(llm_inputs)
+        answer_inputs["input"] += f"{sql_cmd}\nSQLResult: {result}\nAnswer:"
+        return answer_inputs
+
+    def _chain_result(self, final_result: Any, intermediate_steps: List) -> Dict[str, Any]:
+        chain_result: Dict[str, Any] = {self.output_key: final_result}
+        if self.return_intermediate_steps:
+            chain_result[INTERMEDIATE_STEPS_KEY] = intermediate_steps
+        return chain_result
+
+    def _call(
+        self,
+        inputs: Dict[str, Any],
+        run_manager: Optional[CallbackManagerForChainRun] = None,
+    ) -> Dict[str, Any]:
+        _run_manager = run_manager or CallbackManagerForChainRun.get_noop_manager()
+        intermediate_steps: List = []
+        try:
+            for event, payload in self._iter_call(
+                inputs, _run_manager, intermediate_steps
+            ):
+                if event == ANSWER_EVENT:
+                    final_result = payload
+            return self._chain_result(final_result, intermediate_steps)
         except Exception as exc:
             # Append intermediate steps to exception, to aid in logging and later
             # improvement of few shot prompt seeds
             exc.intermediate_steps = intermediate_steps  # type: ignore
             raise exc
 
+    async def _acall(
+        self,
+        inputs: Dict[str, Any],
+        run_manager: Optional[AsyncCallbackManagerForChainRun] = None,
+    ) -> Dict[str, Any]:
+        """Async version of ``_call``. LLM calls use the model's async client and
+        database and cache calls run in ``db_executor``, so many questions can be
+        in flight on one event loop without a thread each."""
+        _run_manager = run_manager or AsyncCallbackManagerForChainRun.get_noop_manager()
+        intermediate_steps: List = []
+        question = inputs[self.input_key]
+        request_id = inputs.get("request_id") or new_request_id()
+        input_text = f"{question}\nSQLQuery:"
+        table_names_to_use = inputs.get("table_names_to_use")
+        llm_inputs: Optional[Dict[str, Any]] = None
+
+        async def get_llm_inputs() -> Dict[str, Any]:
+            nonlocal llm_inputs
+            if llm_inputs is None:
+                llm_inputs = self._llm_inputs(
+                    input_text,
+                    await self._in_executor(
+                        self._table_info, table_names_to_use, request_id
+                    ),
+                )
+            return llm_inputs
+
+        try:
+            await _run_manager.on_text(input_text, verbose=self.verbose)
+            sql_cmd = await self._in_executor(
+                self._cached_sql, question, table_names_to_use, request_id
+            )
+            if sql_cmd is None:
+                intermediate_steps.append(await get_llm_inputs())  # input: sql generation
+                with self._stage(request_id, "sql_generation") as record:
+                    sql_cmd = (
+                        await self.llm_chain.apredict(
+                            callbacks=self._child_callbacks(_run_manager, record),
+                            **(await get_llm_inputs()),
+                        )
+                    ).strip()
+                if self.return_sql:
+                    return self._chain_result(sql_cmd, intermediate_steps)
+                if self.use_sql_validator:
+                    with self._stage(request_id, "sql_validation"):
+                        sql_cmd = await self._avalidate_sql(
+                            sql_cmd, table_names_to_use, _run_manager, request_id
+                        )
+                elif self.use_query_checker:
+                    with self._stage(request_id, "query_checker") as record:
+                        sql_cmd = await self._acheck_sql(
+                            sql_cmd, self._child_callbacks(_run_manager, record)
+                        )
+                await self._in_executor(
+                    self._cache_sql, question, sql_cmd, table_names_to_use
+                )
+            elif self.return_sql:
+                return self._chain_result(sql_cmd, intermediate_steps)
+            await _run_manager.on_text(sql_cmd, color="green", verbose=self.verbose)
+            intermediate_steps.append(sql_cmd)  # output: sql generation
+            intermediate_steps.append({"sql_cmd": sql_cmd})  # input: sql exec
+
+            cached_answer = await self._in_executor(self._cached_answer, sql_cmd, request_id)
+            if cached_answer is not None:
+                result, final_result = cached_answer
+            else:
+                with self._stage(request_id, "sql_execution") as record:
+                    result = await self._in_executor(self._run_sql, sql_cmd, record)
+            intermediate_steps.append(str(result))  # output: sql exec
+
+            await _run_manager.on_text("\nSQLResult: ", verbose=self.verbose)
+            await _run_manager.on_text(result, color="yellow", verbose=self.verbose)
+            if cached_answer is not None:
+                await _run_manager.on_text(final_result, color="green", verbose=self.verbose)
+            elif self.return_direct:
+                final_result = result
+            elif result == '':
+                final_result = NO_RESULTS_ANSWER
+            else:
+                await _run_manager.on_text("\nAnswer:", verbose=self.verbose)
+                answer_inputs = self._answer_inputs(await get_llm_inputs(), sql_cmd, result)
+                intermediate_steps.append(answer_inputs)  # input: final answer
+                with self._stage(request_id, "answer_generation") as record:
+                    final_result = (
+                        await self.llm_chain.apredict(
+                            callbacks=self._child_callbacks(_run_manager, record),
+                            **answer_inputs,
+                        )
+                    ).strip()
+                intermediate_steps.append(final_result)  # output: final answer
+                await _run_manager.on_text(final_result, color="green", verbose=self.verbose)
+            if cached_answer is None:
+                await self._in_executor(
+                    self._cache_answer, sql_cmd, str(result), final_result
+                )
+            return self._chain_result(final_result, intermediate_steps)
+        except Exception as exc:
+            exc.intermediate_steps = intermediate_steps  # type: ignore
+            raise exc
+
+    def stream_answer(
+        self,
+        query: str,
+        callbacks: Callbacks = None,
+        request_id: Optional[str] = None,
+    ) -> Iterator[Tuple[str, Any]]:
+        """Run the chain and yield ``(event, payload)`` pairs as they happen.
+
+        Events are ``"sql"`` with the SQL to be run, ``"result"`` with the raw
+        query result as soon as the database returns it, ``"token"`` for each
+        piece of the answer as the LLM produces it (the LLM must be created
+        with ``streaming=True``), and finally ``"answer"`` with the full answer.
+        ``request_id`` keys the stage timings when ``metrics`` is set.
+
+        Example:
+            .. code-block:: python
+
+                for event, payload in db_chain.stream_answer("Live music tonight?"):
+                    if event == "token":
+                        print(payload, end="")
+        """
+        inputs = {self.input_key: query, "request_id": request_id}
+        callback_manager = CallbackManager.configure(
+            callbacks, self.callbacks, self.verbose
+        )
+        run_manager = callback_manager.on_chain_start(
+            {"name": self.__class__.__name__}, inputs
+        )
+        intermediate_steps: List = []
+        try:
+            for event, payload in self._iter_call(
+                inputs, run_manager, intermediate_steps, stream=True
+            ):
+                if event == ANSWER_EVENT:
+                    run_manager.on_chain_end({self.output_key: payload})
+                yield event, payload
+        except Exception as exc:
+            run_manager.on_chain_error(exc)
+            exc.intermediate_steps = intermediate_steps  # type: ignore
+            raise exc
+
     @property
     def _chain_type(self) -> str:
         return "sql_database_chain"
@@ -215,6 +716,8 @@ class SQLDatabaseSequentialChain(Chain):
     2. Based on those tables, call the normal SQL database chain.
 
     This is useful in cases where the number of tables in the database is large.
+    With a ``table_index`` the tables are picked locally, and the decider LLM
+    is only asked when the index isn't confident.
     """
 
     decider_chain: LLMChain
@@ -222,6 +725,8 @@ class SQLDatabaseSequentialChain(Chain):
     input_key: str = "query"  #: :meta private:
     output_key: str = "result"  #: :meta private:
     return_intermediate_steps: bool = False
+    table_index: Optional[TableIndex] = Field(default=None, exclude=True)
+    """Local index to pick tables with before falling back to the decider."""
 
     @classmethod
     def from_llm(
@@ -230,6 +735,7 @@ class SQLDatabaseSequentialChain(Chain):
         database: SQLDatabase,
         query_prompt: BasePromptTemplate = PROMPT,
         decider_prompt: BasePromptTemplate = DECIDER_PROMPT,
+        table_index: Optional[TableIndex] = None,
         **kwargs: Any,
     ) -> SQLDatabaseSequentialChain:
         """Load the necessary chains."""
@@ -239,7 +745,12 @@ class SQLDatabaseSequentialChain(Chain):
         decider_chain = LLMChain(
             llm=llm, prompt=decider_prompt, output_key="table_names"
         )
-        return cls(sql_chain=sql_chain, decider_chain=decider_chain, **kwargs)
+        return cls(
+            sql_chain=sql_chain,
+            decider_chain=decider_chain,
+            table_index=table_index,
+            **kwargs,
+        )
 
     @property
     def input_keys(self) -> List[str]:
@@ -266,19 +777,17 @@ class SQLDatabaseSequentialChain(Chain):
         run_manager: Optional[CallbackManagerForChainRun] = None,
     ) -> Dict[str, Any]:
         _run_manager = run_manager or CallbackManagerForChainRun.get_noop_manager()
-        _table_names = self.sql_chain.database.get_usable_table_names()
-        table_names = ", ".join(_table_names)
-        llm_inputs = {
-            "query": inputs[self.input_key],
-            "table_names": table_names,
-        }
-        _lowercased_table_names = [name.lower() for name in _table_names]
-        table_names_from_chain = self.decider_chain.predict_and_parse(**llm_inputs)
-        table_names_to_use = [
-            name
-            for name in table_names_from_chain
-            if name.lower() in _lowercased_table_names
-        ]
+        table_names_to_use = None
+        if self.table_index is not None:
+            table_names_to_use = self.table_index.select(inputs[self.input_key])
+            if table_names_to_use is None:
+                _run_manager.on_text(
+                    "Table index not confident, asking the decider",
+                    end="\n",
+                    verbose=self.verbose,
+                )
+        if table_names_to_use is None:
+            table_names_to_use = self._decide_tables(inputs[self.input_key])
         _run_manager.on_text("Table names to use:", end="\n", verbose=self.verbose)
         _run_manager.on_text(
             str(table_names_to_use), color="yellow", verbose=self.verbose
@@ -291,6 +800,25 @@ class SQLDatabaseSequentialChain(Chain):
             new_inputs, callbacks=_run_manager.get_child(), return_only_outputs=True
         )
 
+    def _decide_tables(self, query: str) -> List[str]:
+        _table_names = (
+            self.table_index.table_names
+            if self.table_index is not None
+            else self.sql_chain.database.get_usable_table_names()
+        )
+        table_names = ", ".join(_table_names)
+        llm_inputs = {
+            "query": query,
+            "table_names": table_names,
+        }
+        _lowercased_table_names = [name.lower() for name in _table_names]
+        table_names_from_chain = self.decider_chain.predict_and_parse(**llm_inputs)
+        return [
+            name
+            for name in table_names_from_chain
+            if name.lower() in _lowercased_table_names
+        ]
+
     @property
     def _chain_type(self) -> str:
         return "sql_database_sequential_chain"
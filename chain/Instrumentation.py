@@ -0,0 +1,159 @@
+"""Per-stage latency, token and error recording for the Louru chains."""
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from typing import Any, Deque, Dict, Iterator, List, Optional
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex[:12]
+
+
+@dataclass
+class StageRecord:
+    """One timed stage of one request."""
+
+    request_id: str
+    chain: str
+    stage: str
+    started_at: float = field(default_factory=time.time)
+    seconds: float = 0.0
+    llm_calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    estimated_tokens: bool = False
+    """True if token counts were estimated because the LLM didn't report usage."""
+    error: Optional[str] = None
+    extra: Dict[str, Any] = field(default_factory=dict)
+
+
+class MetricsRecorder:
+    """Keeps the stage records of the most recent requests and exports them.
+
+    Example:
+        .. code-block:: python
+
+            metrics = MetricsRecorder()
+            db_chain = ExploreChain(llm=llm, database=db, metrics=metrics)
+            db_chain({"query": question, "request_id": "abc123"})
+            metrics.breakdown("abc123")
+            metrics.to_prometheus()
+    """
+
+    def __init__(self, max_records: int = 10000):
+        self._records: Deque[StageRecord] = deque(maxlen=max_records)
+        self._lock = threading.Lock()
+        # Running totals for Prometheus, which must not drop as old records age out
+        self._totals: Dict[tuple, Dict[str, float]] = {}
+
+    @contextmanager
+    def stage(self, request_id: str, chain: str, stage: str) -> Iterator[StageRecord]:
+        """Time the enclosed block as one stage. Errors are recorded and re-raised."""
+        record = StageRecord(request_id=request_id, chain=chain, stage=stage)
+        start = time.perf_counter()
+        try:
+            yield record
+        except BaseException as exc:
+            record.error = f"{type(exc).__name__}: {exc}"
+            raise
+        finally:
+            record.seconds = time.perf_counter() - start
+            self.add(record)
+
+    def add(self, record: StageRecord) -> None:
+        with self._lock:
+            self._records.append(record)
+            totals = self._totals.setdefault(
+                (record.chain, record.stage),
+                {
+                    "count": 0,
+                    "seconds": 0.0,
+                    "errors": 0,
+                    "prompt_tokens": 0,
+                    "completion_tokens": 0,
+                },
+            )
+            totals["count"] += 1
+            totals["seconds"] += record.seconds
+            totals["errors"] += record.error is not None
+            totals["prompt_tokens"] += record.prompt_tokens
+            totals["completion_tokens"] += record.completion_tokens
+
+    def records(self, request_id: Optional[str] = None) -> List[StageRecord]:
+        with self._lock:
+            return [
+                record for record in self._records
+                if request_id is None or record.request_id == request_id
+            ]
+
+    def breakdown(self, request_id: str) -> List[Dict[str, Any]]:
+        """Stage records of one request as dicts, in the order they finished."""
+        return [asdict(record) for record in self.records(request_id)]
+
+    def to_jsonl(self, request_id: Optional[str] = None) -> str:
+        return "".join(
+            json.dumps(asdict(record), default=str) + "\n"
+            for record in self.records(request_id)
+        )
+
+    def write_jsonl(self, path: str, request_id: Optional[str] = None) -> None:
+        with open(path, "a") as f:
+            f.write(self.to_jsonl(request_id))
+
+    def to_prometheus(self) -> str:
+        """Totals per chain and stage in the Prometheus text exposition format."""
+        with self._lock:
+            totals = {key: dict(value) for key, value in self._totals.items()}
+        lines = [
+            "# HELP louru_stage_seconds Wall time spent in each chain stage.",
+            "# TYPE louru_stage_seconds summary",
+        ]
+        for (chain, stage), value in sorted(totals.items()):
+            labels = f'chain="{chain}",stage="{stage}"'
+            lines.append(f"louru_stage_seconds_sum{{{labels}}} {value['seconds']}")
+            lines.append(f"louru_stage_seconds_count{{{labels}}} {value['count']}")
+        lines += [
+            "# HELP louru_stage_errors_total Stages that raised an error.",
+            "# TYPE louru_stage_errors_total counter",
+        ]
+        for (chain, stage), value in sorted(totals.items()):
+            labels = f'chain="{chain}",stage="{stage}"'
+            lines.append(f"louru_stage_errors_total{{{labels}}} {value['errors']}")
+        lines += [
+            "# HELP louru_stage_tokens_total LLM tokens used by each chain stage.",
+            "# TYPE louru_stage_tokens_total counter",
+        ]
+        for (chain, stage), value in sorted(totals.items()):
+            for kind in ("prompt", "completion"):
+                labels = f'chain="{chain}",stage="{stage}",kind="{kind}"'
+                lines.append(
+                    f"louru_stage_tokens_total{{{labels}}} {value[kind + '_tokens']}"
+                )
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str) -> None:
+        """Write ``to_prometheus`` output atomically, e.g. for the
+        node_exporter textfile collector."""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp_path, path)
+
+
+@contextmanager
+def maybe_stage(
+    metrics: Optional[MetricsRecorder], request_id: str, chain: str, stage: str
+) -> Iterator[StageRecord]:
+    """``metrics.stage`` when there is a recorder, otherwise a throwaway record."""
+    if metrics is None:
+        yield StageRecord(request_id=request_id, chain=chain, stage=stage)
+        return
+    with metrics.stage(request_id, chain, stage) as record:
+        yield record
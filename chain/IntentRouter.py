@@ -0,0 +1,444 @@
+"""Fast path for common Explorer questions that skips the LLM entirely."""
+from __future__ import annotations
+
+import datetime
+import functools
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import Date, DateTime, Numeric, Time, bindparam, inspect, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.sql.elements import TextClause
+
+from chain.DateTimeParser import (
+    DEFAULT_TIMEZONE,
+    MONTHS,
+    WEEKDAYS,
+    local_now,
+    local_today,
+    parse_date,
+    parse_time,
+)
+from chain.LocalReplica import LocalReplica
+from chain.UpcomingExperiences import EVENT_END_COLUMN
+
+LIVE_MUSIC_INTENT = "live_music"
+HAPPY_HOUR_INTENT = "happy_hour"
+EVENTS_INTENT = "events"
+
+NO_RESULTS_ANSWER = "We're not finding anything like that right now.. Try something else!"
+
+# Neighborhoods people ask about. experience_raw has no location column, so
+# questions that mention one are left to the LLM chain.
+KNOWN_AREAS = (
+    "soulard", "the grove", "central west end", "cwe", "downtown", "the loop",
+    "delmar", "lafayette square", "tower grove", "benton park", "cherokee",
+    "maplewood", "clayton", "the hill", "midtown", "dogtown", "wash ave",
+    "washington ave", "south grand", "u city", "university city", "kirkwood",
+    "webster", "laclede's landing", "the landing", "fox park", "shaw",
+)
+
+_LIVE_MUSIC = re.compile(
+    r"\b(live music|music|bands?|concerts?|gigs?|jazz|blues|bluegrass|acoustic)\b"
+)
+_HAPPY_HOUR = re.compile(r"\b(happy ?hours?|drink specials?|drink deals?)\b")
+_EVENTS = re.compile(r"\b(events?|things to do|going on|happening|shows?|anything|something)\b")
+_FREE = re.compile(r"\b(free|no cover)\b")
+_PRICE_UNDER = re.compile(r"\b(?:under|less than|below|cheaper than)\s+\$?\s*(\d+(?:\.\d{1,2})?)")
+_PRICE_AT_MOST = re.compile(
+    r"\b(?:at most|up to|max(?:imum)?|no more than)\s+\$?\s*(\d+(?:\.\d{1,2})?)"
+    r"|\$\s*(\d+(?:\.\d{1,2})?)\s+or\s+(?:less|under)\b"
+)
+_ANY_PRICE = re.compile(r"\$\s*\d|\bdollars?\b|\bbucks\b")
+_TIME = r"\d{1,2}(?::\d{2})?\s*[ap]\.?\s*m\.?|noon|midnight"
+_TIME_FILTER = re.compile(rf"\b(after|before|at|around|from|starting at)\s+({_TIME})")
+_ANY_TIME = re.compile(rf"\b(?:{_TIME})")
+# "Tonight" means shows still going in the evening, not the lunch special
+EVENING = datetime.time(17, 0)
+# Things the prepared queries can't express
+_UNSUPPORTED = re.compile(
+    r"\b(how many|how much|count|average|cheapest|most|least|best|worst|who|why|"
+    r"compare|not|without|except|rating|reviews?|between)\b"
+)
+_AREA = re.compile(r"\b(?:in|near|around)\s+([A-Z][a-z]+)")
+# Characters that would turn a listing's text into markdown formatting, links or math
+_MARKDOWN = re.compile(r"([\\`*_\[\]<>#|~$])")
+_NAME_WORDS = (
+    {"I", "Louru", "St", "Louis", "Saint"}
+    | {word.capitalize() for word in WEEKDAYS}
+    | {word.capitalize() for word in MONTHS}
+)
+
+_COLUMNS = {
+    LIVE_MUSIC_INTENT: [
+        "business_name", "band_name", "event_date", "event_start_time",
+        "event_end_time", "event_price",
+    ],
+    HAPPY_HOUR_INTENT: [
+        "business_name", "happy_hour_deal", "event_date", "event_start_time",
+        "event_end_time",
+    ],
+    EVENTS_INTENT: [
+        "business_name", "event_type", "band_name", "event_date",
+        "event_start_time", "event_end_time", "event_price",
+    ],
+}
+_INTENT_CONDITIONS = {
+    LIVE_MUSIC_INTENT: "(LOWER(event_type) LIKE '%music%' OR band_name IS NOT NULL)",
+    HAPPY_HOUR_INTENT: "(LOWER(event_type) LIKE '%happy hour%' OR happy_hour_deal IS NOT NULL)",
+    EVENTS_INTENT: None,
+}
+_CLAUSES = {
+    "start_date": "event_date >= :start_date",
+    "end_date": "event_date <= :end_date",
+    "start_time_from": "event_start_time >= :start_time_from",
+    "start_time_to": "event_start_time <= :start_time_to",
+    "start_time_before": "event_start_time < :start_time_before",
+    # A show ending before it starts runs past midnight, so it is still on in the evening
+    "evening": (
+        "(COALESCE(event_end_time, event_start_time) >= :evening "
+        "OR event_end_time < event_start_time)"
+    ),
+    # Today's shows that are already over
+    "not_ended": f"({EVENT_END_COLUMN} IS NULL OR {EVENT_END_COLUMN} > :not_ended)",
+    "free": "event_price = 0",
+    "price_under": "event_price < :price_under",
+    "price_at_most": "event_price <= :price_at_most",
+}
+_PARAM_TYPES = {
+    "start_date": Date,
+    "end_date": Date,
+    "start_time_from": Time,
+    "start_time_to": Time,
+    "start_time_before": Time,
+    "evening": Time,
+    "not_ended": DateTime,
+    "price_under": Numeric,
+    "price_at_most": Numeric,
+}
+_HEADERS = {
+    LIVE_MUSIC_INTENT: "Here's the live music we found {when}{price}:",
+    HAPPY_HOUR_INTENT: "Here are the happy hours we found {when}{price}:",
+    EVENTS_INTENT: "Here's what's going on {when}{price}:",
+}
+
+
+@dataclass
+class Intent:
+    """A classified question and the parameters of its prepared query."""
+
+    name: str
+    params: Dict[str, Any] = field(default_factory=dict)
+    when: str = "coming up"
+    """How the date window reads in the answer, e.g. "tonight"."""
+    price: str = ""
+    """How the price filter reads in the answer, e.g. " under $10"."""
+
+
+@dataclass
+class RoutedAnswer:
+    """The answer to a question the router handled itself."""
+
+    intent: Intent
+    sql: str
+    rows: List[Dict[str, Any]]
+    answer: str
+    seconds: float
+
+
+def _weekend(today: datetime.date, weeks_ahead: int = 0) -> Tuple[datetime.date, datetime.date]:
+    friday = today + datetime.timedelta(days=4 - today.weekday() + 7 * weeks_ahead)
+    sunday = friday + datetime.timedelta(days=2)
+    return max(friday, today), sunday
+
+
+def date_window(
+    question: str, today: datetime.date
+) -> Tuple[datetime.date, Optional[datetime.date], str]:
+    """``(start, end, label)`` of the dates a question asks about.
+
+    ``end`` is None for open-ended questions, which cover everything from today.
+    """
+    question = question.lower()
+    if re.search(r"\b(tonight|tonite|this evening)\b", question):
+        return today, today, "tonight"
+    if re.search(r"\btoday\b", question):
+        return today, today, "today"
+    if re.search(r"\b(tomorrow|tmrw)\b", question):
+        tomorrow = today + datetime.timedelta(days=1)
+        return tomorrow, tomorrow, "tomorrow"
+    if re.search(r"\bnext weekend\b", question):
+        return (*_weekend(today, 1), "next weekend")
+    if re.search(r"\bweekend\b", question):
+        return (*_weekend(today), "this weekend")
+    if re.search(r"\bnext week\b", question):
+        monday = today + datetime.timedelta(days=7 - today.weekday())
+        return monday, monday + datetime.timedelta(days=6), "next week"
+    if re.search(r"\bthis week\b", question):
+        return today, today + datetime.timedelta(days=6 - today.weekday()), "this week"
+    # Drop times first so "7-10pm" isn't read as July 10th
+    date = parse_date(_ANY_TIME.sub(" ", question), today=today)
+    if date is not None:
+        day = datetime.date(date["year"], date["month"], date["day"])
+        return day, day, f"on {day:%A, %B} {day.day}"
+    return today, None, "coming up"
+
+
+def _format_time(value: Any) -> str:
+    if not isinstance(value, datetime.time):
+        return str(value)
+    return value.strftime("%I:%M %p").lstrip("0")
+
+
+def _escape_markdown(value: Any) -> str:
+    return _MARKDOWN.sub(r"\\\1", str(value))
+
+
+def _format_price(value: Any) -> str:
+    if value is None:
+        return ""
+    if float(value) == 0:
+        return "free"
+    return f"\\${float(value):g}"
+
+
+@functools.lru_cache(maxsize=None)
+def prepared_query(
+    intent: str, clauses: Tuple[str, ...], limit: int, table_name: str = "experience_raw"
+) -> TextClause:
+    """The parameterized query for ``intent`` with the given optional filters."""
+    conditions = [_INTENT_CONDITIONS[intent]] + [_CLAUSES[clause] for clause in clauses]
+    where = " AND ".join(condition for condition in conditions if condition)
+    query = text(
+        f"SELECT {', '.join(_COLUMNS[intent])} FROM {table_name} "
+        f"WHERE {where} ORDER BY event_date, event_start_time LIMIT {int(limit)}"
+    )
+    return query.bindparams(
+        *[bindparam(clause, type_=_PARAM_TYPES[clause]) for clause in clauses if clause in _PARAM_TYPES]
+    ).columns(event_date=Date, event_start_time=Time, event_end_time=Time)
+
+
+class IntentRouter:
+    """Answers the most common Explorer questions with prepared queries.
+
+    Questions about live music, happy hours, or events on a date or under a
+    price are classified with patterns, their date window, time and price are pulled
+    out, and a parameterized query over ``table_name`` is run and rendered
+    from a template. Anything else, including questions that name an area,
+    a band or a venue, returns None from ``route`` so the caller can fall
+    through to ``ExploreChain``.
+
+    Example:
+        .. code-block:: python
+
+            router = IntentRouter(engine)
+            routed = router.route("Where can I listen to live music tonight?")
+            if routed is None:
+                answer = db_chain.run(question)
+    """
+
+    def __init__(
+        self,
+        engine: Engine,
+        replica: Optional[LocalReplica] = None,
+        table_name: str = "experience_raw",
+        max_rows: int = 10,
+        timezone: str = DEFAULT_TIMEZONE,
+        known_areas: Sequence[str] = KNOWN_AREAS,
+    ):
+        self.engine = engine
+        self.replica = replica
+        self.table_name = table_name
+        self.max_rows = max_rows
+        self.timezone = timezone
+        self.known_areas = [area.lower() for area in known_areas]
+        self._lock = threading.Lock()
+        self._has_end_column: Dict[Engine, bool] = {}
+        self.questions = 0
+        self.hits = 0
+        self.hit_seconds = 0.0
+        self.classify_seconds = 0.0
+        self.intents: Dict[str, int] = {}
+        self.fall_throughs: Dict[str, int] = {}
+
+    def _fall_through_reason(self, question: str) -> Optional[str]:
+        lowered = question.lower()
+        if _UNSUPPORTED.search(lowered):
+            return "unsupported"
+        if any(re.search(rf"\b{re.escape(area)}\b", lowered) for area in self.known_areas):
+            return "area"
+        if _AREA.search(question):
+            return "area"
+        # Capitalized words past the first are usually a band or venue name
+        words = re.findall(r"[A-Za-z][\w']*", question)[1:]
+        if any(word[0].isupper() and word not in _NAME_WORDS for word in words):
+            return "name"
+        return None
+
+    def classify(self, question: str) -> Tuple[Optional[Intent], Optional[str]]:
+        """``(intent, None)`` if the router can answer, else ``(None, reason)``."""
+        reason = self._fall_through_reason(question)
+        if reason:
+            return None, reason
+        lowered = question.lower()
+        names = [
+            name
+            for name, pattern in ((LIVE_MUSIC_INTENT, _LIVE_MUSIC), (HAPPY_HOUR_INTENT, _HAPPY_HOUR))
+            if pattern.search(lowered)
+        ]
+        if len(names) > 1:
+            return None, "ambiguous"
+
+        params: Dict[str, Any] = {}
+        price = ""
+        if _FREE.search(lowered):
+            params["free"] = True
+            price = " for free"
+        elif _PRICE_UNDER.search(lowered):
+            params["price_under"] = float(_PRICE_UNDER.search(lowered)[1])
+            price = f" under \\${params['price_under']:g}"
+        elif _PRICE_AT_MOST.search(lowered):
+            match = _PRICE_AT_MOST.search(lowered)
+            params["price_at_most"] = float(match[1] or match[2])
+            price = f" for \\${params['price_at_most']:g} or less"
+        elif _ANY_PRICE.search(lowered):
+            return None, "unsupported"
+        today = local_today(self.timezone)
+        start, end, when = date_window(lowered, today)
+        if not names:
+            # Plain "what's on" questions need a price or a date to go on
+            if not _EVENTS.search(lowered) or not (params or end is not None):
+                return None, "no_intent"
+            names = [EVENTS_INTENT]
+
+        params["start_date"] = start
+        if end is not None:
+            params["end_date"] = end
+        if start == today:
+            params["not_ended"] = local_now(self.timezone)
+
+        time_filters = _TIME_FILTER.findall(lowered)
+        if len(time_filters) != len(_ANY_TIME.findall(lowered)) or len(time_filters) > 1:
+            # A time we can't place, like "7-10pm"
+            return None, "unsupported"
+        if not time_filters and when == "tonight":
+            params["evening"] = EVENING
+        if time_filters:
+            word, time_text = time_filters[0]
+            parsed = parse_time(time_text)
+            if parsed is None:
+                return None, "unsupported"
+            at = datetime.time(parsed["hour"], parsed["minute"])
+            if word == "before":
+                params["start_time_before"] = at
+            elif word in ("after", "from", "starting at"):
+                params["start_time_from"] = at
+            else:
+                # "at 8pm" also matches shows starting within the hour around it
+                minutes = at.hour * 60 + at.minute
+                params["start_time_from"] = datetime.time(*divmod(max(minutes - 60, 0), 60))
+                params["start_time_to"] = datetime.time(*divmod(min(minutes + 60, 23 * 60 + 59), 60))
+            when += f" {word} {_format_time(at)}"
+        return Intent(name=names[0], params=params, when=when, price=price), None
+
+    def _engine(self) -> Engine:
+        if self.replica is not None and self.replica.ready:
+            return self.replica.engine
+        return self.engine
+
+    def _has_end(self, engine: Engine) -> bool:
+        # event_end_ts only exists once ensure_timestamp_columns has run
+        if engine not in self._has_end_column:
+            columns = inspect(engine).get_columns(self.table_name)
+            self._has_end_column[engine] = EVENT_END_COLUMN in (
+                column["name"].lower() for column in columns
+            )
+        return self._has_end_column[engine]
+
+    def render(self, intent: Intent, rows: List[Dict[str, Any]]) -> str:
+        if not rows:
+            return NO_RESULTS_ANSWER
+        single_day = intent.params.get("start_date") == intent.params.get("end_date")
+        lines = [_HEADERS[intent.name].format(when=intent.when, price=intent.price)]
+        for row in rows:
+            times = " - ".join(
+                _format_time(row[column])
+                for column in ("event_start_time", "event_end_time")
+                if row.get(column) is not None
+            )
+            date = row.get("event_date")
+            when = ", ".join(
+                part
+                for part in (
+                    None if single_day or date is None else f"{date:%a %b} {date.day}",
+                    times,
+                )
+                if part
+            )
+            # Listings are user submitted, so their text must not turn into markdown
+            band_name, event_type, deal = (
+                _escape_markdown(row.get(column) or "")
+                for column in ("band_name", "event_type", "happy_hour_deal")
+            )
+            details = [
+                band_name if intent.name != HAPPY_HOUR_INTENT else None,
+                event_type if intent.name == EVENTS_INTENT else None,
+                when,
+                _format_price(row.get("event_price")) if "event_price" in row else None,
+                deal,
+            ]
+            lines.append(
+                f"- **{_escape_markdown(row['business_name'])}**: "
+                + ", ".join(d for d in details if d)
+            )
+        return "\n".join(lines)
+
+    def route(self, question: str) -> Optional[RoutedAnswer]:
+        """Answer ``question`` from a prepared query, or None to fall through."""
+        start = time.perf_counter()
+        intent, reason = self.classify(question)
+        classified = time.perf_counter()
+        if intent is None:
+            with self._lock:
+                self.questions += 1
+                self.classify_seconds += classified - start
+                self.fall_throughs[reason] = self.fall_throughs.get(reason, 0) + 1
+            return None
+
+        engine = self._engine()
+        clauses = tuple(
+            clause
+            for clause in _CLAUSES
+            if clause in intent.params and (clause != "not_ended" or self._has_end(engine))
+        )
+        query = prepared_query(intent.name, clauses, self.max_rows, self.table_name)
+        params = {key: intent.params[key] for key in clauses if key in _PARAM_TYPES}
+        with engine.connect() as connection:
+            rows = [dict(row._mapping) for row in connection.execute(query, params)]
+        answer = self.render(intent, rows)
+        seconds = time.perf_counter() - start
+        with self._lock:
+            self.questions += 1
+            self.hits += 1
+            self.classify_seconds += classified - start
+            self.hit_seconds += seconds
+            self.intents[intent.name] = self.intents.get(intent.name, 0) + 1
+        return RoutedAnswer(intent=intent, sql=str(query), rows=rows, answer=answer, seconds=seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit rate, latency of routed answers and why questions fell through."""
+        with self._lock:
+            return {
+                "questions": self.questions,
+                "hits": self.hits,
+                "hit_rate": self.hits / self.questions if self.questions else None,
+                "avg_hit_seconds": self.hit_seconds / self.hits if self.hits else None,
+                "avg_classify_seconds": (
+                    self.classify_seconds / self.questions if self.questions else None
+                ),
+                "intents": dict(self.intents),
+                "fall_throughs": dict(self.fall_throughs),
+            }
@@ -0,0 +1,390 @@
+"""Local SQLite read replica of experience_raw for the Explorer."""
+from __future__ import annotations
+
+import datetime
+import os
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterator, Optional, Sequence, Tuple
+
+import pandas as pd
+import sqlglot
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.engine import Engine
+from sqlglot import exp
+
+from chain.DateTimeParser import DEFAULT_TIMEZONE, local_now
+from chain.SQLValidator import SQLGLOT_DIALECTS
+
+if TYPE_CHECKING:
+    from langchain.utilities.sql_database import SQLDatabase
+
+WATERMARK_COLUMN = "ingested_at"
+DEFAULT_INDEX_COLUMNS = ("event_date", "event_type")
+# SQLite date modifier and multiplier for each DATEADD unit
+SQLITE_DATE_UNITS = {
+    "SECOND": ("SECOND", 1),
+    "MINUTE": ("MINUTE", 1),
+    "HOUR": ("HOUR", 1),
+    "DAY": ("DAY", 1),
+    "WEEK": ("DAY", 7),
+    "MONTH": ("MONTH", 1),
+    "QUARTER": ("MONTH", 3),
+    "YEAR": ("YEAR", 1),
+}
+SUB_DAY_UNITS = {"SECOND", "MINUTE", "HOUR"}
+TIMESTAMP_TYPES = (exp.CurrentTimestamp, exp.Localtimestamp, exp.CurrentTime, exp.Localtime)
+CURRENT_TIME_TYPES = (exp.CurrentDate, *TIMESTAMP_TYPES)
+
+
+def add_timestamp_columns(engine: Engine, table_name: str, columns: Sequence[str]) -> None:
+    """Add each of ``columns`` that ``table_name`` lacks as a naive timestamp.
+
+    A table that doesn't exist yet is left alone; the first load creates it
+    with the columns.
+    """
+    inspector = inspect(engine)
+    if not inspector.has_table(table_name):
+        return
+    existing = {column["name"].lower() for column in inspector.get_columns(table_name)}
+    column_type = "TIMESTAMP_NTZ" if engine.dialect.name == "snowflake" else "TIMESTAMP"
+    with engine.begin() as conn:
+        for column in columns:
+            if column not in existing:
+                conn.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {column} {column_type}"))
+
+
+def ensure_watermark_column(engine: Engine, table_name: str = "experience_raw") -> None:
+    """Add the ``ingested_at`` watermark column to ``table_name`` if it lacks it."""
+    add_timestamp_columns(engine, table_name, [WATERMARK_COLUMN])
+
+
+def stamp_ingested_at(df: pd.DataFrame) -> pd.DataFrame:
+    """Add the UTC ``ingested_at`` watermark the replica syncs on.
+
+    ``ensure_watermark_column`` adds the column to experience_raw.
+    """
+    df = df.copy()
+    df[WATERMARK_COLUMN] = pd.Timestamp.utcnow().tz_localize(None)
+    return df
+
+
+def _translate_date_add(node: exp.Expression) -> exp.Expression:
+    """``DATEADD`` as SQLite's ``DATE``, or ``DATETIME`` for times and sub-day units."""
+    if not isinstance(node, exp.DateAdd):
+        return node
+    unit = node.text("unit").upper().rstrip("S") or "DAY"
+    if unit not in SQLITE_DATE_UNITS:
+        raise ValueError(f"Can't translate DATEADD unit {unit}")
+    sqlite_unit, multiplier = SQLITE_DATE_UNITS[unit]
+    amount = node.expression
+    if isinstance(amount, exp.Literal) and amount.is_int:
+        modifier: exp.Expression = exp.Literal.string(
+            f"{int(amount.this) * multiplier} {sqlite_unit}"
+        )
+    else:
+        # e.g. DATE(event_date, n || ' DAY')
+        amount = amount.copy()
+        if multiplier != 1:
+            # || binds tighter than * in SQLite
+            amount = exp.Paren(
+                this=exp.Mul(this=exp.Paren(this=amount), expression=exp.Literal.number(multiplier))
+            )
+        modifier = exp.DPipe(this=amount, expression=exp.Literal.string(f" {sqlite_unit}"))
+    timestamp = unit in SUB_DAY_UNITS or isinstance(node.this, TIMESTAMP_TYPES)
+    return exp.Anonymous(
+        this="DATETIME" if timestamp else "DATE", expressions=[node.this.copy(), modifier]
+    )
+
+
+class LocalReplica:
+    """SQLite copy of a warehouse table that Explorer queries run against.
+
+    The first ``sync`` copies the whole table. Later syncs only fetch rows whose
+    ``ingested_at`` is at or after the newest one already copied, so a sync
+    after a portal submit costs one small warehouse query. Tables without the
+    watermark column are fully re-copied on every sync instead, and only a full
+    copy, e.g. ``request_sync(full=True)``, picks up rows deleted from the
+    warehouse. Queries are written for the warehouse dialect and translated to
+    SQLite by ``translate``.
+
+    ``on_sync`` is called with the summary of every sync that found new rows or
+    replaced a non-empty table, e.g. to invalidate cached answers.
+
+    Example:
+        .. code-block:: python
+
+            replica = LocalReplica(sf_engine, path=".cache/replica.sqlite")
+            replica.sync()
+            replica.start(interval=300)
+            db_chain = ExploreChain(llm=llm, database=db, replica=replica)
+    """
+
+    def __init__(
+        self,
+        source_engine: Engine,
+        path: str = ".cache/replica.sqlite",
+        table_name: str = "experience_raw",
+        index_columns: Sequence[str] = DEFAULT_INDEX_COLUMNS,
+        timezone: str = DEFAULT_TIMEZONE,
+        batch_size: int = 5000,
+        on_sync: Optional[Callable[[Dict[str, Any]], None]] = None,
+    ):
+        self.source_engine = source_engine
+        self.path = path
+        self.table_name = table_name
+        self.index_columns = list(index_columns)
+        self.timezone = timezone
+        self.batch_size = batch_size
+        self.on_sync = on_sync
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.engine = create_engine(
+            f"sqlite:///{path}", connect_args={"check_same_thread": False}
+        )
+
+        @event.listens_for(self.engine, "connect")
+        def on_connect(dbapi_connection: Any, connection_record: Any) -> None:
+            # WAL lets Explorer queries read while a sync writes
+            dbapi_connection.execute("PRAGMA journal_mode=WAL")
+
+        self._sync_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._database: Optional[SQLDatabase] = None
+        self._ready: Optional[bool] = None
+        self._has_watermark: Optional[bool] = None
+        self._sync_requested = threading.Event()
+        self._full_sync_requested = False
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.last_synced_at: Optional[float] = None
+        self.syncs = 0
+        self.sync_errors = 0
+        self.sync_seconds = 0.0
+        self.last_sync_seconds: Optional[float] = None
+        self.rows_copied = 0
+        self.last_sync_rows = 0
+        self.queries = 0
+        self.fallbacks = 0
+
+    @property
+    def ready(self) -> bool:
+        """Whether the table has been copied at least once."""
+        if not self._ready:
+            self._ready = inspect(self.engine).has_table(self.table_name)
+        return self._ready
+
+    def _watermark(self) -> Optional[str]:
+        with self.engine.connect() as conn:
+            return conn.execute(
+                text(f"SELECT MAX({WATERMARK_COLUMN}) FROM {self.table_name}")
+            ).scalar()
+
+    def _read_source(self, query: str, params: Dict[str, Any]) -> Iterator[pd.DataFrame]:
+        return pd.read_sql(
+            text(query), self.source_engine, params=params, chunksize=self.batch_size
+        )
+
+    def _full_copy(self) -> Tuple[int, int]:
+        # Copy into a scratch table and swap it in, so readers never see it half full
+        scratch = f"{self.table_name}__sync"
+        with self.engine.begin() as conn:
+            conn.execute(text(f"DROP TABLE IF EXISTS {scratch}"))
+        rows = 0
+        for chunk in self._read_source(f"SELECT * FROM {self.table_name}", {}):
+            chunk.to_sql(scratch, self.engine, if_exists="append", index=False)
+            rows += len(chunk)
+        if not inspect(self.engine).has_table(scratch):
+            # An empty source still replaces the copy, with an empty table of its columns
+            pd.read_sql(
+                text(f"SELECT * FROM {self.table_name} WHERE 1 = 0"), self.source_engine
+            ).to_sql(scratch, self.engine, index=False)
+        with self.engine.begin() as conn:
+            replaced = (
+                conn.execute(text(f"SELECT COUNT(*) FROM {self.table_name}")).scalar()
+                if self.ready
+                else 0
+            )
+            conn.execute(text(f"DROP TABLE IF EXISTS {self.table_name}"))
+            conn.execute(text(f"ALTER TABLE {scratch} RENAME TO {self.table_name}"))
+        return rows, replaced
+
+    def _incremental_copy(self, watermark: str) -> Tuple[int, int]:
+        # Re-fetch rows at the watermark itself, since more may have landed
+        # with the same timestamp after the last sync
+        chunks = list(
+            self._read_source(
+                f"SELECT * FROM {self.table_name} WHERE {WATERMARK_COLUMN} >= :watermark",
+                {"watermark": pd.Timestamp(watermark).to_pydatetime()},
+            )
+        )
+        with self.engine.begin() as conn:
+            deleted = conn.execute(
+                text(f"DELETE FROM {self.table_name} WHERE {WATERMARK_COLUMN} >= :watermark"),
+                {"watermark": watermark},
+            ).rowcount
+            for chunk in chunks:
+                chunk.to_sql(self.table_name, conn, if_exists="append", index=False)
+        return sum(len(chunk) for chunk in chunks), deleted
+
+    def _create_indexes(self) -> None:
+        columns = [
+            column["name"] for column in inspect(self.engine).get_columns(self.table_name)
+        ]
+        with self.engine.begin() as conn:
+            for column in self.index_columns + [WATERMARK_COLUMN]:
+                if column in columns:
+                    conn.execute(
+                        text(
+                            f"CREATE INDEX IF NOT EXISTS ix_{self.table_name}_{column} "
+                            f"ON {self.table_name} ({column})"
+                        )
+                    )
+
+    def sync(self, full: bool = False) -> Dict[str, Any]:
+        """Copy new rows, or the whole table if ``full``. Returns what the sync cost."""
+        with self._sync_lock:
+            start = time.perf_counter()
+            try:
+                if self._has_watermark is None:
+                    source_columns = inspect(self.source_engine).get_columns(self.table_name)
+                    self._has_watermark = WATERMARK_COLUMN in (
+                        column["name"].lower() for column in source_columns
+                    )
+                incremental = self._has_watermark and self.ready and not full
+                watermark = self._watermark() if incremental else None
+                if watermark is None:
+                    rows, replaced = self._full_copy()
+                    new_rows = rows - replaced
+                    mode = "full"
+                else:
+                    rows, refetched = self._incremental_copy(watermark)
+                    new_rows = rows - refetched
+                    mode = "incremental"
+                self._ready = None
+                if self.ready:
+                    self._create_indexes()
+            except Exception:
+                with self._stats_lock:
+                    self.sync_errors += 1
+                raise
+            seconds = time.perf_counter() - start
+            with self._stats_lock:
+                self.syncs += 1
+                self.sync_seconds += seconds
+                self.last_sync_seconds = seconds
+                self.rows_copied += rows
+                self.last_sync_rows = rows
+                self.last_synced_at = time.time()
+                if mode == "full":
+                    # The table was replaced, so reflect it again
+                    self._database = None
+        summary = {"mode": mode, "rows": rows, "new_rows": new_rows, "seconds": seconds}
+        # A full copy may have updated or deleted rows without changing the count
+        changed = new_rows or (mode == "full" and (rows or replaced))
+        if changed and self.on_sync is not None:
+            self.on_sync(summary)
+        return summary
+
+    def request_sync(self, full: bool = False) -> None:
+        """Sync soon: on the background thread if started, otherwise now."""
+        if self._thread is not None and self._thread.is_alive():
+            self._full_sync_requested = self._full_sync_requested or full
+            self._sync_requested.set()
+        else:
+            self.sync(full)
+
+    def start(self, interval: float = 300) -> None:
+        """Sync every ``interval`` seconds, and on ``request_sync``, in a daemon thread."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopped.clear()
+
+        def loop() -> None:
+            while not self._stopped.is_set():
+                self._sync_requested.wait(interval)
+                self._sync_requested.clear()
+                if self._stopped.is_set():
+                    return
+                full, self._full_sync_requested = self._full_sync_requested, False
+                try:
+                    self.sync(full)
+                except Exception:
+                    # Counted in sync_errors; keep serving the last good copy
+                    pass
+
+        self._thread = threading.Thread(target=loop, name="replica-sync", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._sync_requested.set()
+
+    def translate(self, sql: str, dialect: str = "snowflake") -> str:
+        """Rewrite a warehouse query in SQLite's dialect.
+
+        ``current_date()``, ``current_timestamp()`` and ``current_time()`` are
+        pinned to the wall clock in ``timezone``, since SQLite's are UTC and
+        the event columns hold local times.
+
+        Raises:
+            ValueError: the query does date arithmetic SQLite can't express,
+                e.g. ``current_date() + 7``.
+        """
+        now = local_now(self.timezone)
+        tree = sqlglot.parse_one(sql, read=SQLGLOT_DIALECTS.get(dialect, dialect))
+        for node in tree.find_all(exp.Add, exp.Sub):
+            operands = (node.this.unnest(), node.expression.unnest())
+            if any(isinstance(o, (*CURRENT_TIME_TYPES, exp.Interval)) for o in operands):
+                # SQLite would treat the date string as a number
+                raise ValueError(f"Can't translate date arithmetic: {node.sql()}")
+        # Rewrite DATEADD before pinning, while current_timestamp() is still recognisable
+        tree = tree.transform(_translate_date_add)
+
+        def pin(node: exp.Expression) -> exp.Expression:
+            if isinstance(node, exp.CurrentDate):
+                return exp.Literal.string(now.date().isoformat())
+            if isinstance(node, (exp.CurrentTimestamp, exp.Localtimestamp)):
+                return exp.Literal.string(now.isoformat(sep=" "))
+            if isinstance(node, (exp.CurrentTime, exp.Localtime)):
+                return exp.Literal.string(now.time().isoformat())
+            return node
+
+        return tree.transform(pin).sql(dialect="sqlite")
+
+    @property
+    def database(self) -> SQLDatabase:
+        """``SQLDatabase`` over the replica, so results format like the warehouse's."""
+        if self._database is None:
+            # langchain is slow to import and only needed once a query runs here
+            from langchain.utilities.sql_database import SQLDatabase
+
+            self._database = SQLDatabase(self.engine, include_tables=[self.table_name])
+        return self._database
+
+    def record_query(self, fallback: bool = False) -> None:
+        with self._stats_lock:
+            if fallback:
+                self.fallbacks += 1
+            else:
+                self.queries += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Replica lag and what syncing has cost so far."""
+        with self._stats_lock:
+            last_synced_at = self.last_synced_at
+            return {
+                "lag_seconds": time.time() - last_synced_at if last_synced_at else None,
+                "last_synced_at": (
+                    datetime.datetime.fromtimestamp(last_synced_at).isoformat()
+                    if last_synced_at else None
+                ),
+                "syncs": self.syncs,
+                "sync_errors": self.sync_errors,
+                "sync_seconds": self.sync_seconds,
+                "last_sync_seconds": self.last_sync_seconds,
+                "rows_copied": self.rows_copied,
+                "last_sync_rows": self.last_sync_rows,
+                "queries": self.queries,
+                "fallbacks": self.fallbacks,
+            }
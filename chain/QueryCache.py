@@ -0,0 +1,298 @@
+"""Two-level cache for ExploreChain: question -> SQL and SQL -> result/answer."""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional, Sequence, Tuple
+
+from chain.DateTimeParser import DEFAULT_TIMEZONE, local_today
+
+
+def normalize_question(question: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace so trivially
+    different phrasings of the same question share a cache entry."""
+    question = question.lower()
+    question = re.sub(r"[^\w\s$%:/'-]", " ", question)
+    return " ".join(question.split())
+
+
+def _hash_key(*parts: str) -> str:
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+class BaseCacheBackend(ABC):
+    """Key/value store used by ``QueryCache``.
+
+    Backends evict least recently used entries past ``maxsize`` and expire
+    entries older than ``ttl`` seconds. They also hold the data version, which
+    is bumped whenever the underlying table changes.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = 86400):
+        self.maxsize = maxsize
+        self.ttl = ttl
+
+    def _is_fresh(self, created_at: float) -> bool:
+        return self.ttl is None or time.time() - created_at < self.ttl
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[Any]:
+        """Return the cached value or None."""
+
+    @abstractmethod
+    def set(self, key: str, value: Any) -> None:
+        """Store a JSON-serializable value."""
+
+    @abstractmethod
+    def clear(self) -> None:
+        """Drop every entry."""
+
+    @property
+    @abstractmethod
+    def data_version(self) -> int:
+        """Current version of the cached data."""
+
+    @abstractmethod
+    def bump_data_version(self) -> int:
+        """Increment and return the data version."""
+
+
+class InMemoryCacheBackend(BaseCacheBackend):
+    """Process-local LRU/TTL backend."""
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = 86400):
+        super().__init__(maxsize=maxsize, ttl=ttl)
+        self._entries: OrderedDict[str, Tuple[float, Any]] = OrderedDict()
+        self._data_version = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if not self._is_fresh(entry[0]):
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = (time.time(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def data_version(self) -> int:
+        return self._data_version
+
+    def bump_data_version(self) -> int:
+        with self._lock:
+            self._data_version += 1
+            return self._data_version
+
+
+class SQLiteCacheBackend(BaseCacheBackend):
+    """LRU/TTL backend in a local SQLite file, shared by every process on the host."""
+
+    def __init__(
+        self,
+        path: str = ".cache/query_cache.sqlite",
+        maxsize: int = 10000,
+        ttl: Optional[float] = 86400,
+    ):
+        super().__init__(maxsize=maxsize, ttl=ttl)
+        self.path = path
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS cache_accessed_at ON cache (accessed_at)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER)"
+            )
+            conn.execute(
+                "INSERT OR IGNORE INTO meta (name, value) VALUES ('data_version', 0)"
+            )
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT value, created_at FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if not self._is_fresh(row[1]):
+                conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                return None
+            conn.execute(
+                "UPDATE cache SET accessed_at = ? WHERE key = ?", (time.time(), key)
+            )
+            return json.loads(row[0])
+
+    def set(self, key: str, value: Any) -> None:
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now, now),
+            )
+            conn.execute(
+                "DELETE FROM cache WHERE key IN (SELECT key FROM cache "
+                "ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.maxsize,),
+            )
+
+    def clear(self) -> None:
+        with self._connect() as conn:
+            conn.execute("DELETE FROM cache")
+
+    def __len__(self) -> int:
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    @property
+    def data_version(self) -> int:
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT value FROM meta WHERE name = 'data_version'"
+            ).fetchone()[0]
+
+    def bump_data_version(self) -> int:
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE meta SET value = value + 1 WHERE name = 'data_version'"
+            )
+            return conn.execute(
+                "SELECT value FROM meta WHERE name = 'data_version'"
+            ).fetchone()[0]
+
+
+class QueryCache:
+    """Question -> SQL and SQL -> (result, answer) cache for ExploreChain.
+
+    The first level is keyed on the normalized question and the current date
+    in ``timezone``, the venue's rather than the server's, since questions
+    like "tonight" resolve differently from day to day. The second level is
+    keyed on the SQL text, the date and the data version, so calling
+    ``invalidate`` after a write to the table retires every cached answer
+    without throwing away the generated SQL.
+
+    Example:
+        .. code-block:: python
+
+            query_cache = QueryCache(SQLiteCacheBackend(".cache/query_cache.sqlite"))
+            db_chain = ExploreChain(llm=llm, database=db, query_cache=query_cache)
+            ...
+            df.to_sql("experience_raw", ...)
+            query_cache.invalidate()
+    """
+
+    def __init__(
+        self,
+        backend: Optional[BaseCacheBackend] = None,
+        timezone: str = DEFAULT_TIMEZONE,
+    ):
+        self.backend = backend or InMemoryCacheBackend()
+        self.timezone = timezone
+        self._lock = threading.Lock()
+        self.sql_hits = 0
+        self.sql_misses = 0
+        self.answer_hits = 0
+        self.answer_misses = 0
+
+    def _sql_key(self, question: str, table_names: Optional[Sequence[str]]) -> str:
+        tables = ",".join(sorted(table_names or []))
+        today = local_today(self.timezone).isoformat()
+        return "sql:" + _hash_key(normalize_question(question), tables, today)
+
+    def _answer_key(self, sql_cmd: str) -> str:
+        # SQL that uses current_date() returns different rows tomorrow
+        sql_text = " ".join(sql_cmd.split())
+        today = local_today(self.timezone).isoformat()
+        return "answer:" + _hash_key(sql_text, str(self.backend.data_version), today)
+
+    def get_sql(
+        self, question: str, table_names: Optional[Sequence[str]] = None
+    ) -> Optional[str]:
+        sql_cmd = self.backend.get(self._sql_key(question, table_names))
+        with self._lock:
+            if sql_cmd is None:
+                self.sql_misses += 1
+            else:
+                self.sql_hits += 1
+        return sql_cmd
+
+    def set_sql(
+        self, question: str, sql_cmd: str, table_names: Optional[Sequence[str]] = None
+    ) -> None:
+        self.backend.set(self._sql_key(question, table_names), sql_cmd)
+
+    def get_answer(self, sql_cmd: str) -> Optional[Tuple[str, str]]:
+        """Return the cached ``(result, answer)`` pair for a SQL command."""
+        entry = self.backend.get(self._answer_key(sql_cmd))
+        with self._lock:
+            if entry is None:
+                self.answer_misses += 1
+            else:
+                self.answer_hits += 1
+        if entry is None:
+            return None
+        return entry["result"], entry["answer"]
+
+    def set_answer(self, sql_cmd: str, result: str, answer: str) -> None:
+        self.backend.set(
+            self._answer_key(sql_cmd), {"result": result, "answer": answer}
+        )
+
+    def invalidate(self) -> int:
+        """Retire cached results and answers after the underlying data changed."""
+        return self.backend.bump_data_version()
+
+    def clear(self) -> None:
+        """Drop both levels."""
+        self.backend.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "sql_hits": self.sql_hits,
+                "sql_misses": self.sql_misses,
+                "answer_hits": self.answer_hits,
+                "answer_misses": self.answer_misses,
+                "data_version": self.backend.data_version,
+            }
@@ -0,0 +1,137 @@
+"""Row and token bounded fetching of query results for the answer prompt."""
+from __future__ import annotations
+
+import datetime
+import math
+from dataclasses import dataclass, field
+from typing import Any, List, Optional, Sequence
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+CHARS_PER_TOKEN = 4
+MAX_VALUE_CHARS = 200
+
+
+def estimate_tokens(value: str) -> int:
+    """Rough token count for English text, good enough for budgeting prompts."""
+    return math.ceil(len(value) / CHARS_PER_TOKEN)
+
+
+def _format_value(value: Any) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, (datetime.date, datetime.time)):
+        value = value.isoformat()
+    value = " ".join(str(value).split()).replace("|", "/")
+    if len(value) > MAX_VALUE_CHARS:
+        value = value[: MAX_VALUE_CHARS - 3] + "..."
+    return value
+
+
+@dataclass
+class BoundedResult:
+    """Rows kept within budget and how many were left out."""
+
+    columns: List[str] = field(default_factory=list)
+    rows: List[Sequence[Any]] = field(default_factory=list)
+    truncated: bool = False
+    rows_omitted: Optional[int] = 0
+    """Rows not shown, or None if the database can't say how many."""
+
+    @property
+    def text(self) -> str:
+        """Pipe-separated header and rows, plus a note about omitted rows.
+
+        Empty when the query returned nothing, like ``SQLDatabase.run``.
+        """
+        if not self.rows:
+            return ""
+        lines = ["|".join(self.columns)]
+        lines.extend("|".join(_format_value(v) for v in row) for row in self.rows)
+        if self.truncated:
+            if self.rows_omitted:
+                lines.append(f"({self.rows_omitted} more rows not shown)")
+            else:
+                lines.append("(more rows not shown)")
+        return "\n".join(lines)
+
+
+def set_schema(connection: Connection, schema: Optional[str]) -> None:
+    """Point ``connection`` at ``schema`` the way ``SQLDatabase._execute`` does."""
+    if schema is None:
+        return
+    dialect = connection.dialect.name
+    if dialect == "snowflake":
+        connection.exec_driver_sql(f"ALTER SESSION SET search_path='{schema}'")
+    elif dialect == "bigquery":
+        connection.exec_driver_sql(f"SET @@dataset_id='{schema}'")
+    elif dialect in ("mssql", "sqlite"):
+        pass
+    else:  # postgresql and compatible dialects
+        connection.exec_driver_sql(f"SET search_path TO {schema}")
+
+
+def fetch_bounded(
+    engine: Engine,
+    sql: str,
+    max_rows: Optional[int] = None,
+    max_tokens: Optional[int] = None,
+    columns: Optional[Sequence[str]] = None,
+    batch_size: int = 50,
+    schema: Optional[str] = None,
+) -> BoundedResult:
+    """Run ``sql`` and fetch rows in batches until a row or token budget is hit.
+
+    Only ``columns`` are kept if given; otherwise columns that are empty in
+    every kept row are dropped. Rows past the budget are never fetched. The
+    session is pointed at ``schema`` first, if given.
+    """
+    bounded = BoundedResult()
+    with engine.connect() as connection:
+        set_schema(connection, schema)
+        cursor = connection.execution_options(stream_results=True).execute(text(sql))
+        if not cursor.returns_rows:
+            return bounded
+        all_columns = list(cursor.keys())
+        if columns:
+            wanted = {name.lower() for name in columns}
+            indexes = [i for i, name in enumerate(all_columns) if name.lower() in wanted]
+        else:
+            indexes = list(range(len(all_columns)))
+        bounded.columns = [all_columns[i] for i in indexes]
+
+        tokens = estimate_tokens("|".join(bounded.columns))
+        seen = 0
+        while not bounded.truncated:
+            batch = cursor.fetchmany(batch_size)
+            if not batch:
+                break
+            for row in batch:
+                projected = [row[i] for i in indexes]
+                row_tokens = estimate_tokens("|".join(_format_value(v) for v in projected))
+                if (max_rows is not None and len(bounded.rows) >= max_rows) or (
+                    max_tokens is not None and bounded.rows and tokens + row_tokens > max_tokens
+                ):
+                    bounded.truncated = True
+                    break
+                bounded.rows.append(projected)
+                tokens += row_tokens
+            seen += len(batch)
+
+        if bounded.truncated:
+            # Snowflake reports the total row count of a SELECT up front, SQLite doesn't
+            rowcount = cursor.rowcount
+            bounded.rows_omitted = (
+                rowcount - len(bounded.rows) if rowcount is not None and rowcount >= seen else None
+            )
+        cursor.close()
+
+    if not columns and bounded.rows:
+        keep = [
+            i for i in range(len(bounded.columns))
+            if any(_format_value(row[i]) for row in bounded.rows)
+        ]
+        bounded.columns = [bounded.columns[i] for i in keep]
+        bounded.rows = [[row[i] for i in keep] for row in bounded.rows]
+    return bounded
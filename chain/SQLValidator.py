@@ -0,0 +1,152 @@
+"""In-process validation and rewriting of LLM-generated SQL."""
+from __future__ import annotations
+
+from typing import Iterable, Iterator, Optional, Set
+
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import OptimizeError, ParseError
+from sqlglot.optimizer.scope import Scope, traverse_scope
+
+# SQLAlchemy dialect name -> sqlglot dialect name
+SQLGLOT_DIALECTS = {
+    "snowflake": "snowflake",
+    "sqlite": "sqlite",
+    "duckdb": "duckdb",
+    "postgresql": "postgres",
+    "mysql": "mysql",
+    "mssql": "tsql",
+}
+
+QUERY_TYPES = (exp.Select, exp.Union, exp.Intersect, exp.Except)
+WRITE_TYPES = (
+    exp.Insert,
+    exp.Update,
+    exp.Delete,
+    exp.Merge,
+    exp.Create,
+    exp.Drop,
+    exp.Alter,
+    exp.Command,
+)
+
+# What garbled text parses as, rather than a statement
+EXPRESSION_TYPES = (exp.Alias, exp.Condition, exp.Identifier)
+# Snowflake metadata and system functions, whatever they are qualified with
+BLOCKED_NAMES = {"INFORMATION_SCHEMA", "ACCOUNT_USAGE"}
+BLOCKED_PREFIXES = ("SYSTEM$",)
+
+
+class SQLValidationError(ValueError):
+    """The SQL is not allowed to run."""
+
+
+class SQLParseError(SQLValidationError):
+    """The SQL could not be parsed, so it could not be checked."""
+
+
+def _limit_value(limit: exp.Expression) -> Optional[int]:
+    value = limit.args.get("expression") or limit.args.get("count")
+    if isinstance(value, exp.Literal) and not value.is_string:
+        try:
+            return int(value.this)
+        except ValueError:
+            return None
+    return None
+
+
+def _cte_references(statement: exp.Expression) -> Set[int]:
+    """ids of the table nodes that read a CTE in scope rather than a real table.
+
+    Resolved per scope, so ``WITH users AS (SELECT * FROM users)`` still
+    reads the real ``users`` inside the CTE body.
+    """
+    try:
+        scopes = traverse_scope(statement)
+    except OptimizeError as exc:
+        raise SQLValidationError(f"Could not resolve the query's tables: {exc}") from exc
+    return {
+        id(node)
+        for scope in scopes
+        for node, source in scope.selected_sources.values()
+        if isinstance(node, exp.Table) and isinstance(source, Scope)
+    }
+
+
+def _sources(statement: exp.Expression) -> Iterator[exp.Expression]:
+    """Everything a query reads rows from: FROM and JOIN sources and laterals."""
+    for node in statement.find_all(exp.From, exp.Join):
+        yield node.this
+    yield from statement.find_all(exp.Lateral, exp.Unnest, exp.TableFromRows)
+
+
+def validate_sql(
+    sql: str,
+    allowed_tables: Iterable[str],
+    max_rows: Optional[int] = None,
+    dialect: str = "snowflake",
+    allowed_qualifiers: Iterable[str] = (),
+) -> str:
+    """Check that ``sql`` is a single read-only query over ``allowed_tables``.
+
+    Tables may only be qualified with a database or schema named in
+    ``allowed_qualifiers``, i.e. the ones the connection is configured for.
+    The query's top-level ``LIMIT`` is added if missing and clamped to
+    ``max_rows`` if larger. Returns the rewritten SQL.
+
+    Raises:
+        SQLParseError: the SQL doesn't parse in ``dialect``.
+        SQLValidationError: the SQL parses but isn't allowed to run.
+    """
+    read = SQLGLOT_DIALECTS.get(dialect, dialect)
+    try:
+        statements = [s for s in sqlglot.parse(sql, read=read) if s is not None]
+    except ParseError as exc:
+        raise SQLParseError(f"Could not parse SQL: {exc}") from exc
+    if len(statements) != 1:
+        raise SQLValidationError(f"Expected one statement, got {len(statements)}")
+    statement = statements[0]
+
+    if isinstance(statement, EXPRESSION_TYPES):
+        # Garbled SQL like "selec * form x" parses as an expression ("selec * form AS x")
+        raise SQLParseError(f"Could not parse SQL: {sql!r} is not a statement")
+    if not isinstance(statement, QUERY_TYPES):
+        # SHOW, CALL, USE and the like parse fine; they just aren't allowed
+        raise SQLValidationError(
+            f"Only SELECT queries are allowed, got {statement.key.upper()}"
+        )
+    if statement.find(*WRITE_TYPES) is not None:
+        raise SQLValidationError("Query contains a write statement")
+
+    for node in statement.walk():
+        name = node.name if isinstance(node, (exp.Identifier, exp.Var, exp.Anonymous)) else ""
+        if name.upper() in BLOCKED_NAMES or name.upper().startswith(BLOCKED_PREFIXES):
+            raise SQLValidationError(f"{name} is not allowed")
+    for source in _sources(statement):
+        # Table functions like TABLE(RESULT_SCAN(...)), LATERAL FLATTEN(...) or
+        # GENERATOR(...) read something other than the allowed tables
+        if isinstance(source, exp.Subquery):
+            continue
+        if not isinstance(source, exp.Table) or not isinstance(source.this, exp.Identifier):
+            raise SQLValidationError(f"{source.sql(dialect=read)} is not a table")
+
+    allowed: Set[str] = {name.lower() for name in allowed_tables}
+    qualifiers: Set[str] = {name.lower() for name in allowed_qualifiers}
+    cte_references = _cte_references(statement)
+    for table in statement.find_all(exp.Table):
+        if id(table) in cte_references:
+            continue
+        name = table.name.lower()
+        if name not in allowed:
+            raise SQLValidationError(f"Table {table.sql(dialect=read)} is not allowed")
+        for part in (table.catalog, table.db):
+            if part and part.lower() not in qualifiers:
+                raise SQLValidationError(f"Table {table.sql(dialect=read)} is not allowed")
+
+    if max_rows is not None:
+        limit = statement.args.get("limit")
+        current = _limit_value(limit) if limit is not None else None
+        if current is None or current > max_rows:
+            statement = statement.limit(max_rows)
+
+    return statement.sql(dialect=read)
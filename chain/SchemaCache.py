@@ -0,0 +1,148 @@
+"""Cache for table info so the schema isn't re-reflected on every question."""
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Sequence, Tuple
+
+if TYPE_CHECKING:
+    from langchain.utilities.sql_database import SQLDatabase
+
+ALL_TABLES_KEY = "*"
+
+
+class SchemaCache:
+    """TTL cache in front of ``SQLDatabase.get_table_info``.
+
+    ``get_table_info`` reflects the schema and pulls sample rows from the
+    warehouse, which takes seconds on Snowflake. Results are kept in memory per
+    set of table names until ``ttl`` seconds pass or ``invalidate`` is called,
+    and optionally written to ``snapshot_path`` so a fresh process starts warm.
+
+    Example:
+        .. code-block:: python
+
+            schema_cache = SchemaCache(db, ttl=3600, snapshot_path=".cache/schema.json")
+            db_chain = ExploreChain(llm=llm, database=db, schema_cache=schema_cache)
+    """
+
+    def __init__(
+        self,
+        database: SQLDatabase,
+        ttl: Optional[float] = 3600,
+        snapshot_path: Optional[str] = None,
+    ):
+        self.database = database
+        self.ttl = ttl
+        self.snapshot_path = snapshot_path
+        self._entries: Dict[str, Tuple[float, str]] = {}
+        self._lock = threading.Lock()
+        self._snapshot_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.reflections = 0
+        self.reflection_seconds = 0.0
+        self.last_reflection_seconds: Optional[float] = None
+        if snapshot_path:
+            self.load_snapshot()
+
+    @staticmethod
+    def _key(table_names: Optional[Sequence[str]]) -> str:
+        if not table_names:
+            return ALL_TABLES_KEY
+        return ",".join(sorted(name.lower() for name in table_names))
+
+    def _is_fresh(self, created_at: float) -> bool:
+        return self.ttl is None or time.time() - created_at < self.ttl
+
+    def get_table_info(self, table_names: Optional[List[str]] = None) -> str:
+        """Return cached table info, reflecting the database on a miss."""
+        key = self._key(table_names)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._is_fresh(entry[0]):
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        start = time.perf_counter()
+        table_info = self.database.get_table_info(table_names=table_names)
+        elapsed = time.perf_counter() - start
+
+        with self._lock:
+            self._entries[key] = (time.time(), table_info)
+            self.reflections += 1
+            self.reflection_seconds += elapsed
+            self.last_reflection_seconds = elapsed
+        if self.snapshot_path:
+            self.save_snapshot()
+        return table_info
+
+    def invalidate(self, table_names: Optional[List[str]] = None) -> None:
+        """Drop cached entries.
+
+        With no table names every entry is dropped. Otherwise any entry that
+        covers one of the given tables is dropped, including the all-tables one.
+        """
+        with self._lock:
+            if not table_names:
+                self._entries.clear()
+            else:
+                names = {name.lower() for name in table_names}
+                for key in list(self._entries):
+                    if key == ALL_TABLES_KEY or names & set(key.split(",")):
+                        del self._entries[key]
+        if self.snapshot_path:
+            self.save_snapshot()
+
+    def load_snapshot(self) -> int:
+        """Load unexpired entries from ``snapshot_path``. Returns how many."""
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return 0
+        try:
+            with open(self.snapshot_path) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            return 0
+        loaded = 0
+        with self._lock:
+            for key, entry in snapshot.get("entries", {}).items():
+                created_at, table_info = entry["created_at"], entry["table_info"]
+                if self._is_fresh(created_at):
+                    self._entries[key] = (created_at, table_info)
+                    loaded += 1
+        return loaded
+
+    def save_snapshot(self) -> None:
+        """Write the current entries to ``snapshot_path``."""
+        if not self.snapshot_path:
+            return
+        with self._lock:
+            snapshot = {
+                "entries": {
+                    key: {"created_at": created_at, "table_info": table_info}
+                    for key, (created_at, table_info) in self._entries.items()
+                }
+            }
+        directory = os.path.dirname(self.snapshot_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.snapshot_path}.tmp"
+        with self._snapshot_lock:
+            with open(tmp_path, "w") as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, self.snapshot_path)
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counts and time spent reflecting the schema."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "reflections": self.reflections,
+                "reflection_seconds": self.reflection_seconds,
+                "last_reflection_seconds": self.last_reflection_seconds,
+            }
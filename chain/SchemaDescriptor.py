@@ -0,0 +1,235 @@
+"""Compact, precomputed table description for the SQL generation prompt."""
+from __future__ import annotations
+
+import json
+import os
+import re
+import threading
+import time
+from collections import Counter
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Sequence, Union
+
+import pandas as pd
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+
+from chain.ResultBudget import estimate_tokens
+from chain.SchemaCache import SchemaCache
+
+if TYPE_CHECKING:
+    from langchain.utilities.sql_database import SQLDatabase
+
+DEFAULT_VALUE_COLUMNS = ("event_type", "business_name", "band_name")
+
+
+class SchemaDescriptor:
+    """Column types plus the most frequent values of a few text columns.
+
+    ``SQLDatabase.get_table_info`` sends the full DDL and sample rows with every
+    question. This describes one table in a fraction of the tokens, and the
+    value dictionaries tell the model how event types and names are actually
+    spelled, which sample rows rarely do. The text is kept under ``max_tokens``,
+    and under the size of the ``table_info`` it stands in for if given, by
+    showing fewer values per column.
+
+    ``refresh`` counts values with one GROUP BY per column, at most every ``ttl``
+    seconds. ``observe`` adds newly ingested rows to the counts in between, so
+    a portal submit shows up without querying the warehouse again.
+
+    Example:
+        .. code-block:: python
+
+            descriptor = SchemaDescriptor(engine, table_info=schema_cache)
+            db_chain = ExploreChain(llm=llm, database=db, schema_descriptor=descriptor)
+            descriptor.observe(new_rows_df)
+    """
+
+    def __init__(
+        self,
+        engine: Engine,
+        table_name: str = "experience_raw",
+        value_columns: Sequence[str] = DEFAULT_VALUE_COLUMNS,
+        max_values: int = 5,
+        max_tokens: Optional[int] = 120,
+        ttl: Optional[float] = 86400,
+        snapshot_path: Optional[str] = None,
+        table_info: Optional[Union[SQLDatabase, SchemaCache]] = None,
+    ):
+        self.engine = engine
+        self.table_name = table_name
+        self.value_columns = list(value_columns)
+        self.max_values = max_values
+        self.max_tokens = max_tokens
+        self.ttl = ttl
+        self.snapshot_path = snapshot_path
+        self.table_info = table_info
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._snapshot_lock = threading.Lock()
+        self._columns: List[Dict[str, str]] = []
+        # Counts beyond max_values are kept so values can climb into the top ones
+        self._counts: Dict[str, Counter] = {}
+        # Size of the table info this replaces, which the description must not exceed
+        self._table_info_tokens: Optional[int] = None
+        self._refreshed_at: Optional[float] = None
+        self._text: Optional[str] = None
+        self.refreshes = 0
+        self.refresh_seconds = 0.0
+        self.observed_rows = 0
+        if snapshot_path:
+            self.load_snapshot()
+
+    def _is_fresh(self) -> bool:
+        return self._refreshed_at is not None and (
+            self.ttl is None or time.time() - self._refreshed_at < self.ttl
+        )
+
+    def refresh(self) -> None:
+        """Reflect the column types and recount the frequent values."""
+        start = time.perf_counter()
+        columns = [
+            {"name": column["name"], "type": re.sub(r"\(.*\)", "", str(column["type"]))}
+            for column in inspect(self.engine).get_columns(self.table_name)
+        ]
+        names = {column["name"].lower() for column in columns}
+        counts: Dict[str, Counter] = {}
+        with self.engine.connect() as connection:
+            for column in self.value_columns:
+                if column.lower() not in names:
+                    continue
+                rows = connection.execute(
+                    text(
+                        f"SELECT {column}, COUNT(*) FROM {self.table_name} "
+                        f"WHERE {column} IS NOT NULL GROUP BY {column} "
+                        f"ORDER BY 2 DESC LIMIT {self.max_values * 10}"
+                    )
+                )
+                counts[column] = Counter({str(value): count for value, count in rows})
+        table_info_tokens = (
+            estimate_tokens(self.table_info.get_table_info(table_names=[self.table_name]))
+            if self.table_info is not None
+            else None
+        )
+        with self._lock:
+            self._columns = columns
+            self._counts = counts
+            self._table_info_tokens = table_info_tokens
+            self._refreshed_at = time.time()
+            self._text = None
+            self.refreshes += 1
+            self.refresh_seconds += time.perf_counter() - start
+        if self.snapshot_path:
+            self.save_snapshot()
+
+    def observe(self, df: pd.DataFrame) -> None:
+        """Add newly ingested rows to the value counts."""
+        with self._lock:
+            for column, counter in self._counts.items():
+                if column in df:
+                    counter.update(str(value) for value in df[column].dropna())
+            self.observed_rows += len(df)
+            self._text = None
+
+    def _render(self, max_values: int) -> str:
+        columns = ", ".join(f"{column['name']} {column['type']}" for column in self._columns)
+        lines = [f"Table {self.table_name}({columns})"]
+        for column, counter in self._counts.items():
+            values = [value for value, _ in counter.most_common(max_values)]
+            if values:
+                lines.append(f"Common {column} values: " + "; ".join(values))
+        return "\n".join(lines)
+
+    def get_table_info(self, table_names: Optional[List[str]] = None) -> str:
+        """The description, refreshing it first if it is missing or stale."""
+        if not self._is_fresh():
+            with self._refresh_lock:
+                if not self._is_fresh():
+                    self.refresh()
+        with self._lock:
+            if self._text is None:
+                budgets = [
+                    budget for budget in (self.max_tokens, self._table_info_tokens)
+                    if budget is not None
+                ]
+                max_tokens = min(budgets, default=None)
+                max_values = self.max_values
+                table_info = self._render(max_values)
+                while (
+                    max_tokens is not None
+                    and estimate_tokens(table_info) > max_tokens
+                    and max_values > 0
+                ):
+                    max_values -= 1
+                    table_info = self._render(max_values)
+                self._text = table_info
+            return self._text
+
+    def covers(self, table_names: Optional[List[str]]) -> bool:
+        """Whether this describes everything a query over ``table_names`` needs.
+
+        No table names means the chain's default, which for the Explorer is
+        experience_raw only.
+        """
+        return not table_names or {name.lower() for name in table_names} == {
+            self.table_name.lower()
+        }
+
+    def compare(self, database: Union[SQLDatabase, SchemaCache]) -> Dict[str, int]:
+        """Estimated prompt tokens of ``database``'s table info vs. this description."""
+        return {
+            "table_info_tokens": estimate_tokens(
+                database.get_table_info(table_names=[self.table_name])
+            ),
+            "descriptor_tokens": estimate_tokens(self.get_table_info()),
+        }
+
+    def load_snapshot(self) -> bool:
+        """Load the description saved by a previous process, if it is fresh."""
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return False
+        try:
+            with open(self.snapshot_path) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            return False
+        with self._lock:
+            self._refreshed_at = snapshot["refreshed_at"]
+            if not self._is_fresh():
+                self._refreshed_at = None
+                return False
+            self._columns = snapshot["columns"]
+            self._counts = {
+                column: Counter(counts) for column, counts in snapshot["counts"].items()
+            }
+            self._table_info_tokens = snapshot.get("table_info_tokens")
+            self._text = None
+        return True
+
+    def save_snapshot(self) -> None:
+        if not self.snapshot_path:
+            return
+        with self._lock:
+            snapshot = {
+                "refreshed_at": self._refreshed_at,
+                "columns": self._columns,
+                "counts": {column: dict(counter) for column, counter in self._counts.items()},
+                "table_info_tokens": self._table_info_tokens,
+            }
+        directory = os.path.dirname(self.snapshot_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.snapshot_path}.tmp"
+        with self._snapshot_lock:
+            with open(tmp_path, "w") as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, self.snapshot_path)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "refreshes": self.refreshes,
+                "refresh_seconds": self.refresh_seconds,
+                "observed_rows": self.observed_rows,
+                "tokens": estimate_tokens(self._text) if self._text else None,
+                "table_info_tokens": self._table_info_tokens,
+            }
@@ -0,0 +1,132 @@
+"""Coalesce concurrent identical Explorer questions into one chain run."""
+from __future__ import annotations
+
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from chain.QueryCache import normalize_question
+
+
+class SingleFlightTimeout(TimeoutError):
+    """Raised to a caller that waited longer than the timeout for another's run."""
+
+
+class _Flight:
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.started_at = time.monotonic()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Runs a function once per key for all the callers that ask at the same time.
+
+    The first caller for a key runs ``func`` and the callers that arrive while
+    it is running wait for it and get the same result, or the same exception.
+    Nothing is kept once the run finishes, so this only saves work during a
+    burst; the ``QueryCache`` covers repeats after that. Waiters give up with
+    ``SingleFlightTimeout`` after ``timeout`` seconds, and a run older than
+    ``timeout`` is no longer joined, so one stuck call doesn't hold a question
+    hostage.
+
+    Keys are normalized like the query cache's, so "Live music tonight?" and
+    "live music tonight" share a run.
+
+    Example:
+        .. code-block:: python
+
+            flight = SingleFlight(timeout=60)
+            answer, shared = flight.do(question, lambda: db_chain.run(question))
+    """
+
+    def __init__(
+        self,
+        timeout: Optional[float] = 60,
+        key_func: Callable[[str], str] = normalize_question,
+    ):
+        self.timeout = timeout
+        self.key_func = key_func
+        self._lock = threading.Lock()
+        self._flights: Dict[str, _Flight] = {}
+        self.calls = 0
+        self.executions = 0
+        self.coalesced = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.max_waiters = 0
+
+    def _is_stale(self, flight: _Flight, timeout: Optional[float]) -> bool:
+        return timeout is not None and time.monotonic() - flight.started_at > timeout
+
+    def do(
+        self,
+        key: str,
+        func: Callable[[], Any],
+        timeout: Optional[float] = None,
+    ) -> Tuple[Any, bool]:
+        """Return ``(func's result, whether it came from another caller's run)``.
+
+        ``timeout`` overrides the default for this call.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        key = self.key_func(key)
+        with self._lock:
+            self.calls += 1
+        while True:
+            with self._lock:
+                flight = self._flights.get(key)
+                leader = flight is None or self._is_stale(flight, timeout)
+                if leader:
+                    flight = self._flights[key] = _Flight()
+                    self.executions += 1
+                else:
+                    flight.waiters += 1
+                    self.coalesced += 1
+                    self.max_waiters = max(self.max_waiters, flight.waiters)
+            if leader:
+                break
+            if not flight.done.wait(timeout):
+                with self._lock:
+                    self.timeouts += 1
+                raise SingleFlightTimeout(
+                    f"Gave up after {timeout}s waiting for the in-flight run of {key!r}"
+                )
+            if flight.error is None:
+                return flight.result, True
+            if isinstance(flight.error, Exception):
+                raise flight.error
+            # The first caller was interrupted (e.g. Streamlit stopped its
+            # script), which says nothing about the question, so run it again
+            with self._lock:
+                self.coalesced -= 1
+
+        try:
+            flight.result = func()
+        except BaseException as exc:
+            flight.error = exc
+            with self._lock:
+                self.errors += 1
+            raise
+        finally:
+            with self._lock:
+                # A stale run may have been replaced; leave the newer one in place
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+            flight.done.set()
+        return flight.result, False
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "executions": self.executions,
+                "coalesced": self.coalesced,
+                "coalesce_rate": self.coalesced / self.calls if self.calls else None,
+                "timeouts": self.timeouts,
+                "errors": self.errors,
+                "in_flight": len(self._flights),
+                "max_waiters": self.max_waiters,
+            }
@@ -0,0 +1,164 @@
+"""Process-wide pooled SQLAlchemy engine for Snowflake."""
+from __future__ import annotations
+
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+
+_engines: Dict[str, Engine] = {}
+_engines_lock = threading.Lock()
+
+
+class PoolStats:
+    """Counters for connection checkouts and how long callers waited for one."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def record_wait(self, seconds: float, timed_out: bool = False) -> None:
+        with self._lock:
+            self.wait_seconds += seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+            if timed_out:
+                self.timeouts += 1
+
+    def incr(self, name: str) -> None:
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "connects": self.connects,
+                "checkouts": self.checkouts,
+                "checkins": self.checkins,
+                "timeouts": self.timeouts,
+                "wait_seconds": self.wait_seconds,
+                "max_wait_seconds": self.max_wait_seconds,
+                "avg_wait_seconds": (
+                    self.wait_seconds / self.checkouts if self.checkouts else 0.0
+                ),
+            }
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited for a connection."""
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def _do_get(self) -> Any:
+        start = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except Exception:
+            self.stats.record_wait(time.perf_counter() - start, timed_out=True)
+            raise
+        self.stats.record_wait(time.perf_counter() - start)
+        return conn
+
+    def recreate(self) -> InstrumentedQueuePool:
+        # engine.dispose() swaps in a fresh pool; keep counting into the same stats
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+
+def _instrument(engine: Engine) -> None:
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection: Any, connection_record: Any) -> None:
+        engine.pool.stats.incr("connects")
+
+    @event.listens_for(engine, "checkout")
+    def on_checkout(
+        dbapi_connection: Any, connection_record: Any, connection_proxy: Any
+    ) -> None:
+        engine.pool.stats.incr("checkouts")
+
+    @event.listens_for(engine, "checkin")
+    def on_checkin(dbapi_connection: Any, connection_record: Any) -> None:
+        engine.pool.stats.incr("checkins")
+
+
+def connection_string_from_secrets(secrets: Any) -> str:
+    """Build the Snowflake SQLAlchemy URL from the app's ``st.secrets`` entries."""
+    return (
+        f"snowflake://{secrets['sf_username']}:{secrets['sf_password']}"
+        f"@{secrets['sf_account']}/{secrets['sf_database']}/{secrets['sf_schema']}"
+    )
+
+
+def get_engine(
+    connection_string: str,
+    pool_size: int = 5,
+    max_overflow: int = 10,
+    pool_timeout: float = 30,
+    pool_recycle: int = 3600,
+    pool_pre_ping: bool = True,
+) -> Engine:
+    """Return the shared engine for ``connection_string``, creating it on first use.
+
+    Every caller in the process gets the same engine, so Snowflake logins only
+    happen when the pool opens a new connection. Pool settings only take effect
+    the first time an engine is created for a given connection string.
+    """
+    engine = _engines.get(connection_string)
+    if engine is not None:
+        return engine
+    with _engines_lock:
+        engine = _engines.get(connection_string)
+        if engine is None:
+            engine = create_engine(
+                connection_string,
+                poolclass=InstrumentedQueuePool,
+                pool_size=pool_size,
+                max_overflow=max_overflow,
+                pool_timeout=pool_timeout,
+                pool_recycle=pool_recycle,
+                pool_pre_ping=pool_pre_ping,
+            )
+            _instrument(engine)
+            _engines[connection_string] = engine
+    return engine
+
+
+def pool_stats(engine: Engine) -> Dict[str, Any]:
+    """Checkout/wait counters plus the pool's current occupancy."""
+    pool = engine.pool
+    stats: Dict[str, Any] = {}
+    if isinstance(pool, InstrumentedQueuePool):
+        stats.update(pool.stats.as_dict())
+    if isinstance(pool, QueuePool):
+        stats.update(
+            {
+                "size": pool.size(),
+                "checked_out": pool.checkedout(),
+                "checked_in": pool.checkedin(),
+                "overflow": pool.overflow(),
+            }
+        )
+    return stats
+
+
+def dispose_engines(connection_string: Optional[str] = None) -> None:
+    """Close pooled connections, for one connection string or all of them."""
+    with _engines_lock:
+        if connection_string is None:
+            engines = list(_engines.values())
+            _engines.clear()
+        else:
+            engine = _engines.pop(connection_string, None)
+            engines = [engine] if engine is not None else []
+    for engine in engines:
+        engine.dispose()
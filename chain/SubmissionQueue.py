@@ -0,0 +1,508 @@
+"""Write-behind, deduplicating queue for portal submissions to experience_raw."""
+from __future__ import annotations
+
+import atexit
+import datetime
+import hashlib
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Callable, Deque, Dict, Hashable, List, Optional, Set, Tuple
+
+import pandas as pd
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection, Engine
+
+from chain.LocalReplica import WATERMARK_COLUMN, ensure_watermark_column, stamp_ingested_at
+from chain.UpcomingExperiences import ensure_timestamp_columns, stamp_event_timestamps
+
+logger = logging.getLogger(__name__)
+
+# A listing is one business's experience on one date at one start time
+KEY_COLUMNS = ("business_name", "event_date", "event_start_time")
+# NULL-safe equality per SQLAlchemy dialect; the standard form is the fallback
+NULL_SAFE_EQUALS = {
+    "snowflake": "EQUAL_NULL({left}, {right})",
+    "sqlite": "{left} IS {right}",
+    "mysql": "{left} <=> {right}",
+}
+# Spooled values of these types are written as ISO strings and parsed back
+_SPOOL_TYPES = {
+    "datetime": datetime.datetime,
+    "date": datetime.date,
+    "time": datetime.time,
+}
+
+
+def submission_key(row: Dict[str, Any]) -> Optional[Tuple[str, Optional[str], Optional[str]]]:
+    """``(business, date, start)`` identifying a listing, or None if it can't be keyed.
+
+    The business name is compared trimmed and case-insensitively and a missing
+    date or start time matches another missing one, like the MERGE does.
+    """
+    business = row.get("business_name")
+    if not isinstance(business, str) or not business.strip():
+        return None
+    date, start = (row.get(column) for column in KEY_COLUMNS[1:])
+    return (
+        business.strip().lower(),
+        None if pd.isna(date) else str(date),
+        None if pd.isna(start) else str(start),
+    )
+
+
+def _fingerprint(row: Dict[str, Any]) -> str:
+    values = {key: value for key, value in row.items() if key != WATERMARK_COLUMN}
+    return hashlib.sha256(
+        json.dumps(values, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+def _spool_entry(row: Dict[str, Any], error: str) -> str:
+    values: Dict[str, Any] = {}
+    types: Dict[str, str] = {}
+    for column, value in row.items():
+        if pd.api.types.is_scalar(value) and pd.isna(value):
+            values[column] = None
+            continue
+        values[column] = value
+        for name, type_ in _SPOOL_TYPES.items():
+            if isinstance(value, type_):
+                values[column], types[column] = value.isoformat(), name
+                break
+    return json.dumps({"row": values, "types": types, "error": error}, default=str)
+
+
+def _spooled_row(entry: Dict[str, Any]) -> Dict[str, Any]:
+    row = entry["row"]
+    for column, name in entry["types"].items():
+        row[column] = _SPOOL_TYPES[name].fromisoformat(row[column])
+    return row
+
+
+class SubmissionQueue:
+    """Micro-batches portal submissions and upserts them with one MERGE per batch.
+
+    ``submit`` returns at once; a background thread flushes the queue when it
+    holds ``max_batch`` listings or its oldest one has waited ``max_delay``
+    seconds. Listings are keyed on business name, ``event_date`` and
+    ``event_start_time``:
+
+    - a resubmit identical to one written recently is dropped without
+      touching the warehouse, using an LRU of the last ``recent_keys`` keys;
+    - a resubmit of a listing still queued replaces it;
+    - everything else is staged in a temporary table and merged into
+      ``table_name``, updating the listing if it exists and inserting it
+      otherwise. Databases without MERGE get an UPDATE and an INSERT in one
+      transaction instead.
+
+    ``ingested_at`` and the event timestamps are stamped when a batch is
+    flushed, so the replica's watermark never goes backwards, and added to
+    ``table_name`` first if it lacks them. ``on_flush`` is called with the rows
+    and summary of every flush. A batch that fails is retried on later flushes;
+    after ``max_attempts`` it is appended to the JSONL file at ``spool_path``,
+    as is whatever ``stop`` can't write. Spooled listings are written again by
+    ``retry_spool``, which the flush thread runs when it starts and after every
+    flush that succeeds. Without a ``spool_path`` they are dropped instead.
+    Failures are logged, and ``stats`` reports whether writes are failing.
+
+    Example:
+        .. code-block:: python
+
+            queue = SubmissionQueue(sf_engine, max_batch=50, on_flush=on_flush)
+            queue.start(max_delay=2.0)
+            queue.submit(form_response_df)
+    """
+
+    def __init__(
+        self,
+        engine: Engine,
+        table_name: str = "experience_raw",
+        max_batch: int = 50,
+        recent_keys: int = 10000,
+        max_attempts: int = 3,
+        spool_path: Optional[str] = ".cache/submission_spool.jsonl",
+        on_flush: Optional[Callable[[pd.DataFrame, Dict[str, Any]], None]] = None,
+    ):
+        self.engine = engine
+        self.table_name = table_name
+        self.staging_table = f"{table_name}__submissions"
+        self.max_batch = max_batch
+        self.recent_keys = recent_keys
+        self.max_attempts = max_attempts
+        self.spool_path = spool_path
+        self.on_flush = on_flush
+        if spool_path and os.path.dirname(spool_path):
+            os.makedirs(os.path.dirname(spool_path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._ready = threading.Condition(self._lock)
+        self._flush_lock = threading.Lock()
+        self._spool_lock = threading.Lock()
+        # key -> (row, queued_at, attempts), oldest first
+        self._pending: "OrderedDict[Hashable, Tuple[Dict[str, Any], float, int]]" = OrderedDict()
+        self._recent: "OrderedDict[Tuple[str, Optional[str], Optional[str]], str]" = OrderedDict()
+        self._unkeyed = itertools.count()
+        self._columns: Optional[Set[str]] = None
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._flush_seconds: Deque[float] = deque(maxlen=1000)
+        self.submitted = 0
+        self.duplicates = 0
+        self.coalesced = 0
+        self.max_queue_depth = 0
+        self.flushes = 0
+        self.flush_errors = 0
+        self.rows_inserted = 0
+        self.rows_updated = 0
+        self.rows_spooled = 0
+        self.rows_dropped = 0
+        self.spooled = self._count_spooled()
+        self.failing = False
+        self.last_error: Optional[str] = None
+
+    def submit(self, rows: pd.DataFrame) -> int:
+        """Queue ``rows`` for the next flush. Returns how many weren't duplicates."""
+        queued = 0
+        now = time.monotonic()
+        with self._ready:
+            for row in rows.to_dict("records"):
+                self.submitted += 1
+                key = submission_key(row)
+                fingerprint = _fingerprint(row)
+                queued_at = now
+                if key is None:
+                    # Can't be matched to anything, so it is always inserted
+                    key = next(self._unkeyed)
+                elif self._recent.get(key) == fingerprint:
+                    self.duplicates += 1
+                    continue
+                elif key in self._pending:
+                    pending_row, queued_at, attempts = self._pending[key]
+                    if _fingerprint(pending_row) == fingerprint:
+                        self.duplicates += 1
+                        continue
+                    self.coalesced += 1
+                self._pending[key] = (row, queued_at, 0)
+                queued += 1
+            self.max_queue_depth = max(self.max_queue_depth, len(self._pending))
+            self._ready.notify()
+        return queued
+
+    def _take_batch(self) -> List[Tuple[Hashable, Dict[str, Any], float, int]]:
+        with self._lock:
+            keys = list(itertools.islice(self._pending, self.max_batch))
+            return [(key, *self._pending.pop(key)) for key in keys]
+
+    def _target_columns(self) -> Set[str]:
+        if self._columns is None:
+            ensure_watermark_column(self.engine, self.table_name)
+            ensure_timestamp_columns(self.engine, self.table_name)
+            self._columns = {
+                column["name"].lower()
+                for column in inspect(self.engine).get_columns(self.table_name)
+            }
+        return self._columns
+
+    def _merge(self, conn: Connection, columns: List[str]) -> Tuple[int, int]:
+        target, staging = self.table_name, self.staging_table
+        # Listings without a start time match each other, and rows written before
+        # the timestamps existed match too
+        equals = NULL_SAFE_EQUALS.get(
+            self.engine.dialect.name, "{left} IS NOT DISTINCT FROM {right}"
+        )
+        on = " AND ".join(
+            [f"LOWER(TRIM(t.{KEY_COLUMNS[0]})) = LOWER(TRIM(s.{KEY_COLUMNS[0]}))"]
+            + [
+                equals.format(left=f"t.{column}", right=f"s.{column}")
+                for column in KEY_COLUMNS[1:]
+            ]
+        )
+        assignments = ", ".join(f"{column} = s.{column}" for column in columns)
+        column_list = ", ".join(columns)
+        if self.engine.dialect.name == "snowflake":
+            result = conn.execute(
+                text(
+                    f"MERGE INTO {target} t USING {staging} s ON {on} "
+                    f"WHEN MATCHED THEN UPDATE SET {assignments} "
+                    f"WHEN NOT MATCHED THEN INSERT ({column_list}) "
+                    f"VALUES ({', '.join(f's.{column}' for column in columns)})"
+                )
+            )
+            inserted, updated = result.fetchone()[:2]
+            return inserted, updated
+        updated = conn.execute(
+            text(
+                f"UPDATE {target} AS t SET {assignments} FROM {staging} AS s WHERE {on}"
+            )
+        ).rowcount
+        # An anti-join rather than NOT EXISTS, so SQLite indexes the target instead
+        # of scanning it for every staged row
+        inserted = conn.execute(
+            text(
+                f"INSERT INTO {target} ({column_list}) "
+                f"SELECT {', '.join(f's.{column}' for column in columns)} FROM {staging} s "
+                f"LEFT JOIN {target} t ON {on} WHERE t.{KEY_COLUMNS[0]} IS NULL"
+            )
+        ).rowcount
+        return inserted, updated
+
+    def _write(self, rows: List[Dict[str, Any]]) -> Tuple[pd.DataFrame, int, int]:
+        df = stamp_event_timestamps(stamp_ingested_at(pd.DataFrame(rows)))
+        # Only the target's columns are staged, and always the ones the MERGE matches on
+        target_columns = self._target_columns()
+        columns = [column for column in df.columns if column.lower() in target_columns]
+        columns += [
+            column
+            for column in KEY_COLUMNS
+            if column not in columns and column in target_columns
+        ]
+        df = df.reindex(columns=columns)
+        with self.engine.begin() as conn:
+            # Created first: DDL commits the open transaction on Snowflake
+            conn.execute(text(f"DROP TABLE IF EXISTS {self.staging_table}"))
+            conn.execute(
+                text(
+                    f"CREATE TEMPORARY TABLE {self.staging_table} AS "
+                    f"SELECT {', '.join(columns)} FROM {self.table_name} WHERE 1 = 0"
+                )
+            )
+            # Micro-batches are small; a multi-row INSERT beats staging files for COPY INTO
+            df.to_sql(
+                self.staging_table,
+                conn,
+                if_exists="append",
+                index=False,
+                method="multi",
+                # Stays under SQLite's and Snowflake's bind parameter limits
+                chunksize=max(1, 10000 // len(columns)),
+            )
+            inserted, updated = self._merge(conn, columns)
+            conn.execute(text(f"DROP TABLE {self.staging_table}"))
+        return df, inserted, updated
+
+    def _count_spooled(self) -> int:
+        if not self.spool_path or not os.path.exists(self.spool_path):
+            return 0
+        with open(self.spool_path) as f:
+            return sum(1 for line in f if line.strip())
+
+    def _spool(self, rows: List[Dict[str, Any]], error: str) -> None:
+        with self._lock:
+            self.rows_spooled += len(rows) if self.spool_path else 0
+            self.rows_dropped += 0 if self.spool_path else len(rows)
+            for row in rows:
+                # Anything written for this listing from now on is newer than the spooled copy
+                key = submission_key(row)
+                if key is not None:
+                    self._recent.pop(key, None)
+        if not self.spool_path:
+            logger.error("Dropped %d portal submissions: %s", len(rows), error)
+            return
+        with self._spool_lock, open(self.spool_path, "a") as f:
+            for row in rows:
+                f.write(_spool_entry(row, error) + "\n")
+            self.spooled += len(rows)
+        logger.error(
+            "Spooled %d portal submissions to %s: %s", len(rows), self.spool_path, error
+        )
+
+    def _record_error(self, exc: BaseException) -> str:
+        error = f"{type(exc).__name__}: {exc}"
+        with self._lock:
+            self.flush_errors += 1
+            self.failing = True
+            self.last_error = error
+        return error
+
+    def _record_flush(
+        self, rows: List[Dict[str, Any]], inserted: int, updated: int, seconds: float
+    ) -> None:
+        with self._lock:
+            for row in rows:
+                key = submission_key(row)
+                if key is not None:
+                    self._recent[key] = _fingerprint(row)
+                    self._recent.move_to_end(key)
+            while len(self._recent) > self.recent_keys:
+                self._recent.popitem(last=False)
+            self.flushes += 1
+            self.failing = False
+            self.rows_inserted += inserted
+            self.rows_updated += updated
+            self._flush_seconds.append(seconds)
+
+    def flush(self) -> Optional[Dict[str, Any]]:
+        """Write up to ``max_batch`` queued listings now. Returns what the flush did."""
+        with self._flush_lock:
+            batch = self._take_batch()
+            if not batch:
+                return None
+            start = time.perf_counter()
+            rows = [row for _, row, _, _ in batch]
+            try:
+                df, inserted, updated = self._write(rows)
+            except Exception as exc:
+                error = self._record_error(exc)
+                retry = [
+                    (key, row, queued_at, attempts + 1)
+                    for key, row, queued_at, attempts in batch
+                    if attempts + 1 < self.max_attempts
+                ]
+                logger.warning(
+                    "Portal submission flush failed, retrying %d of %d rows: %s",
+                    len(retry), len(batch), error,
+                )
+                with self._lock:
+                    # Back to the front of the queue, unless resubmitted meanwhile
+                    for key, row, queued_at, attempts in reversed(retry):
+                        if key not in self._pending:
+                            self._pending[key] = (row, queued_at, attempts)
+                            self._pending.move_to_end(key, last=False)
+                retried = {key for key, _, _, _ in retry}
+                given_up = [row for key, row, _, _ in batch if key not in retried]
+                if given_up:
+                    self._spool(given_up, error)
+                raise
+            seconds = time.perf_counter() - start
+            now = time.monotonic()
+            self._record_flush(rows, inserted, updated, seconds)
+        summary = {
+            "rows": len(df),
+            "inserted": inserted,
+            "updated": updated,
+            "seconds": seconds,
+            "max_wait_seconds": max(now - queued_at for _, _, queued_at, _ in batch),
+        }
+        if self.on_flush is not None:
+            self.on_flush(df, summary)
+        return summary
+
+    def retry_spool(self) -> Optional[Dict[str, Any]]:
+        """Write the spooled listings again. They stay spooled if the write fails."""
+        with self._flush_lock, self._spool_lock:
+            if not self.spool_path or not os.path.exists(self.spool_path):
+                return None
+            with open(self.spool_path) as f:
+                rows = [_spooled_row(json.loads(line)) for line in f if line.strip()]
+            with self._lock:
+                # A listing queued or written since it was spooled is newer, so it wins
+                newer = set(self._pending) | set(self._recent)
+                rows = [row for row in rows if submission_key(row) not in newer]
+            summary = None
+            if rows:
+                start = time.perf_counter()
+                try:
+                    df, inserted, updated = self._write(rows)
+                except Exception as exc:
+                    error = self._record_error(exc)
+                    logger.warning("Retrying spooled portal submissions failed: %s", error)
+                    raise
+                seconds = time.perf_counter() - start
+                self._record_flush(rows, inserted, updated, seconds)
+                summary = {
+                    "rows": len(df),
+                    "inserted": inserted,
+                    "updated": updated,
+                    "seconds": seconds,
+                }
+            os.remove(self.spool_path)
+            self.spooled = 0
+        if summary is not None:
+            logger.info("Wrote %d spooled portal submissions", summary["rows"])
+            if self.on_flush is not None:
+                self.on_flush(df, summary)
+        return summary
+
+    def drain(self) -> None:
+        """Flush until the queue is empty; a failed flush raises."""
+        while self.flush() is not None:
+            pass
+
+    def start(self, max_delay: float = 2.0) -> None:
+        """Flush in a daemon thread, at most ``max_delay`` seconds after a submit."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopped.clear()
+
+        def retry_spool() -> None:
+            if self.spooled:
+                try:
+                    self.retry_spool()
+                except Exception:
+                    # Counted in flush_errors; the listings stay spooled
+                    pass
+
+        def loop() -> None:
+            retry_spool()
+            while not self._stopped.is_set():
+                with self._ready:
+                    while not self._pending and not self._stopped.is_set():
+                        self._ready.wait()
+                    if self._pending:
+                        oldest = next(iter(self._pending.values()))[1]
+                        wait = oldest + max_delay - time.monotonic()
+                        if len(self._pending) < self.max_batch and wait > 0:
+                            self._ready.wait(wait)
+                            continue
+                try:
+                    self.flush()
+                except Exception:
+                    # Counted in flush_errors; the batch is back in the queue or spooled
+                    self._stopped.wait(max_delay)
+                else:
+                    # The warehouse takes writes again
+                    retry_spool()
+
+        self._thread = threading.Thread(target=loop, name="submission-flush", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self) -> None:
+        """Stop the flush thread and write what is still queued, spooling it if that fails."""
+        atexit.unregister(self.stop)
+        with self._ready:
+            self._stopped.set()
+            self._ready.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+        try:
+            self.drain()
+        except Exception as exc:
+            with self._lock:
+                rows = [row for row, _, _ in self._pending.values()]
+                self._pending.clear()
+            if rows:
+                self._spool(rows, f"{type(exc).__name__}: {exc}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            flush_seconds = sorted(self._flush_seconds)
+            oldest = next(iter(self._pending.values()))[1] if self._pending else None
+            return {
+                "queue_depth": len(self._pending),
+                "max_queue_depth": self.max_queue_depth,
+                "oldest_queued_seconds": time.monotonic() - oldest if oldest else None,
+                "submitted": self.submitted,
+                "duplicates": self.duplicates,
+                "coalesced": self.coalesced,
+                "flushes": self.flushes,
+                "flush_errors": self.flush_errors,
+                "failing": self.failing,
+                "rows_inserted": self.rows_inserted,
+                "rows_updated": self.rows_updated,
+                "rows_spooled": self.rows_spooled,
+                "rows_dropped": self.rows_dropped,
+                "spooled": self.spooled,
+                "mean_flush_seconds": (
+                    sum(flush_seconds) / len(flush_seconds) if flush_seconds else None
+                ),
+                "p95_flush_seconds": (
+                    flush_seconds[min(len(flush_seconds) - 1, int(0.95 * len(flush_seconds)))]
+                    if flush_seconds else None
+                ),
+                "last_error": self.last_error,
+            }
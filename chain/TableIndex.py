@@ -0,0 +1,150 @@
+"""Lexical index over table and column names for picking the tables a question needs."""
+from __future__ import annotations
+
+import math
+import re
+import threading
+import time
+from collections import Counter
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from langchain.utilities.sql_database import SQLDatabase
+
+STOPWORDS = {
+    "a", "an", "and", "any", "are", "at", "be", "can", "do", "for", "from", "how",
+    "i", "in", "is", "it", "me", "my", "of", "on", "or", "show", "that", "the",
+    "there", "this", "to", "what", "when", "where", "which", "who", "with",
+}
+# How much more a match on the table name counts than one on a column name
+NAME_WEIGHT = 3.0
+
+
+def terms(value: str) -> List[str]:
+    """Lowercase word stems of ``value``, splitting snake_case and camelCase."""
+    value = re.sub(r"([a-z])([A-Z])", r"\1 \2", value or "")
+    words = re.findall(r"[a-z0-9]+", value.lower())
+    return [
+        word[:-1] if len(word) > 3 and word.endswith("s") and not word.endswith("ss") else word
+        for word in words
+        if word not in STOPWORDS
+    ]
+
+
+class TableIndex:
+    """BM25-style ranking of tables against a question, built from the schema.
+
+    Each table is described by its name, its column names and any table or
+    column comments in the database, plus optional ``descriptions`` for words
+    the schema doesn't contain (e.g. "live music" for experience_raw). The
+    reflected metadata ``SQLDatabase`` already holds is reused, so building the
+    index costs no queries, and the table list is kept until ``refresh``.
+
+    ``select`` returns every table scoring within ``relative_cutoff`` of the best
+    one, or None when even the best scores under ``min_score``, so the caller
+    can fall back to asking the LLM.
+
+    Example:
+        .. code-block:: python
+
+            index = TableIndex(db, descriptions={"experience_raw": "events live music happy hours"})
+            chain = SQLDatabaseSequentialChain.from_llm(llm, db, table_index=index)
+    """
+
+    def __init__(
+        self,
+        database: SQLDatabase,
+        descriptions: Optional[Dict[str, str]] = None,
+        min_score: float = 1.0,
+        relative_cutoff: float = 0.5,
+        max_tables: int = 3,
+    ):
+        self.database = database
+        self.descriptions = descriptions or {}
+        self.min_score = min_score
+        self.relative_cutoff = relative_cutoff
+        self.max_tables = max_tables
+        self._lock = threading.Lock()
+        self.selections = 0
+        self.low_confidence = 0
+        self.select_seconds = 0.0
+        self.refresh()
+
+    def refresh(self) -> None:
+        """Rebuild the index from the database's table list and metadata."""
+        table_names = list(self.database.get_usable_table_names())
+        tables = {table.name: table for table in self.database._metadata.sorted_tables}
+        documents: Dict[str, Counter] = {}
+        for name in table_names:
+            document: Counter = Counter()
+            for term in terms(name):
+                document[term] += NAME_WEIGHT
+            table = tables.get(name)
+            texts = [self.descriptions.get(name, "")]
+            if table is not None:
+                texts.append(table.comment or "")
+                for column in table.columns:
+                    texts += [column.name, column.comment or ""]
+            for text in texts:
+                document.update(terms(text))
+            documents[name] = document
+        document_frequency: Counter = Counter()
+        for document in documents.values():
+            document_frequency.update(set(document))
+        count = len(documents)
+        idf = {
+            term: math.log(1 + (count - frequency + 0.5) / (frequency + 0.5))
+            for term, frequency in document_frequency.items()
+        }
+        average_length = sum(sum(d.values()) for d in documents.values()) / (count or 1)
+        with self._lock:
+            self.table_names = table_names
+            self._documents = documents
+            self._idf = idf
+            self._average_length = average_length or 1.0
+
+    def score(self, question: str) -> List[Tuple[str, float]]:
+        """Every table with its BM25 score for ``question``, best first."""
+        k1, b = 1.2, 0.75
+        query = set(terms(question))
+        with self._lock:
+            scores = []
+            for name, document in self._documents.items():
+                length = sum(document.values())
+                score = 0.0
+                for term in query & set(document):
+                    frequency = document[term]
+                    score += self._idf[term] * frequency * (k1 + 1) / (
+                        frequency + k1 * (1 - b + b * length / self._average_length)
+                    )
+                scores.append((name, score))
+        return sorted(scores, key=lambda item: -item[1])
+
+    def select(self, question: str) -> Optional[List[str]]:
+        """The tables ``question`` most likely needs, or None if unsure."""
+        start = time.perf_counter()
+        if len(self.table_names) <= 1:
+            selected: Optional[List[str]] = list(self.table_names) or None
+        else:
+            scores = self.score(question)
+            best = scores[0][1]
+            if best < self.min_score:
+                selected = None
+            else:
+                selected = [
+                    name for name, score in scores if score >= best * self.relative_cutoff
+                ][: self.max_tables]
+        with self._lock:
+            self.selections += 1
+            self.low_confidence += selected is None
+            self.select_seconds += time.perf_counter() - start
+        return selected
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "tables": len(self.table_names),
+                "selections": self.selections,
+                "low_confidence": self.low_confidence,
+                "select_seconds": self.select_seconds,
+            }
@@ -0,0 +1,50 @@
+"""Callback handler that records LLM token usage on a stage record.
+
+Kept apart from ``chain.Instrumentation`` so recording stage timings doesn't
+import langchain.
+"""
+from __future__ import annotations
+
+from typing import Any, Dict, List
+
+from langchain.callbacks.base import BaseCallbackHandler
+from langchain.schema import LLMResult
+
+from chain.Instrumentation import StageRecord
+from chain.ResultBudget import estimate_tokens
+
+
+class TokenUsageHandler(BaseCallbackHandler):
+    """Callback handler that adds LLM token usage to a ``StageRecord``.
+
+    Uses the provider's reported usage when there is one. Streaming OpenAI
+    completions don't report usage, so those are estimated from the text.
+    """
+
+    # Cheap enough to run on the event loop; otherwise async chains would hand
+    # every callback to a thread and start/end could land out of order
+    run_inline = True
+
+    def __init__(self, record: StageRecord):
+        self.record = record
+        self._prompt_tokens = 0
+
+    def on_llm_start(
+        self, serialized: Dict[str, Any], prompts: List[str], **kwargs: Any
+    ) -> None:
+        self._prompt_tokens = sum(estimate_tokens(prompt) for prompt in prompts)
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        self.record.llm_calls += 1
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        if usage:
+            self.record.prompt_tokens += usage.get("prompt_tokens", 0)
+            self.record.completion_tokens += usage.get("completion_tokens", 0)
+            return
+        self.record.estimated_tokens = True
+        self.record.prompt_tokens += self._prompt_tokens
+        self.record.completion_tokens += sum(
+            estimate_tokens(generation.text)
+            for generations in response.generations
+            for generation in generations
+        )
@@ -0,0 +1,291 @@
+"""Pruned table of the experiences that haven't ended yet, for the Explorer."""
+from __future__ import annotations
+
+import datetime
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+import pandas as pd
+from sqlalchemy import Column, DateTime, Index, MetaData, Table, inspect, text
+from sqlalchemy.engine import Engine
+
+from chain.DateTimeParser import DEFAULT_TIMEZONE
+from chain.LocalReplica import WATERMARK_COLUMN, add_timestamp_columns, ensure_watermark_column
+
+EVENT_START_COLUMN = "event_start_ts"
+EVENT_END_COLUMN = "event_end_ts"
+UPCOMING_TABLE = "experience_upcoming"
+
+
+def _date_text(value: Any) -> Optional[str]:
+    if isinstance(value, datetime.datetime):
+        value = value.date()
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    return value.strip()[:10] if isinstance(value, str) else None
+
+
+def _time_text(value: Any) -> Optional[str]:
+    if isinstance(value, datetime.datetime):
+        value = value.time()
+    if isinstance(value, datetime.time):
+        return value.isoformat()
+    if not isinstance(value, str):
+        return None
+    value = value.strip()
+    # "19:30" needs seconds to parse as a timedelta
+    return f"{value}:00" if re.fullmatch(r"\d{1,2}:\d{2}", value) else value
+
+
+def event_timestamps(
+    event_date: pd.Series, start_time: pd.Series, end_time: pd.Series
+) -> Tuple[pd.Series, pd.Series]:
+    """Local start and end of each experience from its loosely typed columns.
+
+    No start time means the start of the day, and no end time the end of it.
+    An end time before the start time runs past midnight. Rows without a
+    readable date get NaT.
+    """
+    date = pd.to_datetime(event_date.map(_date_text), format="%Y-%m-%d", errors="coerce")
+    start_offset = pd.to_timedelta(start_time.map(_time_text), errors="coerce")
+    end_offset = pd.to_timedelta(end_time.map(_time_text), errors="coerce")
+    start = date + start_offset.fillna(pd.Timedelta(0))
+    end = (date + end_offset).fillna(date + pd.Timedelta(days=1))
+    end = end.mask(end <= start, end + pd.Timedelta(days=1))
+    return start, end
+
+
+def stamp_event_timestamps(df: pd.DataFrame) -> pd.DataFrame:
+    """Add ``event_start_ts`` and ``event_end_ts`` to experience_raw rows.
+
+    ``ensure_timestamp_columns`` adds the columns to experience_raw.
+    """
+    df = df.copy()
+    missing = pd.Series(None, index=df.index, dtype=object)
+    df[EVENT_START_COLUMN], df[EVENT_END_COLUMN] = event_timestamps(
+        df.get("event_date", missing),
+        df.get("event_start_time", missing),
+        df.get("event_end_time", missing),
+    )
+    return df
+
+
+def ensure_timestamp_columns(engine: Engine, table_name: str = "experience_raw") -> None:
+    """Add the normalized timestamp columns to ``table_name`` if it lacks them."""
+    add_timestamp_columns(engine, table_name, [EVENT_START_COLUMN, EVENT_END_COLUMN])
+
+
+class UpcomingExperiences:
+    """Copy of experience_raw holding only experiences that haven't ended.
+
+    Most Explorer questions are about tonight or this weekend, but
+    experience_raw keeps every experience ever submitted, and the generated
+    SQL filters it with ``LIKE`` scans. This table holds the rows whose
+    ``event_end_ts`` is still ahead, clustered by ``event_date`` on Snowflake
+    and indexed on it elsewhere, so those questions read a small table that
+    prunes well.
+
+    ``refresh`` first drops the experiences that have ended. It then copies
+    the source rows ingested at or after the newest ``ingested_at`` already in
+    the table, recomputing their timestamps so rows written before the
+    columns existed are covered too. A source without ``ingested_at``, or an
+    empty table, is rebuilt in full from the experiences dated yesterday or
+    later, as is every ``refresh(full=True)``; only a full rebuild picks up
+    rows updated or deleted in the source. ``on_refresh`` is called with the
+    summary of every refresh that changed the table.
+
+    Example:
+        .. code-block:: python
+
+            upcoming = UpcomingExperiences(sf_engine)
+            upcoming.ensure()
+            upcoming.refresh()
+            upcoming.start(interval=900)
+            db_chain = ExploreChain(llm=llm, database=db, allowed_tables=[upcoming.table_name])
+    """
+
+    def __init__(
+        self,
+        engine: Engine,
+        source_table: str = "experience_raw",
+        table_name: str = UPCOMING_TABLE,
+        timezone: str = DEFAULT_TIMEZONE,
+        batch_size: int = 5000,
+        on_refresh: Optional[Callable[[Dict[str, Any]], None]] = None,
+    ):
+        self.engine = engine
+        self.source_table = source_table
+        self.table_name = table_name
+        self.timezone = timezone
+        self.batch_size = batch_size
+        self.on_refresh = on_refresh
+        self._refresh_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._has_watermark: Optional[bool] = None
+        self._refresh_requested = threading.Event()
+        self._full_refresh_requested = False
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.rows: Optional[int] = None
+        self.last_refreshed_at: Optional[float] = None
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self.refresh_seconds = 0.0
+        self.last_refresh_seconds: Optional[float] = None
+        self.rows_copied = 0
+        self.rows_pruned = 0
+
+    def _now(self) -> datetime.datetime:
+        # Timestamps are local wall-clock time, like event_date and the times
+        return datetime.datetime.now(ZoneInfo(self.timezone)).replace(tzinfo=None)
+
+    def ensure(self) -> None:
+        """Add the timestamp columns to the source and create the table."""
+        ensure_watermark_column(self.engine, self.source_table)
+        ensure_timestamp_columns(self.engine, self.source_table)
+        source_columns = inspect(self.engine).get_columns(self.source_table)
+        self._has_watermark = WATERMARK_COLUMN in (
+            column["name"].lower() for column in source_columns
+        )
+        snowflake = self.engine.dialect.name == "snowflake"
+        columns = [Column(column["name"], column["type"]) for column in source_columns]
+        names = {column.name.lower() for column in columns}
+        for name in (EVENT_START_COLUMN, EVENT_END_COLUMN):
+            if name not in names:
+                columns.append(Column(name, DateTime))
+        if not snowflake:
+            # Snowflake has no indexes; the table is clustered below instead
+            columns.append(Index(f"ix_{self.table_name}_event_date", "event_date"))
+        table = Table(self.table_name, MetaData(), *columns)
+        created = not inspect(self.engine).has_table(self.table_name)
+        table.create(self.engine, checkfirst=True)
+        if created and snowflake:
+            with self.engine.begin() as conn:
+                conn.execute(text(f"ALTER TABLE {self.table_name} CLUSTER BY (event_date)"))
+
+    def _watermark(self) -> Optional[Any]:
+        if not self._has_watermark:
+            return None
+        with self.engine.connect() as conn:
+            return conn.execute(
+                text(f"SELECT MAX({WATERMARK_COLUMN}) FROM {self.table_name}")
+            ).scalar()
+
+    def refresh(self, full: bool = False) -> Dict[str, Any]:
+        """Prune ended experiences and copy new ones, or rebuild if ``full``.
+        Returns what it did."""
+        with self._refresh_lock:
+            start = time.perf_counter()
+            try:
+                if self._has_watermark is None:
+                    self.ensure()
+                now = self._now()
+                watermark = None if full else self._watermark()
+                # Yesterday's experiences can still be running past midnight
+                query = f"SELECT * FROM {self.source_table} WHERE event_date >= :since"
+                params: Dict[str, Any] = {"since": now.date() - datetime.timedelta(days=1)}
+                if watermark is not None:
+                    query += f" AND {WATERMARK_COLUMN} >= :watermark"
+                    params["watermark"] = watermark
+                # Rows land in date order, so a date range reads adjacent pages
+                query += " ORDER BY event_date, event_start_time"
+
+                copied = 0
+                with self.engine.begin() as conn:
+                    pruned = conn.execute(
+                        text(f"DELETE FROM {self.table_name} WHERE {EVENT_END_COLUMN} <= :now"),
+                        {"now": now},
+                    ).rowcount
+                    if watermark is None:
+                        replaced = conn.execute(text(f"DELETE FROM {self.table_name}")).rowcount
+                    else:
+                        # Rows at the watermark are fetched again, so drop the old copies
+                        replaced = conn.execute(
+                            text(
+                                f"DELETE FROM {self.table_name} "
+                                f"WHERE {WATERMARK_COLUMN} >= :watermark"
+                            ),
+                            {"watermark": watermark},
+                        ).rowcount
+                    # Each chunk is written as it is read, so only one is ever in memory
+                    for chunk in pd.read_sql(
+                        text(query), conn, params=params, chunksize=self.batch_size
+                    ):
+                        chunk = stamp_event_timestamps(chunk)
+                        chunk = chunk[chunk[EVENT_END_COLUMN] > now]
+                        chunk.to_sql(self.table_name, conn, if_exists="append", index=False)
+                        copied += len(chunk)
+                    rows = conn.execute(text(f"SELECT COUNT(*) FROM {self.table_name}")).scalar()
+            except Exception:
+                with self._stats_lock:
+                    self.refresh_errors += 1
+                raise
+            seconds = time.perf_counter() - start
+            with self._stats_lock:
+                self.rows = rows
+                self.refreshes += 1
+                self.refresh_seconds += seconds
+                self.last_refresh_seconds = seconds
+                self.rows_copied += copied
+                self.rows_pruned += pruned
+                self.last_refreshed_at = time.time()
+        summary = {
+            "mode": "full" if watermark is None else "incremental",
+            "rows": copied,
+            "new_rows": copied - replaced,
+            "pruned": pruned,
+            "seconds": seconds,
+        }
+        # A full rebuild may have changed rows without changing the count
+        if (summary["new_rows"] or pruned or full) and self.on_refresh is not None:
+            self.on_refresh(summary)
+        return summary
+
+    def request_refresh(self, full: bool = False) -> None:
+        """Refresh soon: on the background thread if started, otherwise now."""
+        if self._thread is not None and self._thread.is_alive():
+            self._full_refresh_requested = self._full_refresh_requested or full
+            self._refresh_requested.set()
+        else:
+            self.refresh(full)
+
+    def start(self, interval: float = 900) -> None:
+        """Refresh every ``interval`` seconds, and on ``request_refresh``, in a daemon thread."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopped.clear()
+
+        def loop() -> None:
+            while not self._stopped.is_set():
+                self._refresh_requested.wait(interval)
+                self._refresh_requested.clear()
+                if self._stopped.is_set():
+                    return
+                full, self._full_refresh_requested = self._full_refresh_requested, False
+                try:
+                    self.refresh(full)
+                except Exception:
+                    # Counted in refresh_errors; the table keeps its last contents
+                    pass
+
+        self._thread = threading.Thread(target=loop, name="upcoming-refresh", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._refresh_requested.set()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            return {
+                "rows": self.rows,
+                "refreshes": self.refreshes,
+                "refresh_errors": self.refresh_errors,
+                "refresh_seconds": self.refresh_seconds,
+                "last_refresh_seconds": self.last_refresh_seconds,
+                "rows_copied": self.rows_copied,
+                "rows_pruned": self.rows_pruned,
+            }
@@ -2,43 +2,281 @@
 import streamlit as st
 
 import pandas as pd
-import json
 import datetime
-import pyodbc
-import snowflake.connector
-from sqlalchemy import create_engine
-import snowflake.sqlalchemy
+import importlib
+import threading
+
+# langchain and the chains built on it take seconds to import, so they are
+# imported where they are first used rather than here; see prewarm_imports()
+from chain.Instrumentation import MetricsRecorder, maybe_stage, new_request_id
+from chain.IntentRouter import IntentRouter
+from chain.LocalReplica import LocalReplica, ensure_watermark_column, stamp_ingested_at
+from chain.QueryCache import InMemoryCacheBackend, QueryCache, SQLiteCacheBackend
+from chain.SchemaCache import SchemaCache
+from chain.SchemaDescriptor import SchemaDescriptor
+from chain.SingleFlight import SingleFlight, SingleFlightTimeout
+from chain.SQLValidator import SQLValidationError
+from chain.SnowflakeEngine import connection_string_from_secrets, get_engine, pool_stats
+from chain.SubmissionQueue import SubmissionQueue
+from chain.UpcomingExperiences import UpcomingExperiences, ensure_timestamp_columns, stamp_event_timestamps
 
-from langchain.chat_models import ChatOpenAI
-from langchain.chains import create_extraction_chain, create_extraction_chain_pydantic
-from langchain.llms import OpenAI
-from langchain.prompts import ChatPromptTemplate
-from langchain import SQLDatabase
+OPEN_AI_API_KEY = st.secrets["open_api_key"]
 
-from chain.ExploreChain import ExploreChain
-from chain.ExperienceExtractorChain import ExperienceExtractorChain
+SCHEMA_CACHE_TTL = st.secrets.get("schema_cache_ttl", 3600)
+SCHEMA_SNAPSHOT_PATH = st.secrets.get("schema_snapshot_path", ".cache/schema_cache.json")
 
-OPEN_AI_API_KEY = st.secrets["open_api_key"]
+SCHEMA_DESCRIPTOR = st.secrets.get("schema_descriptor", True)
+SCHEMA_DESCRIPTOR_MAX_TOKENS = st.secrets.get("schema_descriptor_max_tokens", 120)
+SCHEMA_DESCRIPTOR_SNAPSHOT_PATH = st.secrets.get("schema_descriptor_snapshot_path", ".cache/schema_descriptor.json")
+
+QUERY_CACHE_BACKEND = st.secrets.get("query_cache_backend", "sqlite")
+QUERY_CACHE_PATH = st.secrets.get("query_cache_path", ".cache/query_cache.sqlite")
+QUERY_CACHE_MAXSIZE = st.secrets.get("query_cache_maxsize", 10000)
+QUERY_CACHE_TTL = st.secrets.get("query_cache_ttl", 86400)
+
+EXPLORER_MAX_RESULT_ROWS = st.secrets.get("explorer_max_result_rows", 25)
+EXPLORER_MAX_RESULT_TOKENS = st.secrets.get("explorer_max_result_tokens", 1000)
+
+EXPLORER_INTENT_ROUTER = st.secrets.get("explorer_intent_router", True)
+
+EXPLORER_SINGLE_FLIGHT = st.secrets.get("explorer_single_flight", True)
+EXPLORER_SINGLE_FLIGHT_TIMEOUT = st.secrets.get("explorer_single_flight_timeout", 60)
+
+# Explorer reads a table of the experiences that haven't ended yet, instead of all of experience_raw
+EXPLORER_UPCOMING = st.secrets.get("explorer_upcoming", True)
+EXPLORER_UPCOMING_REFRESH_INTERVAL = st.secrets.get("explorer_upcoming_refresh_interval", 900)
+
+EXPLORER_REPLICA = st.secrets.get("explorer_replica", False)
+EXPLORER_REPLICA_PATH = st.secrets.get("explorer_replica_path", ".cache/experience_replica.sqlite")
+EXPLORER_REPLICA_SYNC_INTERVAL = st.secrets.get("explorer_replica_sync_interval", 300)
 
-SF_ACCOUNT = st.secrets["sf_account"]
-SF_DATABASE = st.secrets["sf_database"]
-SF_SCHEMA = st.secrets["sf_schema"]
-SF_USERNAME = st.secrets["sf_username"]
-SF_PASSWORD = st.secrets["sf_password"]
+# Portal submits are queued, deduplicated and merged into experience_raw in batches
+SUBMISSION_QUEUE = st.secrets.get("submission_queue", True)
+SUBMISSION_MAX_BATCH = st.secrets.get("submission_max_batch", 50)
+SUBMISSION_MAX_DELAY = st.secrets.get("submission_max_delay", 2.0)
+SUBMISSION_SPOOL_PATH = st.secrets.get("submission_spool_path", ".cache/submission_spool.jsonl")
+
+# Extract typed dates and times in one function call instead of extraction plus conversions
+STRUCTURED_EXTRACTION = st.secrets.get("structured_extraction", True)
+
+# Results kept per session, so reruns from other widgets don't call the LLM again
+SESSION_MEMO_SIZE = st.secrets.get("session_memo_size", 5)
+
+# Import the LLM stack in the background after the first render
+PREWARM_IMPORTS = st.secrets.get("prewarm_imports", True)
+PREWARM_MODULES = ['chain.ExploreChain', 'chain.ExperienceExtractorChain', 'langchain.llms', 'langchain.chat_models']
+
+DEBUG_PANEL = st.secrets.get("debug_panel", False)
+METRICS_JSONL_PATH = st.secrets.get("metrics_jsonl_path")
+METRICS_PROMETHEUS_PATH = st.secrets.get("metrics_prometheus_path")
+
+SF_POOL_SIZE = st.secrets.get("sf_pool_size", 5)
+SF_POOL_MAX_OVERFLOW = st.secrets.get("sf_pool_max_overflow", 10)
+SF_POOL_TIMEOUT = st.secrets.get("sf_pool_timeout", 30)
+SF_POOL_RECYCLE = st.secrets.get("sf_pool_recycle", 3600)
 
 
 def sf_engine():
-    conn = snowflake.connector.connect(
-        user=SF_USERNAME,
-        password=SF_PASSWORD,
-        account=SF_ACCOUNT,
-        database=SF_DATABASE,
-        schema=SF_SCHEMA
+    # One pooled engine per process, shared by every session and both tabs
+    return get_engine(
+        connection_string_from_secrets(st.secrets),
+        pool_size=SF_POOL_SIZE,
+        max_overflow=SF_POOL_MAX_OVERFLOW,
+        pool_timeout=SF_POOL_TIMEOUT,
+        pool_recycle=SF_POOL_RECYCLE
     )
 
-    connection_string = f'snowflake://{SF_USERNAME}:{SF_PASSWORD}@{SF_ACCOUNT}/{SF_DATABASE}/{SF_SCHEMA}'
-    # Create an SQLAlchemy engine
-    return create_engine(connection_string)
+@st.cache_resource
+def experience_timestamp_columns():
+    # The portal writes ingested_at, event_start_ts and event_end_ts, so experience_raw needs them
+    ensure_watermark_column(sf_engine())
+    ensure_timestamp_columns(sf_engine())
+
+def upcoming_refreshed(summary):
+    explorer_query_cache().invalidate()
+    if explorer_replica() is not None:
+        # Pruned or updated rows only change in the replica with a full copy
+        explorer_replica().request_sync(full=summary['pruned'] > 0 or summary['mode'] == 'full')
+
+def experiences_written(df, updated=False):
+    # Runs on the submission queue's thread after each flush, so no st.* calls here
+    explorer_query_cache().invalidate()
+    if explorer_schema_descriptor() is not None:
+        explorer_schema_descriptor().observe(df)
+    if explorer_upcoming() is not None:
+        # Its refresh syncs the replica once the new experience is in the table
+        explorer_upcoming().request_refresh(full=updated)
+    elif explorer_replica() is not None:
+        explorer_replica().request_sync(full=updated)
+
+@st.cache_resource
+def submission_queue():
+    experience_timestamp_columns()
+    queue = SubmissionQueue(
+        sf_engine(),
+        max_batch=SUBMISSION_MAX_BATCH,
+        spool_path=SUBMISSION_SPOOL_PATH,
+        on_flush=lambda df, summary: experiences_written(df, updated=summary['updated'] > 0)
+    )
+    queue.start(max_delay=SUBMISSION_MAX_DELAY)
+    return queue
+
+@st.cache_resource
+def explorer_upcoming():
+    if not EXPLORER_UPCOMING:
+        return None
+    upcoming = UpcomingExperiences(sf_engine())
+    upcoming.ensure()
+    upcoming.refresh()
+    # Set after the first refresh; the replica it syncs is built from this table
+    upcoming.on_refresh = upcoming_refreshed
+    upcoming.start(interval=EXPLORER_UPCOMING_REFRESH_INTERVAL)
+    return upcoming
+
+def explorer_table():
+    # Looking up the upcoming table creates it, so it exists before anything reflects it
+    return explorer_upcoming().table_name if EXPLORER_UPCOMING else 'experience_raw'
+
+@st.cache_resource
+def explorer_database():
+    from langchain import SQLDatabase
+
+    # SQLDatabase reflects the schema when it is built, so build it once per process
+    return SQLDatabase(sf_engine(), include_tables=[explorer_table()])
+
+@st.cache_resource
+def explorer_schema_cache():
+    return SchemaCache(explorer_database(), ttl=SCHEMA_CACHE_TTL, snapshot_path=SCHEMA_SNAPSHOT_PATH)
+
+@st.cache_resource
+def explorer_schema_descriptor():
+    # Compact column list and common values, sent instead of the full table info
+    if not SCHEMA_DESCRIPTOR:
+        return None
+    # Capped at the size of the table info it replaces, so it never costs more prompt tokens
+    return SchemaDescriptor(sf_engine(), table_name=explorer_table(), max_tokens=SCHEMA_DESCRIPTOR_MAX_TOKENS, snapshot_path=SCHEMA_DESCRIPTOR_SNAPSHOT_PATH, table_info=explorer_schema_cache())
+
+@st.cache_resource
+def explorer_query_cache():
+    if QUERY_CACHE_BACKEND == 'memory':
+        backend = InMemoryCacheBackend(maxsize=QUERY_CACHE_MAXSIZE, ttl=QUERY_CACHE_TTL)
+    else:
+        backend = SQLiteCacheBackend(QUERY_CACHE_PATH, maxsize=QUERY_CACHE_MAXSIZE, ttl=QUERY_CACHE_TTL)
+    return QueryCache(backend)
+
+@st.cache_resource
+def explorer_replica():
+    # Explorer queries run on a local copy of the explorer table, synced in the background
+    if not EXPLORER_REPLICA:
+        return None
+    replica = LocalReplica(
+        sf_engine(),
+        path=EXPLORER_REPLICA_PATH,
+        table_name=explorer_table(),
+        on_sync=lambda summary: explorer_query_cache().invalidate()
+    )
+    replica.sync()
+    replica.start(interval=EXPLORER_REPLICA_SYNC_INTERVAL)
+    return replica
+
+@st.cache_resource
+def explorer_router():
+    return IntentRouter(sf_engine(), replica=explorer_replica(), table_name=explorer_table())
+
+@st.cache_resource
+def explorer_flight():
+    return SingleFlight(timeout=EXPLORER_SINGLE_FLIGHT_TIMEOUT)
+
+@st.cache_resource
+def extraction_llm():
+    from langchain.chat_models import ChatOpenAI
+
+    return ChatOpenAI(openai_api_key=OPEN_AI_API_KEY, temperature=0, model="gpt-3.5-turbo-0613")
+
+@st.cache_resource
+def convert_llm():
+    from langchain.llms import OpenAI
+
+    return OpenAI(openai_api_key=OPEN_AI_API_KEY, temperature=0)
+
+@st.cache_resource
+def explorer_chain():
+    from langchain.llms import OpenAI
+    from chain.ExploreChain import ExploreChain
+
+    # The chain holds no per-question state, so every session can share one
+    # streaming=True lets the answer render token by token
+    llm = OpenAI(openai_api_key=OPEN_AI_API_KEY, temperature=0, streaming=True)
+    return ExploreChain(
+        llm=llm,
+        database=explorer_database(),
+        schema_cache=explorer_schema_cache(),
+        schema_descriptor=explorer_schema_descriptor(),
+        query_cache=explorer_query_cache(),
+        use_sql_validator=True,
+        allowed_tables=[explorer_table()],
+        max_result_rows=EXPLORER_MAX_RESULT_ROWS,
+        max_result_tokens=EXPLORER_MAX_RESULT_TOKENS,
+        metrics=metrics_recorder(),
+        replica=explorer_replica(),
+        verbose=True
+    )
+
+@st.cache_resource
+def prewarm_imports():
+    # Once per process, so the first question or description doesn't wait on imports
+    def load():
+        for module in PREWARM_MODULES:
+            importlib.import_module(module)
+    thread = threading.Thread(target=load, name='prewarm-imports', daemon=True)
+    thread.start()
+    return thread
+
+@st.cache_resource
+def metrics_recorder():
+    return MetricsRecorder()
+
+def finish_request(request_id):
+    # Export this request's stage timings and show them if the debug panel is on
+    metrics = metrics_recorder()
+    if METRICS_JSONL_PATH:
+        metrics.write_jsonl(METRICS_JSONL_PATH, request_id)
+    if METRICS_PROMETHEUS_PATH:
+        metrics.write_prometheus(METRICS_PROMETHEUS_PATH)
+    if show_timing:
+        breakdown = pd.DataFrame(metrics.breakdown(request_id))
+        if not breakdown.empty:
+            with st.expander(f"Request timing ({breakdown['seconds'].sum():.2f}s)"):
+                st.dataframe(breakdown[['chain', 'stage', 'seconds', 'llm_calls', 'prompt_tokens', 'completion_tokens', 'error', 'extra']])
+
+def session_memo(name):
+    return st.session_state.setdefault(name, {})
+
+def remember(memo, key, value):
+    # Keep the most recent SESSION_MEMO_SIZE entries
+    memo.pop(key, None)
+    memo[key] = value
+    while len(memo) > SESSION_MEMO_SIZE:
+        memo.pop(next(iter(memo)))
+
+def extract_experience(user_input):
+    from chain.ExperienceExtractorChain import ExperienceExtractorChain
+
+    # Streamlit reruns the script on every form edit; only extract again when the text changes
+    extractions = session_memo('extractions')
+    if user_input not in extractions:
+        request_id = new_request_id()
+        extractor_chain = ExperienceExtractorChain(
+            user_input=user_input,
+            metrics=metrics_recorder(),
+            request_id=request_id,
+            extraction_llm=extraction_llm(),
+            convert_llm=convert_llm(),
+            structured=STRUCTURED_EXTRACTION
+        )
+        remember(extractions, user_input, extractor_chain.run())
+        finish_request(request_id)
+    return extractions[user_input]
 
 def get_text():
     input_text = st.text_area("What's poppin'? ", "")
@@ -47,6 +285,36 @@ def get_text():
 # UI
 st.set_page_config(page_title="Project Louru | Experience Portal", page_icon=":robot:")
 
+show_timing = DEBUG_PANEL and st.sidebar.checkbox("Show request timing")
+
+if st.secrets.get("show_pool_stats", False):
+    with st.sidebar.expander("Snowflake connection pool"):
+        st.json(pool_stats(sf_engine()))
+
+if DEBUG_PANEL and SUBMISSION_QUEUE:
+    with st.sidebar.expander("Portal submission queue"):
+        st.json(submission_queue().stats())
+
+if DEBUG_PANEL and explorer_upcoming() is not None:
+    with st.sidebar.expander("Explorer upcoming experiences"):
+        st.json(explorer_upcoming().stats())
+
+if DEBUG_PANEL and explorer_replica() is not None:
+    with st.sidebar.expander("Explorer replica"):
+        st.json(explorer_replica().stats())
+
+if DEBUG_PANEL and explorer_schema_descriptor() is not None:
+    with st.sidebar.expander("Explorer schema prompt"):
+        st.json(explorer_schema_descriptor().compare(explorer_schema_cache()))
+
+if DEBUG_PANEL and EXPLORER_INTENT_ROUTER:
+    with st.sidebar.expander("Explorer intent router"):
+        st.json(explorer_router().stats())
+
+if DEBUG_PANEL and EXPLORER_SINGLE_FLIGHT:
+    with st.sidebar.expander("Explorer request coalescing"):
+        st.json(explorer_flight().stats())
+
 tab1, tab2 = st.tabs(['Experience Management Portal', 'Experience Explorer'])
 
 with tab1:
@@ -65,8 +333,7 @@ with tab1:
 
     if user_input:
 
-        extractor_chain = ExperienceExtractorChain(user_input=user_input)
-        df, date_df, start_time_df, end_time_df = extractor_chain.run()
+        df, date_df, start_time_df, end_time_df = extract_experience(user_input)
 
         with st.chat_message("user"):
             st.write("Sounds awesome 🥳 Please confirm we understood you correctly, and press submit to share your awesome experience with the world!")
@@ -120,20 +387,32 @@ with tab1:
 
                 if submit:
                     st.write(f"Thanks 🙏 Your {form_response_df['event_type'].iloc[0]} is going to be a HIT! 🎉")
-                    form_response_df.to_sql('experience_raw', con=sf_engine(), if_exists='append', index=False)
+                    if SUBMISSION_QUEUE:
+                        # Written within SUBMISSION_MAX_DELAY seconds; the flush runs the hooks
+                        submission_queue().submit(form_response_df)
+                        queue_stats = submission_queue().stats()
+                        if queue_stats['failing'] or queue_stats['spooled']:
+                            # Listings that can't be written are spooled locally and retried
+                            st.warning("We're having trouble saving listings right now. Yours is safe with us and will show up once we're back on track!")
+                    else:
+                        experience_timestamp_columns()
+                        stamp_event_timestamps(stamp_ingested_at(form_response_df)).to_sql('experience_raw', con=sf_engine(), if_exists='append', index=False)
+                        experiences_written(form_response_df)
+                    session_memo('explorer_answers').clear()
 
 with tab2:
     
     template = """Context:  Your name is Louru, and users ask you questions about businesses in St. Louis, Missouri. If the SQLResult returns no results, respond 'No results' to the user and nothing else.
 
-    follow these 7 rules when answering questions: 
-    1. Only use the experience_raw table in the landing schema to answer the following question about businesses. 
+    follow these 8 rules when answering questions: 
+    1. Only use the <table> table in the landing schema to answer the following question about businesses. 
     2. If you are not sure of an answer, respond to the user and ask them to reqord their question.
     3. If your query does not return any results, tell the user 'No results found'
     4. Be sure to use like keyword with wildcards when doing any text search.
     5. If doing text search in where statement, remove plurality when doing search
     6. Escape the '$' character when replying
     7. use 'current_date()' when referencing the current date in the sql query
+    8. event_start_ts and event_end_ts are the local start and end of each experience; order results by event_start_ts
 
     Question: <prompt>
     Answer:
@@ -154,18 +433,70 @@ with tab2:
 
     user_input = st.text_area("Whatcha lookin' for? ", "")
 
-    if user_input:
-
-        prompt = template.replace('<prompt>', user_input)
-
-        connection_string = f'snowflake://{SF_USERNAME}:{SF_PASSWORD}@{SF_ACCOUNT}/{SF_DATABASE}/{SF_SCHEMA}'
-        db = SQLDatabase.from_uri(connection_string)
-
-        llm = OpenAI(openai_api_key=OPEN_AI_API_KEY,temperature=0)
-        db_chain = ExploreChain(llm=llm, database=db, verbose=True)
-        response = db_chain(prompt)
-
-        if response:
-            st.write(response['result'])
-            #st.write(db_chain["intermediate_steps"])
-
+    # Answers already given this session are shown again without rerunning the chain
+    explorer_answers = session_memo('explorer_answers')
+    answered = user_input in explorer_answers
+    if user_input and answered:
+        st.write(explorer_answers[user_input])
+
+    request_id = new_request_id()
+    routed = None
+    if user_input and not answered and EXPLORER_INTENT_ROUTER:
+        # Common questions are answered straight from a prepared query, without the LLM
+        with maybe_stage(metrics_recorder(), request_id, 'explore', 'intent_routing') as record:
+            routed = explorer_router().route(user_input)
+            record.extra['hit'] = routed is not None
+        if routed is not None:
+            st.write(routed.answer)
+            remember(explorer_answers, user_input, routed.answer)
+            finish_request(request_id)
+
+    if user_input and not answered and routed is None:
+
+        prompt = template.replace('<table>', explorer_table()).replace('<prompt>', user_input)
+
+        db_chain = explorer_chain()
+
+        status = st.empty()
+        rows_placeholder = st.empty()
+        answer_placeholder = st.empty()
+        status.caption("Thinking about what you're looking for...")
+
+        def stream_explorer_answer():
+            answer = ''
+            for event, payload in db_chain.stream_answer(prompt, request_id=request_id):
+                if event == 'sql':
+                    status.caption("Checking our experiences...")
+                elif event == 'result':
+                    status.caption("Found some options, writing up your answer...")
+                    if payload:
+                        # Show the rows while the answer is still being written
+                        rows_placeholder.expander("What we found", expanded=True).text(payload)
+                elif event == 'token':
+                    answer += payload
+                    answer_placeholder.markdown(answer + '▌')
+                elif event == 'answer':
+                    answer = payload
+                    #st.write(db_chain["intermediate_steps"])
+            return answer
+
+        try:
+            if EXPLORER_SINGLE_FLIGHT:
+                # Sessions asking the same thing at the same time share one run; only the first one streams it
+                final_answer, _ = explorer_flight().do(user_input, stream_explorer_answer)
+            else:
+                final_answer = stream_explorer_answer()
+            status.empty()
+            answer_placeholder.write(final_answer)
+            remember(explorer_answers, user_input, final_answer)
+        except SingleFlightTimeout:
+            status.empty()
+            st.write("Lots of folks are asking that right now.. Give it another try in a moment!")
+        except SQLValidationError:
+            status.empty()
+            # Not remembered, so asking again retries once the LLM writes valid SQL
+            st.write("We couldn't quite figure that one out.. Try rewording your question!")
+        finish_request(request_id)
+
+if PREWARM_IMPORTS:
+    prewarm_imports()
@@ -0,0 +1,87 @@
+from types import SimpleNamespace
+
+import pytest
+from langchain.utilities.sql_database import SQLDatabase
+from sqlalchemy import create_engine, text
+
+from bench.FakeLLM import FakeLLM
+from chain.ExploreChain import ExploreChain
+from chain.ResultBudget import set_schema
+
+
+def make_database(rows):
+    engine = create_engine("sqlite://")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE experience_raw (business_name TEXT, event_type TEXT)"))
+        for i in range(rows):
+            conn.execute(
+                text("INSERT INTO experience_raw VALUES (:name, 'music')"),
+                {"name": f"Venue {i}"},
+            )
+    return SQLDatabase(engine)
+
+
+def make_chain(database, prompts, **kwargs):
+    def respond(prompt):
+        prompts.append(prompt)
+        if prompt.rstrip().endswith("Answer:"):
+            return "Lots of music."
+        return "SELECT business_name FROM experience_raw"
+
+    return ExploreChain.from_llm(
+        FakeLLM(responder=respond), database, use_sql_validator=True, **kwargs
+    )
+
+
+def test_row_budget_notes_omitted_rows():
+    prompts = []
+    chain = make_chain(make_database(40), prompts, max_result_rows=25)
+    assert chain.run("What music is on?") == "Lots of music."
+    answer_prompt = prompts[-1]
+    assert "LIMIT 26" in answer_prompt
+    assert "Venue 24" in answer_prompt
+    assert "Venue 25" not in answer_prompt
+    assert "(more rows not shown)" in answer_prompt
+
+
+def test_row_budget_has_no_note_when_everything_fits():
+    prompts = []
+    chain = make_chain(make_database(10), prompts, max_result_rows=25)
+    chain.run("What music is on?")
+    assert "Venue 9" in prompts[-1]
+    assert "more rows not shown" not in prompts[-1]
+
+
+class RecordingConnection:
+    def __init__(self, dialect):
+        self.dialect = SimpleNamespace(name=dialect)
+        self.statements = []
+
+    def exec_driver_sql(self, statement):
+        self.statements.append(statement)
+
+
+@pytest.mark.parametrize(
+    "dialect, statements",
+    [
+        ("snowflake", ["ALTER SESSION SET search_path='landing'"]),
+        ("postgresql", ["SET search_path TO landing"]),
+        ("sqlite", []),
+    ],
+)
+def test_set_schema_matches_sql_database(dialect, statements):
+    connection = RecordingConnection(dialect)
+    set_schema(connection, "landing")
+    assert connection.statements == statements
+
+
+def test_bounded_results_run_in_the_database_schema(monkeypatch):
+    database = make_database(3)
+    database._schema = "main"
+    schemas = []
+    monkeypatch.setattr(
+        "chain.ResultBudget.set_schema",
+        lambda connection, schema: schemas.append(schema),
+    )
+    make_chain(database, [], max_result_rows=25).run("What music is on?")
+    assert schemas == ["main"]
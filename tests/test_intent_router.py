@@ -0,0 +1,83 @@
+import datetime
+
+import pytest
+from sqlalchemy import create_engine, text
+
+from chain.IntentRouter import LIVE_MUSIC_INTENT, Intent, IntentRouter
+
+TODAY = datetime.date(2026, 10, 17)
+NOW = datetime.datetime(2026, 10, 17, 21, 30)
+ROWS = [
+    ("Early Bar", "Aaron Kamm", "2026-10-17", "18:00:00", "20:00:00", "2026-10-17 20:00:00"),
+    ("Late Bar", "Jake's Leg", "2026-10-17", "20:00:00", "23:00:00", "2026-10-17 23:00:00"),
+    ("Tomorrow Bar", "Kingdom Brass", "2026-10-18", "18:00:00", "20:00:00", "2026-10-18 20:00:00"),
+]
+
+
+@pytest.fixture(autouse=True)
+def clock(monkeypatch):
+    monkeypatch.setattr("chain.IntentRouter.local_today", lambda timezone: TODAY)
+    monkeypatch.setattr("chain.IntentRouter.local_now", lambda timezone: NOW)
+
+
+def make_engine(with_end_ts=True):
+    engine = create_engine("sqlite://")
+    end_ts = ", event_end_ts TIMESTAMP" if with_end_ts else ""
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                "CREATE TABLE experience_raw (business_name TEXT, event_type TEXT, "
+                "band_name TEXT, happy_hour_deal TEXT, event_date DATE, "
+                "event_start_time TIME, event_end_time TIME, event_price NUMERIC"
+                f"{end_ts})"
+            )
+        )
+        for name, band, date, start, end, end_ts_value in ROWS:
+            row = {"name": name, "band": band, "date": date, "start": start, "end": end}
+            columns = ":name, 'live music', :band, NULL, :date, :start, :end, 10"
+            if with_end_ts:
+                row["end_ts"] = end_ts_value
+                columns += ", :end_ts"
+            conn.execute(text(f"INSERT INTO experience_raw VALUES ({columns})"), row)
+    return engine
+
+
+def businesses(routed):
+    return [row["business_name"] for row in routed.rows]
+
+
+@pytest.mark.parametrize(
+    "question", ["Any live music tonight?", "Where can I hear live music today?"]
+)
+def test_same_day_skips_shows_that_already_ended(question):
+    routed = IntentRouter(make_engine()).route(question)
+    assert businesses(routed) == ["Late Bar"]
+
+
+def test_open_window_skips_ended_shows_but_keeps_later_days():
+    routed = IntentRouter(make_engine()).route("Where can I hear live music?")
+    assert businesses(routed) == ["Late Bar", "Tomorrow Bar"]
+
+
+def test_tables_without_end_timestamps_still_route():
+    routed = IntentRouter(make_engine(with_end_ts=False)).route("Any live music tonight?")
+    assert businesses(routed) == ["Early Bar", "Late Bar"]
+
+
+def test_render_escapes_markdown_in_every_field():
+    router = IntentRouter(make_engine())
+    intent = Intent(name=LIVE_MUSIC_INTENT, params={"start_date": TODAY, "end_date": TODAY})
+    answer = router.render(
+        intent,
+        [
+            {
+                "business_name": "*Bar* [click](http://x)",
+                "band_name": "The $5 _Band_",
+                "event_start_time": datetime.time(20),
+                "event_price": 5,
+            }
+        ],
+    )
+    assert "**\\*Bar\\* \\[click\\](http://x)**" in answer
+    assert "The \\$5 \\_Band\\_" in answer
+    assert "\\$5" in answer.splitlines()[-1]
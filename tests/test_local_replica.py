@@ -0,0 +1,99 @@
+import datetime
+
+import pytest
+from langchain.utilities.sql_database import SQLDatabase
+from sqlalchemy import create_engine, text
+
+from bench.FakeLLM import FakeLLM
+from chain.ExploreChain import ExploreChain
+from chain.LocalReplica import LocalReplica
+
+NOW = datetime.datetime(2026, 10, 17, 21, 30)
+
+
+@pytest.fixture
+def source():
+    engine = create_engine("sqlite://")
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                "CREATE TABLE experience_raw "
+                "(business_name TEXT, event_date DATE, event_end_ts TIMESTAMP)"
+            )
+        )
+        conn.execute(
+            text(
+                "INSERT INTO experience_raw VALUES "
+                "('Early Show', '2026-10-17', '2026-10-17 20:00:00'), "
+                "('Late Show', '2026-10-17', '2026-10-17 23:00:00')"
+            )
+        )
+    return engine
+
+
+@pytest.fixture
+def replica(source, tmp_path, monkeypatch):
+    monkeypatch.setattr("chain.LocalReplica.local_now", lambda timezone: NOW)
+    return LocalReplica(source, path=str(tmp_path / "replica.sqlite"))
+
+
+@pytest.mark.parametrize(
+    "sql, expected",
+    [
+        ("SELECT current_date()", "SELECT '2026-10-17'"),
+        ("SELECT CURRENT_TIMESTAMP", "SELECT '2026-10-17 21:30:00'"),
+        ("SELECT current_time()", "SELECT '21:30:00'"),
+        (
+            "SELECT DATEADD(hour, 6, CURRENT_TIMESTAMP)",
+            "SELECT DATETIME('2026-10-17 21:30:00', '6 HOUR')",
+        ),
+        (
+            "SELECT DATEADD(day, 1, current_date())",
+            "SELECT DATE('2026-10-17', '1 DAY')",
+        ),
+        (
+            "SELECT DATEADD(minutes, 30, event_end_ts) FROM experience_raw",
+            "SELECT DATETIME(event_end_ts, '30 MINUTE') FROM experience_raw",
+        ),
+        (
+            "SELECT DATEADD(week, 2, event_date) FROM experience_raw",
+            "SELECT DATE(event_date, '14 DAY') FROM experience_raw",
+        ),
+    ],
+)
+def test_translate(replica, sql, expected):
+    assert replica.translate(sql) == expected
+
+
+def test_translated_timestamps_compare_with_local_event_times(replica):
+    replica.sync()
+    sql = replica.translate(
+        "SELECT business_name FROM experience_raw WHERE event_end_ts > CURRENT_TIMESTAMP"
+    )
+    with replica.engine.connect() as conn:
+        assert conn.execute(text(sql)).scalars().all() == ["Late Show"]
+
+
+@pytest.mark.parametrize(
+    "sql",
+    [
+        "SELECT current_date() + 7",
+        "SELECT * FROM experience_raw WHERE event_date < (current_date - 1)",
+        "SELECT CURRENT_TIMESTAMP - INTERVAL '2 hours'",
+        "SELECT DATEADD(century, 1, event_date) FROM experience_raw",
+    ],
+)
+def test_translate_refuses_date_arithmetic_sqlite_cannot_do(replica, sql):
+    with pytest.raises(ValueError):
+        replica.translate(sql)
+
+
+def test_untranslatable_query_falls_back_to_the_database(source, replica):
+    replica.sync()
+    sql = "SELECT business_name FROM experience_raw WHERE event_date < current_date + 7"
+    chain = ExploreChain.from_llm(
+        FakeLLM(responder=lambda prompt: sql), SQLDatabase(source), replica=replica
+    )
+    chain.run("What's on this week?")
+    assert replica.stats()["fallbacks"] == 1
+    assert replica.stats()["queries"] == 0
@@ -0,0 +1,23 @@
+from langchain.utilities.sql_database import SQLDatabase
+
+from bench.SyntheticData import seed_database
+from chain.ResultBudget import estimate_tokens
+from chain.SchemaDescriptor import SchemaDescriptor
+
+
+def test_descriptor_is_never_larger_than_the_table_info_it_replaces():
+    database = SQLDatabase(seed_database(rows=200))
+    descriptor = SchemaDescriptor(
+        database._engine, max_values=10, max_tokens=None, table_info=database
+    )
+    comparison = descriptor.compare(database)
+    assert comparison["descriptor_tokens"] <= comparison["table_info_tokens"]
+    assert "Common event_type values" in descriptor.get_table_info()
+
+
+def test_default_budget_fits_under_table_info():
+    database = SQLDatabase(seed_database(rows=200))
+    descriptor = SchemaDescriptor(database._engine)
+    assert estimate_tokens(descriptor.get_table_info()) <= descriptor.max_tokens
+    comparison = descriptor.compare(database)
+    assert comparison["descriptor_tokens"] < comparison["table_info_tokens"]
@@ -0,0 +1,65 @@
+import pytest
+
+from chain.SQLValidator import SQLParseError, SQLValidationError, validate_sql
+
+ALLOWED = ["experience_raw"]
+
+
+def validate(sql, **kwargs):
+    return validate_sql(sql, ALLOWED, max_rows=5, **kwargs)
+
+
+@pytest.mark.parametrize(
+    "sql",
+    [
+        "SELECT * FROM experience_raw",
+        "SELECT * FROM (SELECT * FROM experience_raw) AS e",
+        "WITH upcoming AS (SELECT * FROM experience_raw) SELECT * FROM upcoming",
+        "WITH a AS (SELECT * FROM experience_raw), b AS (SELECT * FROM a) SELECT * FROM b",
+        "SELECT * FROM landing.experience_raw",
+    ],
+)
+def test_allows_queries_over_allowed_tables(sql):
+    assert validate(sql, allowed_qualifiers=["landing"])
+
+
+def test_clamps_limit():
+    assert validate("SELECT * FROM experience_raw LIMIT 100").endswith("LIMIT 5")
+
+
+@pytest.mark.parametrize(
+    "sql",
+    [
+        "SELECT * FROM TABLE(INFORMATION_SCHEMA.QUERY_HISTORY())",
+        "SELECT * FROM TABLE(RESULT_SCAN(LAST_QUERY_ID()))",
+        "SELECT * FROM experience_raw, TABLE(FLATTEN(input => experience_raw.tags))",
+        "SELECT f.value FROM experience_raw, LATERAL FLATTEN(input => experience_raw.tags) f",
+        "SELECT * FROM experience_raw JOIN LATERAL (SELECT 1) AS x ON TRUE",
+        "SELECT * FROM GENERATOR(ROWCOUNT => 10)",
+        "SELECT SYSTEM$CLUSTERING_INFORMATION('experience_raw')",
+        "SELECT * FROM experience_raw WHERE business_name IN "
+        "(SELECT table_name FROM information_schema.tables)",
+        "SELECT * FROM users",
+        "SELECT * FROM other_db.secret.experience_raw",
+        "WITH experience_raw AS (SELECT * FROM users) SELECT * FROM experience_raw",
+        "SELECT * FROM experience_raw; DROP TABLE experience_raw",
+        "DELETE FROM experience_raw",
+    ],
+)
+def test_rejects_other_sources(sql):
+    with pytest.raises(SQLValidationError) as excinfo:
+        validate(sql)
+    assert not isinstance(excinfo.value, SQLParseError)
+
+
+@pytest.mark.parametrize("sql", ["SHOW TABLES", "CALL cleanup()", "USE DATABASE other"])
+def test_refuses_statements_that_parse(sql):
+    with pytest.raises(SQLValidationError) as excinfo:
+        validate(sql)
+    assert not isinstance(excinfo.value, SQLParseError)
+
+
+@pytest.mark.parametrize("sql", ["selec * form experience_raw", "Sure! Here is the SQL"])
+def test_garbled_sql_is_a_parse_error(sql):
+    with pytest.raises(SQLParseError):
+        validate(sql)